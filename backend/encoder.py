@@ -1,10 +1,11 @@
-from typing import List
+from typing import List, Tuple
 
 from backend.cpu_instr import ISAInstruction
 
+EncodedWord = Tuple[int, int]  # (word, imm)
 
 class Encoder:
-    def encode(self, instr: ISAInstruction):
+    def encode(self, instr: ISAInstruction) -> EncodedWord:
         word = (
             (instr.dec_op << 13) |
             (instr.op << 9) |
@@ -14,7 +15,7 @@ class Encoder:
         )
         return word, instr.imm
 
-    def encode_program(self, lowered_program: List):
+    def encode_program(self, lowered_program: List) -> List[EncodedWord]:
         encoded_program = []
         for command in lowered_program:
              encoded_program.append(self.encode(command))
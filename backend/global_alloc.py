@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Set, Tuple
+
+from backend.isa import Register
+from ir import (ProgrammIRInstruction, IRInstruction, IRSlot, IRTemp, CopyIRInstruction, LoadIRInstruction,
+                StoreIRInstruction, TempLiveness, build_cfg, max_temp_id, rename_uses, solve)
+
+import logging
+logger = logging.getLogger('Global Registers')
+
+# Registers for temps live across blocks, taken in this order. The rest are left to the
+# block-local temps of the register allocator.
+GLOBAL_REGISTERS: Tuple[Register, ...] = (Register.R5, Register.R4, Register.R3)
+
+
+@dataclass
+class GlobalTemp:
+    temp: int
+    # Reads and writes, each weighted by 10 ** loop depth
+    weight: int = 0
+    # Temps live where this one is written, or live where they are written
+    neighbours: Set[int] = field(default_factory=set)
+    # Temps this one is copied from or to
+    partners: List[int] = field(default_factory=list)
+
+
+# Gives the temps that outlive their block (the values of variables once the program is
+# in SSA form, and the copies that replaced its phis) a register each for the whole
+# program, so jumps and branches need no fix-up code. Two of them share a register unless
+# one is written where the other is live (Chaitin's interference, found by walking each
+# block backwards from its live-out set), and a copy between two that do not interfere
+# takes the register of the other side and emits nothing.
+#
+# Colouring goes by weight, heaviest first. A temp left without a register goes to
+# memory: the IR is rewritten to store it to a new slot after each write and load it
+# before each read, like the variables were before SSA, and it becomes block-local.
+class GlobalRegisterAssigner:
+    def __init__(self,
+                 program: ProgrammIRInstruction,
+                 slot_base: int,
+                 registers: Tuple[Register, ...] = GLOBAL_REGISTERS):
+        self.program = program
+        self.slot_base = slot_base
+        self.registers = registers
+
+    def assign(self) -> Tuple[ProgrammIRInstruction, Dict[int, Register]]:
+        logger.info('Assigning registers to temps live across blocks')
+        temps = self.interference()
+        if not temps:
+            return self.program, {}
+        homes, spilled = self.colour(temps)
+        logger.info('%s temps in registers, %s in memory', len(homes), len(spilled))
+        if not spilled:
+            return self.program, homes
+        return self.spill(spilled), homes
+
+    def global_temps(self, liveness: TempLiveness) -> Set[int]:
+        # Temps read outside the block defining them, and temps written more than once
+        temps = set(liveness.members)
+        defined: Set[int] = set()
+        for instr in self.program.instructions:
+            for temp in instr.defined_temps():
+                if temp.id in defined:
+                    temps.add(temp.id)
+                defined.add(temp.id)
+        return temps
+
+    def interference(self) -> Dict[int, GlobalTemp]:
+        cfg = build_cfg(self.program)
+        liveness = TempLiveness(cfg)
+        global_ids = self.global_temps(liveness)
+        if not global_ids:
+            return {}
+        live_out = solve(liveness).block_out
+        depths = cfg.loop_depths()
+        temps = {temp_id: GlobalTemp(temp=temp_id) for temp_id in global_ids}
+        instructions = self.program.instructions
+        for block in cfg.blocks:
+            weight = 10 ** depths[block.index]
+            # Temps that are not live across blocks only join once read
+            live = set(liveness.temps(live_out[block.index]))
+            for position in range(block.end - 1, block.start - 1, -1):
+                instr = instructions[position]
+                copied = None
+                if type(instr) is CopyIRInstruction and instr.src.id in temps and instr.dst.id in temps:
+                    copied = instr.src.id
+                    temps[instr.src.id].partners.append(instr.dst.id)
+                    temps[instr.dst.id].partners.append(instr.src.id)
+                for temp in instr.defined_temps():
+                    node = temps.get(temp.id)
+                    if node is None:
+                        continue
+                    node.weight += weight
+                    for other in live:
+                        # The source of a copy holds the same value, so it may share
+                        if other != temp.id and other != copied:
+                            node.neighbours.add(other)
+                            temps[other].neighbours.add(temp.id)
+                    live.discard(temp.id)
+                for temp in instr.used_temps():
+                    node = temps.get(temp.id)
+                    if node is not None:
+                        node.weight += weight
+                        live.add(temp.id)
+        return temps
+
+    def colour(self, temps: Dict[int, GlobalTemp]) -> Tuple[Dict[int, Register], List[int]]:
+        homes: Dict[int, Register] = {}
+        spilled: List[int] = []
+        for node in sorted(temps.values(), key=lambda node: (-node.weight, node.temp)):
+            taken = {homes[other] for other in node.neighbours if other in homes}
+            reg = None
+            for partner in node.partners:
+                if homes.get(partner) is not None and homes[partner] not in taken:
+                    reg = homes[partner]
+                    break
+            if reg is None:
+                reg = next((reg for reg in self.registers if reg not in taken), None)
+            if reg is None:
+                spilled.append(node.temp)
+            else:
+                homes[node.temp] = reg
+        return homes, spilled
+
+    def spill(self, spilled: List[int]) -> ProgrammIRInstruction:
+        program = self.program
+        slots: Dict[int, IRSlot] = {}
+        for number, temp_id in enumerate(sorted(spilled)):
+            slots[temp_id] = IRSlot.of(self.slot_base + number, f'%t{temp_id}')
+        next_temp = max_temp_id(program) + 1
+        result: List[IRInstruction] = []
+        for instr in program.instructions:
+            if type(instr) is CopyIRInstruction and (instr.src.id in slots or instr.dst.id in slots):
+                # Straight between memory and the other side
+                src_slot, dst_slot = slots.get(instr.src.id), slots.get(instr.dst.id)
+                src = instr.src
+                if src_slot is not None:
+                    if dst_slot is None:
+                        result.append(LoadIRInstruction(src=src_slot, dst=instr.dst))
+                        continue
+                    src = IRTemp(next_temp)
+                    next_temp += 1
+                    result.append(LoadIRInstruction(src=src_slot, dst=src))
+                result.append(StoreIRInstruction(src=src, dst=dst_slot))
+                continue
+            loaded: Dict[int, IRTemp] = {}
+            for temp in instr.used_temps():
+                slot = slots.get(temp.id)
+                if slot is not None and temp.id not in loaded:
+                    loaded[temp.id] = IRTemp(next_temp)
+                    next_temp += 1
+                    result.append(LoadIRInstruction(src=slot, dst=loaded[temp.id]))
+            if loaded:
+                instr = rename_uses(instr, lambda temp: loaded.get(temp.id, temp))
+            store = None
+            for temp in instr.defined_temps():
+                slot = slots.get(temp.id)
+                if slot is not None:
+                    value = IRTemp(next_temp)
+                    next_temp += 1
+                    instr = replace(instr, dst=value)
+                    store = StoreIRInstruction(src=value, dst=slot)
+            result.append(instr)
+            if store is not None:
+                result.append(store)
+        return ProgrammIRInstruction(instructions=result, slots=list(program.slots) + list(slots.values()))
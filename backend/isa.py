@@ -67,4 +67,52 @@ class MemOp(IntEnum):
 
 class CallRetOp(IntEnum):
     CALL = 0b0100
-    RET  = 0b0101
\ No newline at end of file
+    RET  = 0b0101
+
+
+# Operators of the language to the ALU operations and branch conditions implementing
+# them. Operators missing from ALU_OP_MAP are lowered as ADD. 'mulh', the high word of a
+# product, is not in the language: only ir.strength produces it.
+ALU_OP_MAP = {
+    '+': ALUOp.ADD,
+    '-': ALUOp.SUB,
+    '*': ALUOp.MUL,
+    '/': ALUOp.DIV,
+    '&': ALUOp.AND,
+    '|': ALUOp.OR,
+    '^': ALUOp.XOR,
+    '<<': ALUOp.SHL,
+    '>>': ALUOp.SHR,
+    '%': ALUOp.DIVH,
+    'mulh': ALUOp.MULH
+}
+
+BRANCH_OP_MAP = {
+    '==': BranchOp.BEQ,
+    '!=': BranchOp.BNE,
+    '>=': BranchOp.BGE,
+    '<=': BranchOp.BLE,
+    '>':  BranchOp.BGT,
+    '<':  BranchOp.BLT
+}
+
+# Estimated cycles of each ALU operation: one for the single-cycle operations, more for
+# the multiplier and the iterative divider. Only used to weigh rewrites against each
+# other (ir.strength), never by the simulators.
+ALU_CYCLES = {
+    ALUOp.ADD: 1,
+    ALUOp.SUB: 1,
+    ALUOp.AND: 1,
+    ALUOp.OR: 1,
+    ALUOp.NOT: 1,
+    ALUOp.XOR: 1,
+    ALUOp.SHL: 1,
+    ALUOp.SHR: 1,
+    ALUOp.MUL: 4,
+    ALUOp.MULH: 4,
+    ALUOp.DIV: 16,
+    ALUOp.DIVH: 16,
+    ALUOp.MOV: 1,
+    ALUOp.ROL: 1,
+    ALUOp.ROR: 1
+}
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+from ir import ProgrammIRInstruction, PackedProgram, StoreIRInstruction, IRTemp
+from ir.instructions import BranchIRInstruction, JumpIRInstruction, LabelIRInstruction
+from ir.soa import NO_TEMP, OP_STORE, OP_LABEL, OP_JUMP, OP_BRANCH
+
+import logging
+logger = logging.getLogger('LiveIntervals')
+
+# next_use of a temp that is not read again
+NEVER = 1 << 62
+
+_BOUNDARIES = (LabelIRInstruction, JumpIRInstruction, BranchIRInstruction)
+_PACKED_BOUNDARIES = (OP_LABEL, OP_JUMP, OP_BRANCH)
+
+
+# Lifetime of one temp in IR instruction positions: defined at start, read at each of
+# uses (ascending; a temp read twice by one instruction appears twice)
+@dataclass
+class LiveInterval:
+    __slots__ = ('temp', 'start', 'uses')
+    temp: int
+    start: int
+    uses: List[int]
+
+    @property
+    def end(self) -> int:
+        return self.uses[-1] if self.uses else self.start
+
+    def next_use(self, position: int) -> int:
+        # First use at or after position; past the end when there is none
+        index = bisect_left(self.uses, position)
+        return self.uses[index] if index < len(self.uses) else NEVER
+
+
+@dataclass
+class LiveIntervals:
+    intervals: Dict[int, LiveInterval] = field(default_factory=dict)
+    # Temps read by the instruction at each position
+    operands: List[List[int]] = field(default_factory=list)
+    # Temps a store writes to a variable slot that still holds them at their last read,
+    # as temp -> (slot, position of the store): from there on a spill can reload them
+    # from the slot instead of storing them again
+    memory_homes: Dict[int, Tuple[int, int]] = field(default_factory=dict)
+
+
+# Collects LiveIntervals.memory_homes in one pass: store and boundary are called in
+# program order, boundary at every label, jump and branch. Past the end of its block a
+# slot may have been written on another path, so it is only trusted up to there.
+class MemoryHomes:
+    def __init__(self):
+        # First store of each temp, as (slot, position)
+        self.candidates: Dict[int, Tuple[int, int]] = {}
+        # Position of the next store to that slot, or of the end of its block
+        self.overwritten: Dict[int, int] = {}
+        # Temp last stored to each slot in the current block
+        self.holding: Dict[int, int] = {}
+
+    def store(self, temp_id: int, slot_index: int, position: int):
+        previous = self.holding.get(slot_index)
+        if previous is not None:
+            self.leave(previous, slot_index, position)
+        self.holding[slot_index] = temp_id
+        if temp_id not in self.candidates:
+            self.candidates[temp_id] = (slot_index, position)
+
+    def boundary(self, position: int):
+        for slot_index, temp_id in self.holding.items():
+            self.leave(temp_id, slot_index, position)
+        self.holding.clear()
+
+    def leave(self, temp_id: int, slot_index: int, position: int):
+        # Only the slot of the first store counts, and only its first overwrite
+        if self.candidates[temp_id][0] == slot_index and temp_id not in self.overwritten:
+            self.overwritten[temp_id] = position
+
+    def homes(self, intervals: Dict[int, LiveInterval]) -> Dict[int, Tuple[int, int]]:
+        # The slot must still hold the temp at its last read
+        return {temp_id: home for temp_id, home in self.candidates.items()
+                if intervals[temp_id].end < self.overwritten.get(temp_id, NEVER)}
+
+
+class LiveIntervalAnalyzer:
+    def __init__(self,
+                 program: ProgrammIRInstruction | PackedProgram):
+        self.program = program
+
+    def analyze(self) -> LiveIntervals:
+        logger.info('Computing live intervals')
+        if isinstance(self.program, PackedProgram):
+            return self.analyze_packed()
+        result = LiveIntervals()
+        intervals = result.intervals
+        memory = MemoryHomes()
+        for position, instruction in enumerate(self.program.instructions):
+            instruction_type = type(instruction)
+            if instruction_type is StoreIRInstruction:
+                if type(instruction.src) is IRTemp:
+                    memory.store(instruction.src.id, instruction.dst.index, position)
+            elif instruction_type in _BOUNDARIES:
+                memory.boundary(position)
+            used = [temp.id for temp in instruction.used_temps()]
+            result.operands.append(used)
+            for temp_id in used:
+                interval = intervals.get(temp_id)
+                if interval is None:
+                    # Read before its first write in program order: a temp of
+                    # backend.global_alloc, live around a loop
+                    interval = intervals[temp_id] = LiveInterval(temp=temp_id, start=position, uses=[])
+                interval.uses.append(position)
+            for temp in instruction.defined_temps():
+                if temp.id not in intervals:
+                    # Copies out of SSA write the same temp more than once
+                    intervals[temp.id] = LiveInterval(temp=temp.id, start=position, uses=[])
+        result.memory_homes = memory.homes(intervals)
+        return result
+
+    def analyze_packed(self) -> LiveIntervals:
+        program = self.program
+        result = LiveIntervals()
+        intervals = result.intervals
+        memory = MemoryHomes()
+        for position in range(len(program)):
+            opcode = program.opcodes[position]
+            if opcode == OP_STORE:
+                memory.store(program.src1[position], program.imm[position], position)
+            elif opcode in _PACKED_BOUNDARIES:
+                memory.boundary(position)
+            used = [temp_id for temp_id in (program.src1[position], program.src2[position]) if temp_id != NO_TEMP]
+            result.operands.append(used)
+            for temp_id in used:
+                intervals[temp_id].uses.append(position)
+            dst = program.dst[position]
+            if dst != NO_TEMP:
+                intervals[dst] = LiveInterval(temp=dst, start=position, uses=[])
+        result.memory_homes = memory.homes(intervals)
+        return result
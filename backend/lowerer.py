@@ -1,12 +1,20 @@
+from __future__ import annotations
+
 from os import cpu_count
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 from backend.cpu_instr import ISACalcImm, ISACalcReg, ISAMemLoad, ISAMemStore, ISABranch
-from backend.isa import Register, ALUOp, MemOp, BranchOp
+from backend.isa import Register, ALUOp, MemOp, BranchOp, ALU_OP_MAP, BRANCH_OP_MAP
+from backend.global_alloc import GlobalRegisterAssigner
 from backend.labelalloc import LabelAllocator
-from backend.regalloc import RegisterAllocator
+from backend.live_intervals import LiveIntervalAnalyzer
+from backend.peephole import PeepholeStats, optimize_peephole
+from backend.regalloc import REGISTER_ALLOCATORS
 from backend.temp_usage_analyzer import TempUsageAnalyzer
-from ir import ProgrammIRInstruction, ConstIRInstruction, LoadIRInstruction, StoreIRInstruction, BinOpIRInstruction, PrintIRInstruction, IRTemp, IRConst
+from common.tracing import tracer
+from common.visitor import Dispatcher
+from ir import ProgrammIRInstruction, ConstIRInstruction, LoadIRInstruction, StoreIRInstruction, BinOpIRInstruction, PrintIRInstruction, CopyIRInstruction, IRTemp, IRConst, PackedProgram
+from ir.soa import OPERATOR_NAMES, NO_TEMP, OP_CONST, OP_LOAD, OP_STORE, OP_BINOP, OP_PRINT, OP_LABEL, OP_JUMP, OP_BRANCH
 
 import logging
 
@@ -15,98 +23,195 @@ from ir.instructions import BranchIRInstruction, JumpIRInstruction, LabelIRInstr
 logger = logging.getLogger('Lowering')
 
 
+def _unknown_instruction(lowerer, instr):
+    raise Exception(f'Cant visit {instr}. Not implimented')
+
+
 class Lowerer:
+    instruction_visitors = Dispatcher('Lowerer.visit_instruction', default=_unknown_instruction)
+
     def __init__(self,
-                 program: ProgrammIRInstruction):
+                 program: ProgrammIRInstruction | PackedProgram,
+                 register_allocator: str = 'linear_scan',
+                 spill_base: Optional[int] = None,
+                 cross_block_temps: bool = False,
+                 peephole: bool = False):
+        self.cpu_instructions: List = []
+        self.peephole = peephole
+        self.peephole_stats: Optional[PeepholeStats] = None
+        if spill_base is None:
+            # Spill slots go past every variable slot of the program
+            spill_base = max((slot.index for slot in program.slots), default=-1) + 1
+        # Registers of the temps live across blocks, which only programs that went through
+        # SSA (ir.ssa), loop promotion (ir.memopt) or value numbering (ir.gvn) have
+        self.homes: Dict[int, Register] = {}
+        if cross_block_temps:
+            with tracer.stage('global_registers'):
+                program, self.homes = GlobalRegisterAssigner(program, spill_base).assign()
+            spill_base = max(spill_base, max((slot.index for slot in program.slots), default=-1) + 1)
         self.program = program
-        self.register_allocator = RegisterAllocator()
+        self.register_allocator = REGISTER_ALLOCATORS[register_allocator](
+            self.cpu_instructions.append, LiveIntervalAnalyzer(program), spill_base)
         self.label_allocator = LabelAllocator()
         self.refcount = {}
-        self.cpu_instructions: List = []
         self.temp_usage_analyzer = TempUsageAnalyzer(self.program)
+        self.debug_enabled = logger.isEnabledFor(logging.DEBUG)
 
     def lower(self):
-        logger.info(f'Lowering program')
-        self.refcount = self.temp_usage_analyzer.analyze()
+        self.lower_instructions()
+        if self.peephole:
+            with tracer.stage('peephole'):
+                self.cpu_instructions, self.peephole_stats = optimize_peephole(
+                    self.cpu_instructions, self.label_allocator.labels)
+        self.patch_offset()
+        return self.cpu_instructions
+
+    def lower_instructions(self):
+        logger.info('Lowering program')
+        with tracer.stage('temp_usage'):
+            self.refcount = self.temp_usage_analyzer.analyze()
         self.register_allocator.set_refcount(self.refcount)
-        for instr in self.program.instructions:
-            logger.debug(f'Lowering instruction {instr}')
+        if self.homes:
+            self.register_allocator.pin(self.homes)
+        if isinstance(self.program, PackedProgram):
+            self.lower_packed(self.program)
+            return self.cpu_instructions
+        advance = self.register_allocator.advance
+        free_if_unread = self.register_allocator.free_if_unread
+        for position, instr in enumerate(self.program.instructions):
+            advance(position)
+            if self.debug_enabled:
+                logger.debug('Lowering instruction %s', instr)
             self.visit_instruction(instr)
             for temp in instr.used_temps():
                 self.register_allocator.consume(temp)
-        self.patch_offset()
+            for temp in instr.defined_temps():
+                free_if_unread(temp.id)
         return self.cpu_instructions
 
     def patch_offset(self):
-        logger.debug(f'Patching offset')
-        logger.info(f'Label table: {self.label_allocator.labels}')
+        logger.debug('Patching offset')
+        logger.info('Label table: %s', self.label_allocator.labels)
         for isa_instruction in self.cpu_instructions:
             if isinstance(isa_instruction, ISABranch):
                 isa_instruction.imm = self.label_allocator.labels[isa_instruction.imm]
 
+    def lower_packed(self, program: PackedProgram):
+        # Walks the columns directly; temps stay ints and no IR objects are created
+        opcodes, ops, dst, src1, src2, imm, label = (
+            program.opcodes, program.ops, program.dst, program.src1, program.src2, program.imm, program.label)
+        consume = self.register_allocator.consume_id
+        advance = self.register_allocator.advance
+        free_if_unread = self.register_allocator.free_if_unread
+        for i in range(len(opcodes)):
+            advance(i)
+            opcode = opcodes[i]
+            if opcode == OP_LOAD:
+                self.lower_load(imm[i], dst[i])
+            elif opcode == OP_BINOP:
+                self.lower_binop(OPERATOR_NAMES[ops[i]], src1[i], src2[i], imm[i], dst[i])
+            elif opcode == OP_STORE:
+                self.lower_store(src1[i], imm[i])
+            elif opcode == OP_CONST:
+                self.lower_const(imm[i], dst[i])
+            elif opcode == OP_LABEL:
+                self.lower_label(label[i])
+            elif opcode == OP_BRANCH:
+                self.lower_branch(OPERATOR_NAMES[ops[i]], src1[i], src2[i], label[i])
+            elif opcode == OP_JUMP:
+                self.lower_jump(label[i])
+            elif opcode == OP_PRINT:
+                self.lower_print(src1[i])
+            else:
+                _unknown_instruction(self, program.instruction(i))
+            if src1[i] != NO_TEMP:
+                consume(src1[i])
+            if src2[i] != NO_TEMP:
+                consume(src2[i])
+            if dst[i] != NO_TEMP:
+                free_if_unread(dst[i])
+
     def visit_instruction(self, instr):
-        if isinstance(instr, ConstIRInstruction):
-            self.visit_const(instr)
-        elif isinstance(instr, LoadIRInstruction):
-            self.visit_load(instr)
-        elif isinstance(instr, StoreIRInstruction):
-            self.visit_store(instr)
-        elif isinstance(instr, BinOpIRInstruction):
-            self.visit_binop(instr)
-        elif isinstance(instr, BranchIRInstruction):
-            self.visit_branch(instr)
-        elif isinstance(instr, JumpIRInstruction):
-            self.visit_jump(instr)
-        elif isinstance(instr, LabelIRInstruction):
-            self.visit_label(instr)
-        else:
-            raise Exception(f'Cant visit {instr}. Not implimented')
+        self.instruction_visitors(self, instr)
 
+    @instruction_visitors.register(LabelIRInstruction)
     def visit_label(self, label: LabelIRInstruction):
-        self.label_allocator.labels[label.label.index] = len(self.cpu_instructions)*2
+        self.lower_label(label.label.index)
 
+    @instruction_visitors.register(BranchIRInstruction)
     def visit_branch(self, branch: BranchIRInstruction):
-        left_reg = self.register_allocator.get_register(branch.left)
-        right_reg = self.register_allocator.get_register(branch.right)
-        op_map = {
-        '==': BranchOp.BEQ,
-        '!=': BranchOp.BNE,
-        '>=': BranchOp.BGE,
-        '<=': BranchOp.BLE,
-        '>':  BranchOp.BGT,
-        '<':  BranchOp.BLT
-    }
+        self.lower_branch(branch.op, branch.left.id, branch.right.id, branch.label.index)
+
+    @instruction_visitors.register(JumpIRInstruction)
+    def visit_jump(self, jump_ir: JumpIRInstruction):
+        self.lower_jump(jump_ir.label.index)
+
+    @instruction_visitors.register(ConstIRInstruction)
+    def visit_const(self, const_ir: ConstIRInstruction):
+        self.lower_const(const_ir.src.value, const_ir.dst.id)
+
+    @instruction_visitors.register(LoadIRInstruction)
+    def visit_load(self, load_ir: LoadIRInstruction):
+        self.lower_load(load_ir.src.index, load_ir.dst.id)
+
+    @instruction_visitors.register(StoreIRInstruction)
+    def visit_store(self, store_ir: StoreIRInstruction):
+        self.lower_store(store_ir.src.id, store_ir.dst.index)
+
+    @instruction_visitors.register(PrintIRInstruction)
+    def visit_print(self, print_ir: PrintIRInstruction):
+        self.lower_print(print_ir.value.id)
+
+    @instruction_visitors.register(CopyIRInstruction)
+    def visit_copy(self, copy_ir: CopyIRInstruction):
+        self.lower_copy(copy_ir.src.id, copy_ir.dst.id)
+
+    @instruction_visitors.register(BinOpIRInstruction)
+    def visit_binop(self, binop_ir: BinOpIRInstruction):
+        if isinstance(binop_ir.right, IRConst):
+            self.lower_binop(binop_ir.op, binop_ir.left.id, NO_TEMP, binop_ir.right.value, binop_ir.dst.id)
+        elif isinstance(binop_ir.right, IRTemp):
+            self.lower_binop(binop_ir.op, binop_ir.left.id, binop_ir.right.id, 0, binop_ir.dst.id)
+
+    # Core lowering on plain ints (temp ids, slot indexes, label indexes), shared by the
+    # dataclass visitors above and the packed path
+    def lower_label(self, label: int):
+        self.label_allocator.labels[label] = len(self.cpu_instructions)*2
+
+    def lower_branch(self, op: str, left: int, right: int, label: int):
+        left_reg = self.register_allocator.get_register_id(left)
+        right_reg = self.register_allocator.get_register_id(right)
         cpu_instr = ISABranch(
             rs1=left_reg,
             rs2=right_reg,
-            op=op_map[branch.op],
-            imm=branch.label.index
+            op=BRANCH_OP_MAP[op],
+            imm=label
         )
         self.cpu_instructions.append(cpu_instr)
 
-    def visit_jump(self, jump_ir: JumpIRInstruction):
+    def lower_jump(self, label: int):
         cpu_instr = ISABranch(
             op=BranchOp.JUMP,
-            imm=jump_ir.label.index
+            imm=label
         )
         self.cpu_instructions.append(cpu_instr)
 
-    def visit_const(self, const_ir: ConstIRInstruction):
-        reg: Register = self.register_allocator.allocate(const_ir.dst)
+    def lower_const(self, value: int, dst: int):
+        reg: Register = self.register_allocator.allocate_id(dst)
         cpu_instr = ISACalcImm(
             op=ALUOp.MOV,
             rd=reg,
-            imm=const_ir.src.value
+            imm=value
         )
         self.cpu_instructions.append(cpu_instr)
 
-    def visit_load(self, load_ir: LoadIRInstruction):
-        reg: Register = self.register_allocator.allocate(load_ir.dst)
+    def lower_load(self, slot_index: int, dst: int):
+        reg: Register = self.register_allocator.allocate_id(dst)
         self.cpu_instructions.append(
             ISACalcImm(
                 op=ALUOp.MOV,
                 rd=Register.MAR,
-                imm=load_ir.src.index
+                imm=slot_index
             )
         )
         self.cpu_instructions.append(
@@ -116,13 +221,13 @@ class Lowerer:
             )
         )
 
-    def visit_store(self, store_ir: StoreIRInstruction):
-        src_reg: Register = self.register_allocator.get_register(store_ir.src)
+    def lower_store(self, src: int, slot_index: int):
+        src_reg: Register = self.register_allocator.get_register_id(src)
         self.cpu_instructions.append(
             ISACalcImm(
                 op=ALUOp.MOV,
                 rd=Register.MAR,
-                imm=store_ir.dst.index
+                imm=slot_index
             )
         )
         self.cpu_instructions.append(
@@ -132,39 +237,52 @@ class Lowerer:
             )
         )
 
+    def lower_print(self, value: int):
+        # Writing a register to IO outputs it. MOV takes its second operand, so the value
+        # goes in both source fields.
+        value_reg: Register = self.register_allocator.get_register_id(value)
+        self.cpu_instructions.append(
+            ISACalcReg(
+                op=ALUOp.MOV,
+                rs1=value_reg,
+                rs2=value_reg,
+                rd=Register.IO
+            )
+        )
 
-    def visit_binop(self, binop_ir: BinOpIRInstruction):
-        # Map string operations to ALUOp
-        op_map = {
-            '+': ALUOp.ADD,
-            '-': ALUOp.SUB,
-            '*': ALUOp.MUL,
-            '/': ALUOp.DIV,
-            '&': ALUOp.AND,
-            '|': ALUOp.OR,
-            '^': ALUOp.XOR,
-            '<<': ALUOp.SHL,
-            '>>': ALUOp.SHR,
-            '%': ALUOp.DIVH
-        }
-        
-        alu_op = op_map.get(binop_ir.op, ALUOp.ADD)  # Default to ADD if op not found
-        dst_reg: Register = self.register_allocator.allocate(binop_ir.dst)
-        
-        # Check if we can use immediate mode
-        left_reg = self.register_allocator.get_register(binop_ir.left)
+    def lower_copy(self, src: int, dst: int):
+        # Nothing to emit when both temps got the same register
+        src_reg = self.register_allocator.get_register_id(src)
+        dst_reg: Register = self.register_allocator.allocate_id(dst)
+        if dst_reg != src_reg:
+            self.cpu_instructions.append(
+                ISACalcReg(
+                    op=ALUOp.MOV,
+                    rs1=src_reg,
+                    rs2=src_reg,
+                    rd=dst_reg
+                )
+            )
 
-        if isinstance(binop_ir.right, IRConst):
+    def lower_binop(self, op: str, left: int, right: int, right_imm: int, dst: int):
+        # right is NO_TEMP when the right operand is the immediate right_imm
+        alu_op = ALU_OP_MAP.get(op, ALUOp.ADD)  # Default to ADD if op not found
+        # Operands first: fetching them may reload a spilled temp, and the destination may
+        # then take the register of an operand read here for the last time
+        left_reg = self.register_allocator.get_register_id(left)
+        right_reg = self.register_allocator.get_register_id(right) if right != NO_TEMP else None
+        dst_reg: Register = self.register_allocator.allocate_id(dst)
+
+        if right == NO_TEMP:
             self.cpu_instructions.append(
                 ISACalcImm(
                     op=alu_op,
                     rs1=left_reg,
                     rd=dst_reg,
-                    imm=binop_ir.right.value
+                    imm=right_imm
                 )
             )
-        elif isinstance(binop_ir.right, IRTemp):
-            right_reg = self.register_allocator.get_register(binop_ir.right)
+        else:
             self.cpu_instructions.append(
                 ISACalcReg(
                     op=alu_op,
@@ -0,0 +1,346 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+from backend.cpu_instr import ISAInstruction, ISACalcImm, ISACalcReg, ISAMemLoad, ISAMemStore, ISABranch
+from backend.isa import ALUOp, BranchOp, Register
+from common.tracing import tracer
+from sim.alu import ALU_FUNCTIONS, MASK
+
+import logging
+logger = logging.getLogger('Peephole')
+
+MAR = Register.MAR
+IO = Register.IO
+
+# ALU operations whose operands may be swapped, so a constant on the left can become the
+# immediate
+COMMUTATIVE_OPS = frozenset((ALUOp.ADD, ALUOp.MUL, ALUOp.AND, ALUOp.OR, ALUOp.XOR))
+
+
+# What each register is known to hold at one point: a constant, and the value of the
+# memory slot it was last loaded from or stored to, while that slot is not written again.
+# MAR only ever gets constants, the slot addresses.
+class RegisterState:
+    def __init__(self):
+        self.consts: Dict[Register, int] = {}
+        self.slots: Dict[Register, int] = {}
+
+    def clear(self):
+        self.consts.clear()
+        self.slots.clear()
+
+    def holding(self, slot: int) -> Optional[Register]:
+        for reg, held in self.slots.items():
+            if held == slot:
+                return reg
+        return None
+
+    def write(self, reg: Register, const: Optional[int] = None, slot: Optional[int] = None):
+        if reg == IO:
+            return
+        self.consts.pop(reg, None)
+        self.slots.pop(reg, None)
+        if const is not None:
+            self.consts[reg] = const
+        if slot is not None:
+            self.slots[reg] = slot
+
+    def apply(self, instr: ISAInstruction):
+        instr_type = type(instr)
+        if instr_type is ISACalcImm:
+            if instr.op == ALUOp.MOV:
+                self.write(instr.rd, const=instr.imm & MASK)
+            else:
+                self.write(instr.rd, const=self.result(instr.op, instr.rs1, instr.imm & MASK))
+        elif instr_type is ISACalcReg:
+            if instr.op == ALUOp.MOV and instr.rs2 != IO:
+                # A copy holds whatever its source held
+                self.write(instr.rd, const=self.consts.get(instr.rs2), slot=self.slots.get(instr.rs2))
+            elif IO in (instr.rs1, instr.rs2):
+                self.write(instr.rd)
+            else:
+                self.write(instr.rd, const=self.result(instr.op, instr.rs1, self.consts.get(instr.rs2)))
+        elif instr_type is ISAMemLoad:
+            self.write(instr.rd, slot=self.consts.get(MAR))
+        elif instr_type is ISAMemStore:
+            slot = self.consts.get(MAR)
+            if slot is None:
+                self.slots.clear()
+                return
+            for reg in [reg for reg, held in self.slots.items() if held == slot]:
+                del self.slots[reg]
+            if instr.rs1 != IO:
+                self.slots[instr.rs1] = slot
+        elif instr_type is ISABranch and instr.op == BranchOp.JUMP:
+            # What follows is only reached through its label
+            self.clear()
+
+    def result(self, op: ALUOp, left: Register, right: Optional[int]) -> Optional[int]:
+        # The value of left op right when both are known, computed like the simulators do
+        left_value = self.consts.get(left) if left != IO else None
+        if left_value is None or right is None or op not in ALU_FUNCTIONS:
+            return None
+        return ALU_FUNCTIONS[op](left_value, right)
+
+
+# Rewrites of one instruction given what the registers hold before it: None when the rule
+# does not apply, otherwise the instructions replacing it (none to drop it)
+Rewrite = Callable[[RegisterState, ISAInstruction], Optional[List[ISAInstruction]]]
+
+
+def forward_load(state: RegisterState, instr: ISAMemLoad) -> Optional[List[ISAInstruction]]:
+    # LOAD of a slot some register already holds: a MOV from it, or nothing
+    slot = state.consts.get(MAR)
+    holder = state.holding(slot) if slot is not None and instr.rd != IO else None
+    if holder is None:
+        return None
+    if holder == instr.rd:
+        return []
+    return [ISACalcReg(op=ALUOp.MOV, rs1=holder, rs2=holder, rd=instr.rd)]
+
+
+def constant_result(state: RegisterState, instr: ISAInstruction) -> Optional[List[ISAInstruction]]:
+    # An operation on known values: a MOV of the result
+    if instr.op == ALUOp.MOV or instr.rd == IO:
+        return None
+    if type(instr) is ISACalcImm:
+        value = state.result(instr.op, instr.rs1, instr.imm & MASK)
+    elif IO in (instr.rs1, instr.rs2):
+        return None
+    else:
+        value = state.result(instr.op, instr.rs1, state.consts.get(instr.rs2))
+    if value is None:
+        return None
+    return [ISACalcImm(op=ALUOp.MOV, rd=instr.rd, imm=value)]
+
+
+def immediate_operand(state: RegisterState, instr: ISACalcReg) -> Optional[List[ISAInstruction]]:
+    # A register operand holding a known constant: the immediate form, which leaves the
+    # MOV that put it there to dead_write when nothing else reads it
+    if IO in (instr.rs1, instr.rs2):
+        return None
+    right = state.consts.get(instr.rs2)
+    if instr.op == ALUOp.MOV:
+        return None if right is None else [ISACalcImm(op=ALUOp.MOV, rd=instr.rd, imm=right)]
+    if right is not None:
+        return [ISACalcImm(op=instr.op, rs1=instr.rs1, rd=instr.rd, imm=right)]
+    left = state.consts.get(instr.rs1)
+    if left is not None and instr.op in COMMUTATIVE_OPS:
+        return [ISACalcImm(op=instr.op, rs1=instr.rs2, rd=instr.rd, imm=left)]
+    return None
+
+
+def redundant_mar(state: RegisterState, instr: ISACalcImm) -> Optional[List[ISAInstruction]]:
+    # MOV MAR, slot while MAR already holds that slot
+    if instr.op == ALUOp.MOV and instr.rd == MAR and instr.rs1 != IO and state.consts.get(MAR) == instr.imm & MASK:
+        return []
+    return None
+
+
+def redundant_mov(state: RegisterState, instr: ISACalcImm) -> Optional[List[ISAInstruction]]:
+    # MOV of a constant the register already holds
+    if (instr.op == ALUOp.MOV and instr.rd not in (MAR, IO) and instr.rs1 != IO
+            and state.consts.get(instr.rd) == instr.imm & MASK):
+        return []
+    return None
+
+
+@dataclass(frozen=True)
+class PeepholeRule:
+    name: str
+    # Instruction classes the rule looks at
+    kinds: Tuple[type, ...]
+    rewrite: Rewrite
+
+
+# Tried in order on each instruction, each on what the ones before made of it
+RULES: Tuple[PeepholeRule, ...] = (
+    PeepholeRule('forward_load', (ISAMemLoad,), forward_load),
+    PeepholeRule('constant_result', (ISACalcImm, ISACalcReg), constant_result),
+    PeepholeRule('immediate_operand', (ISACalcReg,), immediate_operand),
+    PeepholeRule('redundant_mar', (ISACalcImm,), redundant_mar),
+    PeepholeRule('redundant_mov', (ISACalcImm,), redundant_mov),
+)
+
+# Hit counters of the two passes over the whole sequence after the rules
+DEAD_WRITE = 'dead_write'
+JUMP_TO_NEXT = 'jump_to_next'
+
+
+@dataclass
+class PeepholeStats:
+    hits: Dict[str, int] = field(default_factory=dict)
+    instructions_before: int = 0
+    instructions_after: int = 0
+
+    @property
+    def removed(self) -> int:
+        return self.instructions_before - self.instructions_after
+
+
+def register_bit(reg: Register) -> int:
+    # IO is not storage: reading it takes input and writing it outputs
+    return 0 if reg == IO else 1 << reg
+
+
+# Peephole optimization of the Lowerer's output, before patch_offset: branches still
+# carry label indexes and labels maps each to the byte offset of the instruction it marks,
+# which is kept up to date as instructions go.
+#
+# A forward pass tracks what the registers and MAR hold (RegisterState), forgotten at
+# every instruction a label marks, and runs each instruction through RULES. Then writes
+# no instruction reads are dropped, found by a backward liveness pass over the registers
+# in which only the reads of instructions that stay count, and last jumps and branches to
+# the instruction right after them. Nothing is live at the end of the program: what it
+# leaves is its output and memory.
+class PeepholeOptimizer:
+    def __init__(self,
+                 instructions: List[ISAInstruction],
+                 labels: Dict[int, int],
+                 rules: Tuple[PeepholeRule, ...] = RULES):
+        self.instructions = instructions
+        self.labels = labels
+        self.rules = rules
+        self.stats = PeepholeStats(hits={rule.name: 0 for rule in rules},
+                                   instructions_before=len(instructions))
+        self.stats.hits[DEAD_WRITE] = 0
+        self.stats.hits[JUMP_TO_NEXT] = 0
+
+    def run(self) -> List[ISAInstruction]:
+        logger.info('Peephole optimizing %s instructions', len(self.instructions))
+        instructions = self.rewrite(self.instructions)
+        instructions = self.remove_dead_writes(instructions)
+        instructions = self.remove_jumps_to_next(instructions)
+        stats = self.stats
+        stats.instructions_after = len(instructions)
+        logger.info('Peephole removed %s of %s instructions (%s)', stats.removed, stats.instructions_before,
+                    ', '.join(f'{name} {hits}' for name, hits in stats.hits.items()))
+        if tracer.enabled:
+            tracer.count('peephole.removed', stats.removed)
+            for name, hits in stats.hits.items():
+                tracer.count(f'peephole.{name}', hits)
+        return instructions
+
+    def label_positions(self) -> set:
+        return {offset // 2 for offset in self.labels.values()}
+
+    def move_labels(self, moved: List[int]):
+        # moved[position] is where the instruction at position (or the end) now is
+        for label, offset in self.labels.items():
+            self.labels[label] = moved[offset // 2] * 2
+
+    def rewrite(self, instructions: List[ISAInstruction]) -> List[ISAInstruction]:
+        hits = self.stats.hits
+        targets = self.label_positions()
+        state = RegisterState()
+        result: List[ISAInstruction] = []
+        moved: List[int] = []
+        for position, instr in enumerate(instructions):
+            moved.append(len(result))
+            if position in targets:
+                state.clear()
+            replacement = [instr]
+            for rule in self.rules:
+                if len(replacement) != 1 or type(replacement[0]) not in rule.kinds:
+                    continue
+                rewritten = rule.rewrite(state, replacement[0])
+                if rewritten is not None:
+                    hits[rule.name] += 1
+                    replacement = rewritten
+            for new_instr in replacement:
+                state.apply(new_instr)
+                result.append(new_instr)
+        moved.append(len(result))
+        self.move_labels(moved)
+        return result
+
+    def successors(self, instructions: List[ISAInstruction], position: int) -> Tuple[int, ...]:
+        instr = instructions[position]
+        if type(instr) is not ISABranch:
+            return (position + 1,)
+        target = self.labels[instr.imm] // 2
+        return (target,) if instr.op == BranchOp.JUMP else (target, position + 1)
+
+    @staticmethod
+    def effects(instr: ISAInstruction) -> Tuple[int, int, bool]:
+        # Registers read and written, and whether the instruction does nothing else. The
+        # simulators read an IO operand, taking input, even where the operation ignores it.
+        instr_type = type(instr)
+        if instr_type is ISACalcReg:
+            pure = instr.rd != IO and IO not in (instr.rs1, instr.rs2)
+            return register_bit(instr.rs1) | register_bit(instr.rs2), register_bit(instr.rd), pure
+        if instr_type is ISACalcImm:
+            reads = 0 if instr.op == ALUOp.MOV else register_bit(instr.rs1)
+            return reads, register_bit(instr.rd), IO not in (instr.rd, instr.rs1)
+        if instr_type is ISAMemLoad:
+            return register_bit(MAR), register_bit(instr.rd), instr.rd != IO
+        if instr_type is ISAMemStore:
+            return register_bit(instr.rs1) | register_bit(MAR), 0, False
+        if instr_type is ISABranch and instr.op != BranchOp.JUMP:
+            return register_bit(instr.rs1) | register_bit(instr.rs2), 0, False
+        return 0, 0, False
+
+    def remove_dead_writes(self, instructions: List[ISAInstruction]) -> List[ISAInstruction]:
+        count = len(instructions)
+        effects = [self.effects(instr) for instr in instructions]
+        successors = [self.successors(instructions, position) for position in range(count)]
+        # Registers live on entry to each position; the end has none
+        live_in = [0] * (count + 1)
+        changed = True
+        while changed:
+            changed = False
+            for position in range(count - 1, -1, -1):
+                live_out = 0
+                for successor in successors[position]:
+                    live_out |= live_in[successor]
+                reads, writes, pure = effects[position]
+                if pure and not writes & live_out:
+                    live = live_out
+                else:
+                    live = reads | (live_out & ~writes)
+                if live != live_in[position]:
+                    live_in[position] = live
+                    changed = True
+
+        result: List[ISAInstruction] = []
+        moved: List[int] = []
+        for position, instr in enumerate(instructions):
+            moved.append(len(result))
+            _, writes, pure = effects[position]
+            if pure:
+                live_out = 0
+                for successor in successors[position]:
+                    live_out |= live_in[successor]
+                if not writes & live_out:
+                    continue
+            result.append(instr)
+        moved.append(len(result))
+        self.stats.hits[DEAD_WRITE] += count - len(result)
+        self.move_labels(moved)
+        return result
+
+    def remove_jumps_to_next(self, instructions: List[ISAInstruction]) -> List[ISAInstruction]:
+        # Dropping one can bring the next jump right before its target too
+        while True:
+            result: List[ISAInstruction] = []
+            moved: List[int] = []
+            for position, instr in enumerate(instructions):
+                moved.append(len(result))
+                if type(instr) is ISABranch and self.labels[instr.imm] // 2 == position + 1:
+                    continue
+                result.append(instr)
+            moved.append(len(result))
+            removed = len(instructions) - len(result)
+            if not removed:
+                return instructions
+            self.stats.hits[JUMP_TO_NEXT] += removed
+            self.move_labels(moved)
+            instructions = result
+
+
+def optimize_peephole(instructions: List[ISAInstruction],
+                      labels: Dict[int, int]) -> Tuple[List[ISAInstruction], PeepholeStats]:
+    optimizer = PeepholeOptimizer(instructions, labels)
+    return optimizer.run(), optimizer.stats
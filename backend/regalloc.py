@@ -1,12 +1,22 @@
-from typing import List, Dict
+from __future__ import annotations
 
-from backend.isa import Register
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Set, Type
+
+from backend.cpu_instr import ISACalcImm, ISAInstruction, ISAMemLoad, ISAMemStore
+from backend.isa import ALUOp, MemOp, Register
+from backend.live_intervals import LiveIntervalAnalyzer, LiveIntervals
+from common.tracing import tracer
 from ir import IRTemp
 
 import logging
 logger = logging.getLogger('Register Allocator')
 
 
+# Refcount of pinned temps, which no number of reads brings to zero
+PINNED_REFCOUNT = 1 << 62
+
+
 class RegisterAllocator:
     def __init__(self):
         self.all_registers: List[Register] = [
@@ -21,6 +31,11 @@ class RegisterAllocator:
         self.temp_to_reg: Dict[int, Register] = {}
         self.reg_to_temp: Dict[Register, int] = {}
         self.refcount: Dict[int, int] = {}
+        # Temps holding one register for the whole program, see pin()
+        self.pinned: Dict[int, Register] = {}
+        # Checked once per instance: the per-temp debug messages below are otherwise the
+        # single largest cost of lowering when logging is off
+        self.debug_enabled = logger.isEnabledFor(logging.DEBUG)
 
     def reset(self):
         logger.info('Resetting registers')
@@ -28,53 +43,254 @@ class RegisterAllocator:
         self.temp_to_reg: Dict[int, Register] = {}
         self.reg_to_temp: Dict[Register, int] = {}
         self.refcount: Dict[int, int] = {}
+        self.pinned: Dict[int, Register] = {}
 
     def allocate(self, temp_ir: IRTemp) -> Register:
-        logger.debug(f'Allocating register for temp {temp_ir}')
-        if not self.is_allocated(temp_ir):
-            if self.free_registers:
-                reg_to_allocate = self.free_registers.pop()
-                self.temp_to_reg[temp_ir.id] = reg_to_allocate
-                self.reg_to_temp[reg_to_allocate] = temp_ir.id
-                logger.debug(f'Allocated register {reg_to_allocate}')
-            else:
-                raise Exception(f'There is no free registers. Cannot allocate.')
-        logger.info(f'For temp_id {temp_ir} register {self.temp_to_reg[temp_ir.id]} was allocated.')
-        return self.temp_to_reg[temp_ir.id]
+        return self.allocate_id(temp_ir.id)
 
     def free(self, temp_ir: IRTemp):
-        logger.debug(f'Free register for temp {temp_ir}')
-        if self.is_allocated(temp_ir):
-            reg_for_free = self.temp_to_reg[temp_ir.id]
-            self.reg_to_temp.pop(reg_for_free)
-            self.temp_to_reg.pop(temp_ir.id)
-            self.free_registers.append(reg_for_free)
-            logger.info(f'Free register {reg_for_free} was free.')
-        else:
-            raise Exception(f'This temp is no allocated. Cannot free.')
+        self.free_id(temp_ir.id)
 
     def set_refcount(self, refcount: Dict[int,int]):
         self.refcount = refcount
 
+    def pin(self, homes: Dict[int, Register]):
+        # Temps live across blocks get their register up front (backend.global_alloc).
+        # Those registers leave the free list, and the temps are never freed or spilled.
+        self.pinned = homes
+        pinned_registers = set(homes.values())
+        self.free_registers = [reg for reg in self.free_registers if reg not in pinned_registers]
+        for temp_id, reg in homes.items():
+            self.temp_to_reg[temp_id] = reg
+            self.reg_to_temp[reg] = temp_id
+            self.refcount[temp_id] = PINNED_REFCOUNT
+
+    def advance(self, position: int):
+        # Called with the IR position before each instruction is lowered
+        pass
+
     def consume(self, temp_ir: IRTemp):
-        logger.debug(f'Consume register for temp {temp_ir}')
-        if self.is_allocated(temp_ir):
-            self.refcount[temp_ir.id] -= 1
-            if self.refcount[temp_ir.id] == 0:
-                self.free(temp_ir)
-        else:
-            raise Exception(f'This temp is no allocated. Cannot consume.')
+        self.consume_id(temp_ir.id)
 
     def is_allocated(self, temp_ir: IRTemp):
-        if self.temp_to_reg.get(temp_ir.id, None) is not None:
-            return True
-        else:
-            return False
+        return temp_ir.id in self.temp_to_reg
 
     def get_register(self, temp_ir: IRTemp):
-        logger.debug(f'Get register for temp {temp_ir}')
-        if self.is_allocated(temp_ir):
-            logger.info(f'Get register for temp {temp_ir} was allocated.')
-            return self.temp_to_reg[temp_ir.id]
+        return self.get_register_id(temp_ir.id)
+
+    # The *_id variants work on plain temp ids and are what the packed lowering path calls
+    def allocate_id(self, temp_id: int) -> Register:
+        if self.debug_enabled:
+            logger.debug('Allocating register for temp %s', temp_id)
+        if temp_id not in self.temp_to_reg:
+            if not self.free_registers:
+                self.free_registers.append(self.out_of_registers())
+            reg_to_allocate = self.free_registers.pop()
+            self.temp_to_reg[temp_id] = reg_to_allocate
+            self.reg_to_temp[reg_to_allocate] = temp_id
+            if self.debug_enabled:
+                logger.debug('Allocated register %s', reg_to_allocate)
+            if tracer.enabled:
+                tracer.count('registers.allocated')
+                tracer.peak('registers.live', len(self.temp_to_reg))
+        if self.debug_enabled:
+            logger.debug('For temp_id %s register %s was allocated.', temp_id, self.temp_to_reg[temp_id])
+        return self.temp_to_reg[temp_id]
+
+    def free_id(self, temp_id: int):
+        if self.debug_enabled:
+            logger.debug('Free register for temp %s', temp_id)
+        if temp_id in self.temp_to_reg:
+            reg_for_free = self.temp_to_reg.pop(temp_id)
+            self.reg_to_temp.pop(reg_for_free)
+            self.free_registers.append(reg_for_free)
+            if self.debug_enabled:
+                logger.debug('Free register %s was free.', reg_for_free)
+        else:
+            raise Exception(f'This temp is no allocated. Cannot free.')
+
+    def consume_id(self, temp_id: int):
+        if self.debug_enabled:
+            logger.debug('Consume register for temp %s', temp_id)
+        if temp_id in self.temp_to_reg:
+            self.refcount[temp_id] -= 1
+            if self.refcount[temp_id] == 0:
+                self.free_id(temp_id)
         else:
-            raise Exception(f'Register is not allocated.')
\ No newline at end of file
+            self.consume_unallocated(temp_id)
+
+    def free_if_unread(self, temp_id: int):
+        # Called with the destination after its instruction is lowered: a temp nothing
+        # reads gives its register back at once instead of holding it until spilled
+        if temp_id in self.temp_to_reg and self.refcount.get(temp_id, 0) <= 0:
+            self.free_id(temp_id)
+
+    def get_register_id(self, temp_id: int) -> Register:
+        if self.debug_enabled:
+            logger.debug('Get register for temp %s', temp_id)
+        reg = self.temp_to_reg.get(temp_id)
+        if reg is None:
+            return self.unallocated_register(temp_id)
+        if self.debug_enabled:
+            logger.debug('Get register for temp %s was allocated.', temp_id)
+        return reg
+
+    # Reached only when a temp is not in a register or none is free; subclasses that spill
+    # handle these, so the common path above stays the same for every allocator
+    def out_of_registers(self) -> Register:
+        raise Exception(f'There is no free registers. Cannot allocate.')
+
+    def consume_unallocated(self, temp_id: int):
+        raise Exception(f'This temp is no allocated. Cannot consume.')
+
+    def unallocated_register(self, temp_id: int) -> Register:
+        raise Exception(f'Register is not allocated.')
+
+
+@dataclass
+class SpillStats:
+    spilled_temps: int = 0
+    stores: int = 0
+    reloads: int = 0
+    slots: int = 0
+
+
+# Linear scan over the live intervals of the IR, walked in instruction order.
+#
+# Without register pressure it hands out registers exactly like RegisterAllocator (LIFO
+# free list, destination allocated before the operands are released), so the code is
+# unchanged, and the live intervals are not even computed. When all six registers are
+# taken, a register is freed by spilling the live temp whose next use is farthest away
+# (Belady's heuristic): it is stored to a spill slot through MAR and reloaded into a free
+# register at its next use. A temp keeps one spill slot for its whole lifetime, and since
+# temps are assigned once, a temp that was reloaded can be evicted again without another
+# store. Operands of the instruction being lowered are never evicted, and a destination
+# that needs a register under pressure takes the one of an operand read for the last time
+# by that instruction. A temp already stored to a variable slot that keeps it until its
+# last read (LiveIntervals.memory_homes) is reloaded from there and needs no store.
+#
+# Spill slots are numbered from spill_base, past every variable slot, and reused once
+# their temp is dead. emit appends the spill code to the lowered program.
+class LinearScanAllocator(RegisterAllocator):
+    def __init__(self,
+                 emit: Callable[[ISAInstruction], None],
+                 live_interval_analyzer: LiveIntervalAnalyzer,
+                 spill_base: int = 0):
+        super().__init__()
+        self.emit = emit
+        self.live_interval_analyzer = live_interval_analyzer
+        self.live: Optional[LiveIntervals] = None
+        self.spill_base = spill_base
+        self.position = 0
+        self.spill_slot: Dict[int, int] = {}
+        self.free_spill_slots: List[int] = []
+        # Spilled temps whose spill slot is the variable slot they were stored to
+        self.homed: Set[int] = set()
+        self.stats = SpillStats()
+
+    def advance(self, position: int):
+        self.position = position
+
+    def live_intervals(self) -> LiveIntervals:
+        if self.live is None:
+            with tracer.stage('live_intervals'):
+                self.live = self.live_interval_analyzer.analyze()
+        return self.live
+
+    def out_of_registers(self) -> Register:
+        return self.take_register(for_result=True)
+
+    def unallocated_register(self, temp_id: int) -> Register:
+        slot = self.spill_slot.get(temp_id)
+        if slot is None:
+            return super().unallocated_register(temp_id)
+        if not self.free_registers:
+            self.free_registers.append(self.take_register(for_result=False))
+        reg = self.allocate_id(temp_id)
+        self.emit_slot_access(slot)
+        self.emit(ISAMemLoad(op=MemOp.LOAD, rd=reg))
+        self.stats.reloads += 1
+        if tracer.enabled:
+            tracer.count('registers.reloads')
+        return reg
+
+    def consume_unallocated(self, temp_id: int):
+        # In memory only, or its register went to the result of this instruction. The spill
+        # slot of a dead temp is reclaimed when the next slot is needed.
+        if temp_id not in self.spill_slot and self.refcount.get(temp_id, 0) <= 0:
+            super().consume_unallocated(temp_id)
+        self.refcount[temp_id] -= 1
+
+    def take_register(self, for_result: bool) -> Register:
+        operands = self.live_intervals().operands[self.position]
+        if for_result:
+            for temp_id in operands:
+                if temp_id in self.temp_to_reg and self.refcount.get(temp_id, 0) == operands.count(temp_id):
+                    return self.release(temp_id)
+        intervals = self.live.intervals
+        victim: Optional[int] = None
+        victim_distance = -1
+        for temp_id in self.temp_to_reg:
+            if temp_id in operands or temp_id in self.pinned:
+                continue
+            distance = intervals[temp_id].next_use(self.position)
+            if distance > victim_distance:
+                victim, victim_distance = temp_id, distance
+        if victim is None:
+            return super().out_of_registers()
+        return self.spill(victim)
+
+    def release(self, temp_id: int) -> Register:
+        reg = self.temp_to_reg.pop(temp_id)
+        self.reg_to_temp.pop(reg)
+        return reg
+
+    def spill(self, temp_id: int) -> Register:
+        if self.debug_enabled:
+            logger.debug('Spilling temp %s at %s', temp_id, self.position)
+        reg = self.release(temp_id)
+        if temp_id not in self.spill_slot:
+            home = self.live_intervals().memory_homes.get(temp_id)
+            if home is not None and home[1] < self.position:
+                # Already stored to its variable, which holds it up to its last read
+                self.spill_slot[temp_id] = home[0]
+                self.homed.add(temp_id)
+                return reg
+            self.spill_slot[temp_id] = self.new_spill_slot()
+            self.emit_slot_access(self.spill_slot[temp_id])
+            self.emit(ISAMemStore(op=MemOp.STOR, rs1=reg))
+            self.stats.spilled_temps += 1
+            self.stats.stores += 1
+            if tracer.enabled:
+                tracer.count('registers.spills')
+        return reg
+
+    def new_spill_slot(self) -> int:
+        for temp_id, slot in list(self.spill_slot.items()):
+            if self.refcount.get(temp_id, 0) == 0 and temp_id not in self.homed:
+                del self.spill_slot[temp_id]
+                self.free_spill_slots.append(slot)
+        if self.free_spill_slots:
+            return self.free_spill_slots.pop()
+        self.stats.slots += 1
+        return self.spill_base + self.stats.slots - 1
+
+    def emit_slot_access(self, slot: int):
+        self.emit(ISACalcImm(op=ALUOp.MOV, rd=Register.MAR, imm=slot))
+
+
+# Baseline for measuring LinearScanAllocator: every temp is stored to its spill slot right
+# after it is computed and reloaded before every use, so registers hold values only within
+# one instruction.
+class SpillEverythingAllocator(LinearScanAllocator):
+    def advance(self, position: int):
+        for temp_id in list(self.temp_to_reg):
+            if temp_id not in self.pinned:
+                self.free_registers.append(self.spill(temp_id))
+        super().advance(position)
+
+
+REGISTER_ALLOCATORS: Dict[str, Type[LinearScanAllocator]] = {
+    'linear_scan': LinearScanAllocator,
+    'spill_all': SpillEverythingAllocator,
+}
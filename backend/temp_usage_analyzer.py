@@ -1,6 +1,9 @@
+from __future__ import annotations
+
 from typing import Dict
 
-from ir import ProgrammIRInstruction, IRTemp
+from ir import ProgrammIRInstruction, IRTemp, PackedProgram
+from ir.soa import NO_TEMP
 
 import logging
 logger = logging.getLogger('TempAnalyzer')
@@ -8,15 +11,28 @@ logger = logging.getLogger('TempAnalyzer')
 
 class TempUsageAnalyzer:
     def __init__(self,
-                 program: ProgrammIRInstruction):
+                 program: ProgrammIRInstruction | PackedProgram):
         self.refcount: Dict[int, int] = {}
         self.program = program
+        self.debug_enabled = logger.isEnabledFor(logging.DEBUG)
 
     def analyze(self) -> Dict[int, int]:
-        logger.info(f'Analyzing program')
+        logger.info('Analyzing program')
+        if isinstance(self.program, PackedProgram):
+            return self.analyze_packed()
         for instruction in self.program.instructions:
             values = instruction.used_temps()
             for value in values:
                 self.refcount[value.id] = self.refcount.get(value.id, 0) + 1
-                logger.debug(f'Usage for temp {value.id} now is {self.refcount[value.id]}')
+                if self.debug_enabled:
+                    logger.debug('Usage for temp %s now is %s', value.id, self.refcount[value.id])
         return self.refcount
+
+    def analyze_packed(self) -> Dict[int, int]:
+        # Every read of a temp is in src1 or src2, so counting the two columns is enough
+        refcount = self.refcount
+        for column in (self.program.src1, self.program.src2):
+            for temp_id in column:
+                if temp_id != NO_TEMP:
+                    refcount[temp_id] = refcount.get(temp_id, 0) + 1
+        return refcount
@@ -0,0 +1,35 @@
+import argparse
+import time
+
+from benchmarks.generator import generate
+from driver.compiler import CompileOptions, Compiler
+from ir.cfg import build_cfg
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Control flow graph, dominator and loop analysis time by program size')
+    arg_parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 50_000, 100_000])
+    arg_parser.add_argument('--shape', default='nested')
+    arg_parser.add_argument('--packed-ir', action='store_true')
+    args = arg_parser.parse_args()
+
+    compiler = Compiler(CompileOptions(packed_ir=args.packed_ir))
+    for size in args.sizes:
+        program = compiler.compile_stages(generate(args.shape, size)).ir_program
+        instructions = len(program) if args.packed_ir else len(program.instructions)
+
+        started = time.perf_counter()
+        cfg = build_cfg(program)
+        built = time.perf_counter()
+        cfg.immediate_dominators()
+        dominated = time.perf_counter()
+        loops = cfg.loops()
+        finished = time.perf_counter()
+
+        print(f'{args.shape:8} {instructions:>8} instructions {len(cfg.blocks):>7} blocks {len(loops):>6} loops  '
+              f'build {built - started:6.3f}s  dominators {dominated - built:6.3f}s  loops {finished - dominated:6.3f}s  '
+              f'{(finished - started) / instructions * 1e6:5.2f} us/instruction')
+
+
+if __name__ == '__main__':
+    main()
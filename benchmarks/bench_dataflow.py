@@ -0,0 +1,69 @@
+import argparse
+import time
+from typing import List, Set
+
+from benchmarks.generator import generate
+from driver.compiler import CompileOptions, Compiler
+from ir.cfg import ControlFlowGraph, build_cfg
+from ir.dataflow import ReachingDefinitions, SlotLiveness, TempLiveness, slot_effects, solve
+
+
+def set_slot_liveness(cfg: ControlFlowGraph) -> List[Set[int]]:
+    # Baseline: the same analysis with sets of slots, iterated round robin to a fixed point
+    effects = list(slot_effects(cfg.program))
+    use, define = [], []
+    for block in cfg.blocks:
+        block_use, block_define = set(), set()
+        for position in range(block.end - 1, block.start - 1, -1):
+            loaded, stored = effects[position]
+            if stored >= 0:
+                block_define.add(stored)
+                block_use.discard(stored)
+            elif loaded >= 0:
+                block_use.add(loaded)
+        use.append(block_use)
+        define.append(block_define)
+    at_exit = {slot.index for slot in cfg.program.slots}
+    live_in: List[Set[int]] = [set() for _ in cfg.blocks]
+    changed = True
+    while changed:
+        changed = False
+        for block in reversed(cfg.blocks):
+            live_out = set(at_exit) if not block.successors else set()
+            for successor in block.successors:
+                live_out |= live_in[successor]
+            value = use[block.index] | (live_out - define[block.index])
+            if value != live_in[block.index]:
+                live_in[block.index] = value
+                changed = True
+    return live_in
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Dataflow analysis time on large programs')
+    arg_parser.add_argument('--sizes', type=int, nargs='+', default=[4_000, 20_000])
+    arg_parser.add_argument('--shapes', nargs='+', default=['nested', 'many_vars'])
+    args = arg_parser.parse_args()
+
+    for shape in args.shapes:
+        for size in args.sizes:
+            program = Compiler(CompileOptions()).compile_stages(generate(shape, size)).ir_program
+            cfg, cfg_time = timed(build_cfg, program)
+            print(f'{shape:10} {len(program.instructions):>8} instructions {len(cfg.blocks):>7} blocks  '
+                  f'cfg {cfg_time:6.3f}s')
+            for problem_cls in (TempLiveness, SlotLiveness, ReachingDefinitions):
+                result, seconds = timed(lambda: solve(problem_cls(cfg)))
+                print(f'    {problem_cls.__name__:20} {seconds:7.3f}s  '
+                      f'{result.visits / max(1, len(cfg.blocks)):5.2f} visits per block')
+            _, seconds = timed(set_slot_liveness, cfg)
+            print(f'    {"SlotLiveness (sets)":20} {seconds:7.3f}s')
+
+
+if __name__ == '__main__':
+    main()
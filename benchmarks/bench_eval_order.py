@@ -0,0 +1,53 @@
+import argparse
+from typing import List
+
+from backend.live_intervals import LiveIntervalAnalyzer
+from benchmarks.generator import generate
+from common.tracing import tracer
+from driver.compiler import CompileOptions, Compiler
+
+
+def peak_live_temps(program) -> int:
+    # Most temps defined and still to be read at once, over all IR positions
+    live = LiveIntervalAnalyzer(program).analyze()
+    delta: List[int] = [0] * (len(live.operands) + 1)
+    for interval in live.intervals.values():
+        if interval.uses:
+            delta[interval.start] += 1
+            delta[interval.end] -= 1
+    peak = current = 0
+    for change in delta:
+        current += change
+        peak = max(peak, current)
+    return peak
+
+
+# Programs that fit in the six registers are the ones that compiled before spilling existed
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Register pressure with and without Sethi-Ullman operand order')
+    arg_parser.add_argument('--size', type=int, default=100)
+    arg_parser.add_argument('--programs', type=int, default=20, help='generated programs (seeds) per shape')
+    arg_parser.add_argument('--shapes', nargs='+', default=['pressure', 'balanced', 'wide', 'nested'])
+    args = arg_parser.parse_args()
+
+    for shape in args.shapes:
+        for reorder in (False, True):
+            compiler = Compiler(CompileOptions(reorder_operands=reorder))
+            peak = spills = without_spills = 0
+            for seed in range(args.programs):
+                tracer.enable()
+                try:
+                    result = compiler.compile_stages(generate(shape, args.size, seed))
+                finally:
+                    tracer.disable()
+                program_spills = tracer.counters.get('registers.spills', 0)
+                peak = max(peak, peak_live_temps(result.ir_program))
+                spills += program_spills
+                without_spills += program_spills == 0
+            order = 'sethi_ullman' if reorder else 'left_first'
+            print(f'{shape:10} {order:13} peak live temps {peak:>3}  spilled temps {spills:>7}  '
+                  f'fit in registers {without_spills}/{args.programs}')
+
+
+if __name__ == '__main__':
+    main()
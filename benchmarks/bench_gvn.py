@@ -0,0 +1,31 @@
+import argparse
+import time
+
+from benchmarks.bench_regalloc import memory_ops
+from benchmarks.generator import generate
+from driver.compiler import CompileOptions, compile
+from sim.translator import TranslatingSimulator
+
+
+# Code as built against code with repeated loads and operations reused
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Code size and run time with and without value numbering')
+    arg_parser.add_argument('--size', type=int, default=500)
+    arg_parser.add_argument('--shapes', nargs='+', default=['straight', 'balanced', 'wide', 'nested'])
+    args = arg_parser.parse_args()
+
+    for shape in args.shapes:
+        source = generate(shape, args.size)
+        for value_numbering in (False, True):
+            started = time.perf_counter()
+            words = compile(source, CompileOptions(value_numbering=value_numbering))
+            elapsed = time.perf_counter() - started
+            stats = TranslatingSimulator(words).run().stats
+            variant = 'numbered' if value_numbering else 'as built'
+            print(f'{shape:10} {variant:8} {len(words):>8} instructions  {memory_ops(words):>7} memory ops  '
+                  f'executed {stats.instructions:>9} instructions, {stats.memory_traffic:>8} memory ops  '
+                  f'compiled in {elapsed:.3f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+import argparse
+import gc
+import time
+import tracemalloc
+
+from backend.lowerer import Lowerer
+from benchmarks.bench_memory import make_program
+from frontend.lexer import Lexer
+from frontend.parser import Parser
+from frontend.symbol_table import SemanticAnalyzer
+from ir.builder import IRBuilder, PackedIRBuilder
+
+
+def measure(builder_cls, ast, table):
+    gc.collect()
+    tracemalloc.start()
+    program = builder_cls(symbol_table=table).build_program(ast)
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    builder_cls(symbol_table=table).build_program(ast)
+    build_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    Lowerer(program).lower()
+    lower_time = time.perf_counter() - started
+    return retained, build_time, lower_time
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='IRInstruction objects vs struct-of-arrays IR')
+    arg_parser.add_argument('--statements', type=int, default=100_000)
+    arg_parser.add_argument('--names', type=int, default=64)
+    args = arg_parser.parse_args()
+
+    ast = Parser(Lexer(make_program(args.statements, args.names)).token_stream()).parse_program()
+    analyzer = SemanticAnalyzer()
+    analyzer.visit(ast)
+
+    for name, builder_cls in (('objects', IRBuilder), ('packed', PackedIRBuilder)):
+        retained, build_time, lower_time = measure(builder_cls, ast, analyzer.table)
+        print(f'{name:8} IR {retained / 2**20:7.2f} MiB  build {build_time:6.3f}s  '
+              f'analyze+lower {lower_time:6.3f}s')
+
+
+if __name__ == '__main__':
+    main()
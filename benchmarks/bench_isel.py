@@ -0,0 +1,41 @@
+import argparse
+
+from backend.encoder import Encoder
+from backend.lowerer import Lowerer
+from benchmarks.bench_regalloc import memory_ops
+from benchmarks.generator import generate
+from frontend.lexer import Lexer
+from frontend.parser import Parser
+from frontend.symbol_table import SemanticAnalyzer
+from ir.builder import IRBuilder
+from ir.isel import select_instructions
+from sim.translator import TranslatingSimulator
+
+
+# IR as built against IR after instruction selection: code size, run time and the spills
+# register pressure costs
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Code size and spills with and without instruction selection')
+    arg_parser.add_argument('--size', type=int, default=500)
+    arg_parser.add_argument('--shapes', nargs='+', default=['straight', 'nested', 'balanced', 'pressure'])
+    args = arg_parser.parse_args()
+
+    for shape in args.shapes:
+        ast = Parser(Lexer(generate(shape, args.size)).token_stream()).parse_program()
+        analyzer = SemanticAnalyzer()
+        analyzer.visit(ast)
+        program = IRBuilder(symbol_table=analyzer.table).build_program(ast)
+        for select in (False, True):
+            selected = select_instructions(program)[0] if select else program
+            lowerer = Lowerer(selected)
+            words = Encoder().encode_program(lowered_program=lowerer.lower())
+            stats = TranslatingSimulator(words).run().stats
+            spills = lowerer.register_allocator.stats
+            variant = 'selected' if select else 'as built'
+            print(f'{shape:10} {variant:8} {len(words):>8} instructions  {memory_ops(words):>7} memory ops  '
+                  f'{spills.spilled_temps:>5} temps spilled  '
+                  f'executed {stats.instructions:>9} instructions, {stats.memory_traffic:>8} memory ops')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from frontend.lexer import Lexer
+
+SAMPLE = """// factorial
+var n = 6;
+var result = 1;
+while n > 1:{
+    var result = result * n;
+    var n = n - 1;
+}
+if result >= 720:{ var flag = result % 7 << 2; } else { var flag = ~result; }
+print result
+"""
+
+
+def make_source(size: int) -> str:
+    return SAMPLE * max(1, size // len(SAMPLE))
+
+
+def consume(tokens) -> int:
+    count = 0
+    for _ in tokens:
+        count += 1
+    return count
+
+
+def run_master_pattern(path: str) -> int:
+    with open(path, encoding='utf-8') as f:
+        return len(Lexer(f.read()).tokenize_master_pattern())
+
+
+def run_tokenize(path: str) -> int:
+    with open(path, encoding='utf-8') as f:
+        return len(Lexer(f.read()).tokenize())
+
+
+def run_streaming(path: str) -> int:
+    with Lexer.from_file(path) as lexer:
+        return consume(lexer.iter_tokens())
+
+
+def run_streaming_positions(path: str) -> int:
+    with Lexer.from_file(path) as lexer:
+        return consume(lexer.iter_positioned_tokens())
+
+
+CASES = [
+    ('master_pattern', run_master_pattern),
+    ('tokenize', run_tokenize),
+    ('stream mmap', run_streaming),
+    ('stream mmap +pos', run_streaming_positions),
+]
+
+
+def measure(fn, path: str, repeat: int):
+    best = float('inf')
+    tokens = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        tokens = fn(path)
+        best = min(best, time.perf_counter() - started)
+    tracemalloc.start()
+    fn(path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return tokens, best, peak
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Lexer throughput: master_pattern vs streaming fast path')
+    arg_parser.add_argument('--size-mb', type=float, nargs='+', default=[1, 4])
+    arg_parser.add_argument('--repeat', type=int, default=3)
+    args = arg_parser.parse_args()
+
+    for size_mb in args.size_mb:
+        with tempfile.NamedTemporaryFile('w', suffix='.leg', delete=False) as f:
+            f.write(make_source(int(size_mb * 1024 * 1024)))
+            path = f.name
+        try:
+            print(f'--- {os.path.getsize(path) / 1024 / 1024:.1f} MB')
+            baseline = None
+            for name, fn in CASES:
+                tokens, elapsed, peak = measure(fn, path, args.repeat)
+                rate = tokens / elapsed
+                baseline = baseline or rate
+                print(f'{name:18} {tokens:>10} tokens {rate / 1e6:6.2f} Mtok/s '
+                      f'x{rate / baseline:4.1f}  peak {peak / 1024 / 1024:8.2f} MB')
+        finally:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
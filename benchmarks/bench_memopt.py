@@ -0,0 +1,50 @@
+import argparse
+import time
+
+from benchmarks.bench_regalloc import memory_ops
+from benchmarks.generator import generate
+from driver.compiler import CompileOptions, compile
+from sim.translator import TranslatingSimulator
+
+FACTORIAL = '''var n = {trips};
+var result = 1;
+while n > 0:{{ var result = result * n; var n = n - 1; }}
+print result
+'''
+
+
+# Memory ops one more trip around the factorial loop costs: the difference between two
+# runs of different lengths, so the code around the loop cancels out
+def per_iteration(options: CompileOptions) -> float:
+    short, long = 10, 20
+    traffic = [TranslatingSimulator(compile(FACTORIAL.format(trips=trips), options)).run().stats.memory_traffic
+               for trips in (short, long)]
+    return (traffic[1] - traffic[0]) / (long - short)
+
+
+# Every variable access through memory against forwarded loads, dead stores removed and
+# loop variables kept in registers
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Memory traffic with and without load/store optimization')
+    arg_parser.add_argument('--size', type=int, default=500)
+    arg_parser.add_argument('--shapes', nargs='+', default=['nested', 'many_vars', 'straight', 'balanced'])
+    args = arg_parser.parse_args()
+
+    for optimize in (False, True):
+        variant = 'optimized' if optimize else 'memory'
+        print(f'factorial  {variant:9} {per_iteration(CompileOptions(optimize_memory=optimize)):.1f} memory ops per iteration')
+    for shape in args.shapes:
+        source = generate(shape, args.size)
+        for optimize in (False, True):
+            started = time.perf_counter()
+            words = compile(source, CompileOptions(optimize_memory=optimize))
+            elapsed = time.perf_counter() - started
+            stats = TranslatingSimulator(words).run().stats
+            variant = 'optimized' if optimize else 'memory'
+            print(f'{shape:10} {variant:9} {len(words):>8} instructions  {memory_ops(words):>7} memory ops  '
+                  f'executed {stats.instructions:>9} instructions, {stats.memory_traffic:>8} memory ops  '
+                  f'compiled in {elapsed:.3f}s')
+
+
+if __name__ == '__main__':
+    main()
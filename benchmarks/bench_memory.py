@@ -0,0 +1,61 @@
+import argparse
+import gc
+import random
+import tracemalloc
+
+from frontend.lexer import Lexer
+from frontend.parser import Parser
+from frontend.symbol_table import SemanticAnalyzer
+from ir.builder import IRBuilder
+
+OPERATORS = ['+', '-', '*', '&', '|', '^']
+
+
+def make_program(statements: int, names: int, seed: int = 0) -> str:
+    rnd = random.Random(seed)
+    lines = [f'var v{i} = {i};' for i in range(names)]
+    for _ in range(statements - names):
+        target = rnd.randrange(names)
+        left = f'v{rnd.randrange(names)}'
+        right = str(rnd.randrange(256)) if rnd.random() < 0.5 else f'v{rnd.randrange(names)}'
+        lines.append(f'var v{target} = {left} {rnd.choice(OPERATORS)} {right};')
+    return '\n'.join(lines) + '\n'
+
+
+def measure(build):
+    # Bytes still held by the result of build() and the peak while it ran
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, retained, peak
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Retained memory of tokens, AST and IR')
+    arg_parser.add_argument('--statements', type=int, default=100_000)
+    arg_parser.add_argument('--names', type=int, default=64)
+    args = arg_parser.parse_args()
+
+    source = make_program(args.statements, args.names)
+    tokens, tokens_retained, tokens_peak = measure(lambda: Lexer(source).token_stream())
+    ast, ast_retained, ast_peak = measure(lambda: Parser(tokens).parse_program())
+
+    analyzer = SemanticAnalyzer()
+    analyzer.visit(ast)
+
+    program, ir_retained, ir_peak = measure(lambda: IRBuilder(symbol_table=analyzer.table).build_program(ast))
+    ir = program.instructions
+
+    print(f'{args.statements} statements, {len(tokens)} tokens, {len(ir)} IR instructions')
+    for stage, retained, peak, count in (('tokens', tokens_retained, tokens_peak, len(tokens)),
+                                         ('ast', ast_retained, ast_peak, len(ast.statements)),
+                                         ('ir', ir_retained, ir_peak, len(ir))):
+        print(f'{stage:6} retained {retained / 2**20:8.2f} MiB  peak {peak / 2**20:8.2f} MiB  '
+              f'{retained / count:7.1f} B/item')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+import argparse
+import random
+import sys
+import time
+
+from frontend.ast_leg import BinaryOp, Number, VarRef
+from frontend.lexer import Lexer
+from frontend.parser import BINARY_PRECEDENCE, Parser, gc_paused
+from frontend.token_stream import KIND_TEXT, Kind
+
+OPERATORS = ['+', '-', '*', '/', '%', '&', '|', '^', '<<', '>>']
+
+
+class FlatParser(Parser):
+    # The previous single-level, recursive parse_expr/parse_term, kept as the baseline
+    def parse_expr(self):
+        left = self.parse_term()
+        kinds = self.kinds
+        while self.pos < len(kinds):
+            kind = kinds[self.pos]
+            if kind in BINARY_PRECEDENCE:
+                op = KIND_TEXT[kind]
+                self.pos += 1
+                right = self.parse_term()
+                left = BinaryOp(left, op, right)
+            else:
+                break
+        return left
+
+    def parse_term(self):
+        kind = self.kinds[self.pos]
+        if kind == Kind.NOT:
+            self.pos += 1
+            return BinaryOp(Number(0), '~', self.parse_term())
+        self.pos += 1
+        if kind == Kind.NUMBER:
+            return Number(int(self.tokens.text(self.pos - 1)))
+        return VarRef(self.tokens.text(self.pos - 1))
+
+
+def wide_expression(operands: int, seed: int = 0) -> str:
+    rnd = random.Random(seed)
+    parts = ['a']
+    for i in range(operands - 1):
+        parts.append(rnd.choice(OPERATORS))
+        parts.append(str(i % 100) if i % 3 else 'a')
+    return 'var a = 1;\nvar b = ' + ' '.join(parts) + ';\n'
+
+
+def not_chain(depth: int) -> str:
+    return 'var a = 1;\nvar b = ' + '~' * depth + 'a;\n'
+
+
+def measure(parser_cls, source: str):
+    tokens = Lexer(source).token_stream()
+    started = time.perf_counter()
+    try:
+        with gc_paused():
+            parser_cls(tokens).parse_program()
+    except RecursionError:
+        return len(tokens), None
+    return len(tokens), time.perf_counter() - started
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Expression parser scaling: precedence climbing vs flat recursive')
+    arg_parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    args = arg_parser.parse_args()
+
+    for shape, make in (('wide', wide_expression), ('~ chain', not_chain)):
+        for size in args.sizes:
+            source = make(size)
+            for name, parser_cls in (('flat', FlatParser), ('precedence', Parser)):
+                tokens, elapsed = measure(parser_cls, source)
+                if elapsed is None:
+                    print(f'{shape:8} {size:>9} {name:11} RecursionError (limit {sys.getrecursionlimit()})')
+                else:
+                    print(f'{shape:8} {size:>9} {name:11} {elapsed:7.3f}s '
+                          f'{elapsed / tokens * 1e9:6.0f} ns/token')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+import argparse
+import time
+
+from backend.encoder import Encoder
+from backend.lowerer import Lowerer
+from benchmarks.bench_regalloc import memory_ops
+from benchmarks.generator import generate
+from frontend.lexer import Lexer
+from frontend.parser import Parser
+from frontend.symbol_table import SemanticAnalyzer
+from ir.builder import IRBuilder
+from sim.translator import TranslatingSimulator
+
+
+# Lowered code as emitted against code after the peephole pass, with the hits of each rule
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Code size and run time with and without the peephole pass')
+    arg_parser.add_argument('--size', type=int, default=500)
+    arg_parser.add_argument('--shapes', nargs='+', default=['straight', 'nested', 'many_vars', 'balanced'])
+    args = arg_parser.parse_args()
+
+    for shape in args.shapes:
+        ast = Parser(Lexer(generate(shape, args.size)).token_stream()).parse_program()
+        analyzer = SemanticAnalyzer()
+        analyzer.visit(ast)
+        program = IRBuilder(symbol_table=analyzer.table).build_program(ast)
+        for peephole in (False, True):
+            started = time.perf_counter()
+            lowerer = Lowerer(program, peephole=peephole)
+            words = Encoder().encode_program(lowered_program=lowerer.lower())
+            elapsed = time.perf_counter() - started
+            stats = TranslatingSimulator(words).run().stats
+            variant = 'peephole' if peephole else 'lowered'
+            print(f'{shape:10} {variant:8} {len(words):>8} instructions  {memory_ops(words):>7} memory ops  '
+                  f'executed {stats.instructions:>9} instructions, {stats.memory_traffic:>8} memory ops  '
+                  f'lowered in {elapsed:.3f}s')
+            if lowerer.peephole_stats is not None:
+                print(' ' * 20 + '  '.join(f'{name} {hits}' for name, hits in lowerer.peephole_stats.hits.items()))
+
+
+if __name__ == '__main__':
+    main()
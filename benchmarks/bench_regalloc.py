@@ -0,0 +1,31 @@
+import argparse
+
+from backend.isa import DecOp
+from backend.regalloc import REGISTER_ALLOCATORS
+from benchmarks.generator import generate
+from driver.compiler import CompileOptions, compile
+from sim.decoder import decode_program
+from sim.translator import TranslatingSimulator
+
+
+def memory_ops(words) -> int:
+    return sum(1 for instr in decode_program(words) if instr.dec_op in (DecOp.MEM_LOAD, DecOp.MEM_STOR))
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Code size and memory traffic per register allocator')
+    arg_parser.add_argument('--size', type=int, default=500)
+    arg_parser.add_argument('--shapes', nargs='+', default=['balanced', 'pressure', 'nested'])
+    args = arg_parser.parse_args()
+
+    for shape in args.shapes:
+        source = generate(shape, args.size)
+        for allocator in REGISTER_ALLOCATORS:
+            words = compile(source, CompileOptions(register_allocator=allocator))
+            stats = TranslatingSimulator(words).run().stats
+            print(f'{shape:10} {allocator:12} {len(words):>8} instructions  {memory_ops(words):>7} memory ops  '
+                  f'executed {stats.instructions:>9} instructions, {stats.memory_traffic:>8} memory ops')
+
+
+if __name__ == '__main__':
+    main()
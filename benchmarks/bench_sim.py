@@ -0,0 +1,51 @@
+import argparse
+
+from benchmarks.generator import generate
+from driver.compiler import compile
+from sim.interpreter import Simulator
+from sim.translator import TranslatingSimulator
+
+ENGINES = (('interpret', Simulator), ('translate', TranslatingSimulator))
+
+LOOP_KERNEL = '''
+var n = {iterations};
+var acc = 0;
+var x = 1;
+while n > 0:{{
+    var acc = acc + n;
+    var x = x * 3 ^ acc;
+    var n = n - 1;
+}}
+print acc
+print x
+'''
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Simulated instructions per second')
+    arg_parser.add_argument('--iterations', type=int, default=30_000, help='loop kernel trip count (< 32768)')
+    arg_parser.add_argument('--size', type=int, default=2_000, help='size of the generated nested program')
+    arg_parser.add_argument('--repeat', type=int, default=3)
+    args = arg_parser.parse_args()
+
+    workloads = (
+        ('loop kernel', LOOP_KERNEL.format(iterations=args.iterations)),
+        ('nested', generate('nested', args.size)),
+        ('straight', generate('straight', args.size)),
+    )
+    for name, source in workloads:
+        words = compile(source)
+        for engine, cls in ENGINES:
+            simulator = cls(words)
+            best = None
+            for _ in range(args.repeat):
+                simulator.reset()
+                stats = simulator.run().stats
+                if best is None or stats.seconds < best.seconds:
+                    best = stats
+            print(f'{name:12} {engine:10} {best.instructions:>10} instructions  {best.seconds:7.3f}s  '
+                  f'{best.instructions_per_second / 1e6:6.2f} M instr/s  '
+                  f'{best.memory_traffic / best.instructions:5.1%} memory ops')
+
+if __name__ == '__main__':
+    main()
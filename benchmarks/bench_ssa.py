@@ -0,0 +1,32 @@
+import argparse
+import time
+
+from benchmarks.bench_regalloc import memory_ops
+from benchmarks.generator import generate
+from driver.compiler import CompileOptions, compile
+from sim.translator import TranslatingSimulator
+
+
+# Variables in memory (every read a MOV MAR + LOAD) against variables kept in registers
+# through SSA form
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Code size and memory traffic with and without SSA form')
+    arg_parser.add_argument('--size', type=int, default=500)
+    arg_parser.add_argument('--shapes', nargs='+', default=['nested', 'many_vars', 'balanced', 'straight'])
+    args = arg_parser.parse_args()
+
+    for shape in args.shapes:
+        source = generate(shape, args.size)
+        for ssa in (False, True):
+            started = time.perf_counter()
+            words = compile(source, CompileOptions(ssa=ssa))
+            elapsed = time.perf_counter() - started
+            stats = TranslatingSimulator(words).run().stats
+            variables = 'ssa' if ssa else 'memory'
+            print(f'{shape:10} {variables:7} {len(words):>8} instructions  {memory_ops(words):>7} memory ops  '
+                  f'executed {stats.instructions:>9} instructions, {stats.memory_traffic:>8} memory ops  '
+                  f'compiled in {elapsed:.3f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+import argparse
+
+from backend.encoder import Encoder
+from backend.isa import ALU_CYCLES, ALUOp
+from backend.lowerer import Lowerer
+from benchmarks.generator import generate
+from frontend.lexer import Lexer
+from frontend.parser import Parser
+from frontend.symbol_table import SemanticAnalyzer
+from ir.builder import IRBuilder
+from ir.isel import select_instructions
+from ir.strength import reduce_strength
+from sim.translator import TranslatingSimulator
+
+
+# Executed instructions weighted by backend.isa.ALU_CYCLES, 1 for everything but ALU operations
+def estimated_cycles(by_opcode: dict) -> int:
+    total = 0
+    for mnemonic, count in by_opcode.items():
+        kind, name = mnemonic.split()
+        cost = ALU_CYCLES[ALUOp[name]] if kind in ('CALC_REG', 'CALC_IMM') else 1
+        total += cost * count
+    return total
+
+
+# Selected IR against IR strength reduced before selection: run time in instructions and in
+# estimated cycles
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Estimated cycles with and without strength reduction')
+    arg_parser.add_argument('--size', type=int, default=500)
+    arg_parser.add_argument('--shapes', nargs='+', default=['straight', 'nested', 'wide', 'balanced'])
+    args = arg_parser.parse_args()
+
+    for shape in args.shapes:
+        ast = Parser(Lexer(generate(shape, args.size)).token_stream()).parse_program()
+        analyzer = SemanticAnalyzer()
+        analyzer.visit(ast)
+        program = IRBuilder(symbol_table=analyzer.table).build_program(ast)
+        for reduce in (False, True):
+            reduced, reduction = reduce_strength(program) if reduce else (program, None)
+            words = Encoder().encode_program(lowered_program=Lowerer(select_instructions(reduced)[0]).lower())
+            stats = TranslatingSimulator(words).run().stats
+            variant = 'reduced' if reduce else 'selected'
+            print(f'{shape:10} {variant:8} {len(words):>8} instructions  '
+                  f'executed {stats.instructions:>9} instructions, {estimated_cycles(stats.by_opcode):>9} cycles')
+            if reduction is not None:
+                print(' ' * 20 + f'{reduction.shifts} shifts  {reduction.masks} masks  '
+                      f'{reduction.shift_adds} shift-adds  {reduction.magic_divides} magic divides  '
+                      f'{reduction.cycles_saved} of {reduction.cycles_before} cycles saved statically')
+
+
+if __name__ == '__main__':
+    main()
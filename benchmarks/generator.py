@@ -0,0 +1,170 @@
+import argparse
+import random
+from typing import Callable, Dict, List
+
+# Synthetic LEG-16 programs of a given shape and size (roughly the number of statements).
+#
+# Every program is valid: names are declared before use, loops count a private counter
+# down to zero so they terminate, and / and % only divide by non-zero constants. Every
+# shape but pressure and balanced uses a single precedence level per expression, so its
+# temps fit in the six allocatable registers.
+
+OPERATOR_GROUPS = (('+', '-'), ('*',), ('&',), ('|',), ('^',), ('<<', '>>'), ('/', '%'))
+COMPARISONS = ('<', '>', '<=', '>=', '!=', '==')
+
+STRAIGHT_NAMES = 16
+NESTED_DEPTH = 16
+WIDE_OPERANDS = 64
+LOOP_TRIPS = 2
+
+
+def operand_for(op: str, rnd: random.Random, names: List[str]) -> str:
+    if op in ('/', '%'):
+        return str(rnd.randint(1, 255))
+    if op in ('<<', '>>'):
+        return str(rnd.randint(0, 15))
+    return rnd.choice(names) if rnd.random() < 0.5 else str(rnd.randint(0, 255))
+
+
+def chain(rnd: random.Random, names: List[str], operands: int) -> str:
+    group = rnd.choice(OPERATOR_GROUPS)
+    parts = [rnd.choice(names)]
+    for _ in range(operands - 1):
+        op = rnd.choice(group)
+        parts.append(op)
+        parts.append(operand_for(op, rnd, names))
+    return ' '.join(parts)
+
+
+def declarations(names: List[str]) -> List[str]:
+    return [f'var {name} = {i + 1};' for i, name in enumerate(names)]
+
+
+# Long straight-line chains of var statements over a small set of names
+def straight(size: int, rnd: random.Random) -> str:
+    names = [f'v{i}' for i in range(STRAIGHT_NAMES)]
+    lines = declarations(names)
+    for _ in range(size - len(lines)):
+        lines.append(f'var {rnd.choice(names)} = {chain(rnd, names, rnd.randint(2, 3))};')
+    return '\n'.join(lines) + '\n'
+
+
+# Deeply nested if/while blocks, repeated until the size is reached
+def nested(size: int, rnd: random.Random) -> str:
+    names = [f'v{i}' for i in range(4)]
+    counters = [f'c{depth}' for depth in range(NESTED_DEPTH)]
+    lines = declarations(names) + declarations(counters)
+    emitted = len(lines)
+    while emitted < size:
+        opened: List[str] = []
+        for depth in range(NESTED_DEPTH):
+            indent = '    ' * depth
+            if depth % 2 == 0:
+                counter = counters[depth]
+                lines.append(f'{indent}var {counter} = {LOOP_TRIPS};')
+                lines.append(f'{indent}while {counter} > 0:{{')
+                opened.append(f'{indent}    var {counter} = {counter} - 1;')
+            else:
+                lines.append(f'{indent}if {rnd.choice(names)} {rnd.choice(COMPARISONS)} {rnd.randint(0, 255)}:{{')
+                opened.append('')
+            lines.append(f'{indent}    var {rnd.choice(names)} = {chain(rnd, names, 3)};')
+            emitted += 3
+        for depth in reversed(range(NESTED_DEPTH)):
+            indent = '    ' * depth
+            if opened[depth]:
+                lines.append(opened[depth])
+            lines.append(f'{indent}}}')
+    return '\n'.join(lines) + '\n'
+
+
+# Few statements with very long expressions, one per 8 of size so the token count stays
+# in the range of the other shapes
+def wide(size: int, rnd: random.Random) -> str:
+    names = [f'v{i}' for i in range(8)]
+    lines = declarations(names)
+    for _ in range(max(1, size // 8 - len(lines))):
+        lines.append(f'var {rnd.choice(names)} = {chain(rnd, names, WIDE_OPERANDS)};')
+    return '\n'.join(lines) + '\n'
+
+
+# Every statement declares a new name, so the symbol table and slot count grow with size
+def many_vars(size: int, rnd: random.Random) -> str:
+    operators = ('+', '-', '&', '|', '^')
+    names = ['v0']
+    lines = ['var v0 = 1;']
+    for i in range(1, size):
+        left, right = rnd.choice(names), rnd.choice(names)
+        lines.append(f'var v{i} = {left} {rnd.choice(operators)} {right};')
+        names.append(f'v{i}')
+    return '\n'.join(lines) + '\n'
+
+
+PRECEDENCE_LEVELS = (('|',), ('^',), ('&',), ('<<', '>>'), ('+', '-'), ('*',))
+
+
+# Expressions climbing every precedence level, as in a | b ^ c & d << e + f * g, keep one
+# operand per level live at once when evaluated left to right: more temps than registers
+def pressure(size: int, rnd: random.Random) -> str:
+    names = [f'v{i}' for i in range(8)]
+    lines = declarations(names)
+    levels = PRECEDENCE_LEVELS
+    for _ in range(size - len(lines)):
+        parts = [rnd.choice(names)]
+        for _ in range(rnd.randint(1, 3)):
+            for group in levels:
+                op = rnd.choice(group)
+                parts.append(op)
+                parts.append(operand_for(op, rnd, names))
+        lines.append(f'var {rnd.choice(names)} = {" ".join(parts)};')
+    return '\n'.join(lines) + '\n'
+
+
+def balanced_tree(rnd: random.Random, names: List[str], level: int, depth: int) -> str:
+    if depth == 0:
+        return rnd.choice(names) if rnd.random() < 0.5 else str(rnd.randint(0, 255))
+    op = rnd.choice(PRECEDENCE_LEVELS[level])
+    left = balanced_tree(rnd, names, level + 1, depth - 1)
+    right = balanced_tree(rnd, names, level + 1, depth - 1)
+    return f'{left} {op} {right}'
+
+
+# Complete trees over consecutive precedence levels, as in a * b + c * d & e * f + g * h:
+# a tree of depth 6 needs seven registers in any evaluation order, so the allocator has to
+# spill. One statement per 8 of size, as for wide.
+def balanced(size: int, rnd: random.Random) -> str:
+    names = [f'v{i}' for i in range(8)]
+    lines = declarations(names)
+    for _ in range(max(1, size // 8 - len(lines))):
+        depth = rnd.randint(4, len(PRECEDENCE_LEVELS))
+        tree = balanced_tree(rnd, names, len(PRECEDENCE_LEVELS) - depth, depth)
+        lines.append(f'var {rnd.choice(names)} = {tree};')
+    return '\n'.join(lines) + '\n'
+
+
+SHAPES: Dict[str, Callable[[int, random.Random], str]] = {
+    'straight': straight,
+    'nested': nested,
+    'wide': wide,
+    'many_vars': many_vars,
+    'pressure': pressure,
+    'balanced': balanced,
+}
+
+
+def generate(shape: str, size: int, seed: int = 0) -> str:
+    if shape not in SHAPES:
+        raise ValueError(f'Unknown shape {shape}, expected one of {", ".join(SHAPES)}')
+    return SHAPES[shape](size, random.Random(seed))
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Generate a synthetic LEG-16 program')
+    arg_parser.add_argument('shape', choices=sorted(SHAPES))
+    arg_parser.add_argument('size', type=int, help='approximate number of statements')
+    arg_parser.add_argument('--seed', type=int, default=0)
+    args = arg_parser.parse_args()
+    print(generate(args.shape, args.size, args.seed), end='')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+import argparse
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+from backend.encoder import Encoder
+from backend.lowerer import Lowerer
+from benchmarks.generator import SHAPES, generate
+from frontend.lexer import Lexer
+from frontend.parser import Parser, gc_paused
+from frontend.symbol_table import SemanticAnalyzer
+from ir.builder import IRBuilder
+
+STAGES = ('lex', 'parse', 'semantic', 'build_ir', 'lower', 'encode')
+RESULTS_VERSION = 1
+
+
+def pipeline(source: str) -> List[Tuple[str, Callable[[dict], None]]]:
+    # Each step reads and writes the shared state dict, so stages can be timed one by one
+    def lex(state):
+        state['tokens'] = Lexer(source).token_stream()
+
+    def parse(state):
+        with gc_paused():
+            state['ast'] = Parser(state['tokens']).parse_program()
+
+    def semantic(state):
+        analyzer = SemanticAnalyzer()
+        analyzer.visit(state['ast'])
+        state['table'] = analyzer.table
+
+    def build_ir(state):
+        state['ir'] = IRBuilder(symbol_table=state['table']).build_program(state['ast'])
+
+    def lower(state):
+        state['cpu'] = Lowerer(state['ir']).lower()
+
+    def encode(state):
+        state['words'] = Encoder().encode_program(lowered_program=state['cpu'])
+
+    return [('lex', lex), ('parse', parse), ('semantic', semantic),
+            ('build_ir', build_ir), ('lower', lower), ('encode', encode)]
+
+
+def time_stages(source: str) -> Tuple[Dict[str, float], dict]:
+    state: dict = {}
+    seconds = {}
+    for name, step in pipeline(source):
+        gc.collect()
+        started = time.perf_counter()
+        step(state)
+        seconds[name] = time.perf_counter() - started
+    return seconds, state
+
+
+def memory_stages(source: str) -> Tuple[Dict[str, int], int]:
+    # Peak bytes allocated above the live heap at each stage start, then the overall peak.
+    # Run separately from timing because tracemalloc slows allocation down several times.
+    state: dict = {}
+    peaks = {}
+    gc.collect()
+    tracemalloc.start()
+    try:
+        for name, step in pipeline(source):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            step(state)
+            peaks[name] = tracemalloc.get_traced_memory()[1] - before
+        overall = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return peaks, max(overall, max(peaks.values()))
+
+
+def run_case(shape: str, size: int, repeat: int, seed: int, measure_memory: bool) -> dict:
+    source = generate(shape, size, seed)
+    best: Dict[str, float] = {}
+    state: dict = {}
+    for _ in range(repeat):
+        seconds, state = time_stages(source)
+        for name, value in seconds.items():
+            best[name] = min(best.get(name, value), value)
+
+    result = {
+        'shape': shape,
+        'size': size,
+        'seed': seed,
+        'source_bytes': len(source),
+        'statements': len(state['ast'].statements),
+        'tokens': len(state['tokens']),
+        'ir_instructions': len(state['ir'].instructions),
+        'words': len(state['words']),
+        'stages': {name: {'seconds': best[name]} for name in STAGES},
+        'total_seconds': sum(best.values()),
+    }
+    if measure_memory:
+        peaks, overall = memory_stages(source)
+        for name in STAGES:
+            result['stages'][name]['peak_bytes'] = peaks[name]
+        result['peak_bytes'] = overall
+    return result
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    # Stages that got slower than the baseline by more than threshold (a fraction)
+    old_cases = {(case['shape'], case['size']): case for case in baseline['results']}
+    regressions = []
+    for case in results['results']:
+        old = old_cases.get((case['shape'], case['size']))
+        if old is None:
+            continue
+        for name in STAGES:
+            new_seconds = case['stages'][name]['seconds']
+            old_seconds = old['stages'][name]['seconds']
+            ratio = new_seconds / old_seconds if old_seconds else 1.0
+            line = f"{case['shape']:10} {case['size']:>8} {name:9} {old_seconds:8.4f}s -> {new_seconds:8.4f}s  x{ratio:5.2f}"
+            print(line)
+            if ratio > 1 + threshold:
+                regressions.append(line)
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    arg_parser = argparse.ArgumentParser(description='Per-stage compiler throughput on generated programs')
+    arg_parser.add_argument('--shapes', nargs='+', choices=sorted(SHAPES), default=list(SHAPES))
+    arg_parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000])
+    arg_parser.add_argument('--repeat', type=int, default=3, help='timing runs per case, the best is kept')
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc run')
+    arg_parser.add_argument('-o', '--output', help='write results as JSON to this file')
+    arg_parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    arg_parser.add_argument('--threshold', type=float, default=0.10,
+                            help='slowdown fraction reported as a regression (default 0.10)')
+    args = arg_parser.parse_args(argv)
+
+    results = {
+        'version': RESULTS_VERSION,
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': [],
+    }
+    for shape in args.shapes:
+        for size in args.sizes:
+            case = run_case(shape, size, args.repeat, args.seed, not args.no_memory)
+            results['results'].append(case)
+            memory = f"  peak {case['peak_bytes'] / 2**20:7.2f} MiB" if 'peak_bytes' in case else ''
+            print(f"{shape:10} {size:>8}  {case['tokens']:>9} tokens  {case['total_seconds']:8.4f}s  "
+                  f"{case['tokens'] / case['total_seconds'] / 1e3:8.1f} ktok/s{memory}")
+            print('    ' + '  '.join(f"{name} {case['stages'][name]['seconds']:.4f}s" for name in STAGES))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f'{len(regressions)} stage(s) slower than baseline by more than {args.threshold:.0%}:')
+            for line in regressions:
+                print('  ' + line)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
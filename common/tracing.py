@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from typing import Dict, List
+
+
+# Structured per-stage tracing.
+#
+# There is one process-wide Tracer, `tracer`. While it is disabled every entry point is a
+# single attribute check: hot code guards its calls with `if tracer.enabled:`, and stage()
+# returns a shared no-op context manager. When enabled it records:
+#   - stage timings (Chrome "X" complete events and per-stage totals),
+#   - counters, e.g. temps, labels and instructions emitted (cumulative),
+#   - peaks, e.g. live registers (the maximum value seen).
+# Counters and peaks are also snapshotted as Chrome "C" events when a stage ends.
+class Tracer:
+    def __init__(self) -> None:
+        self.enabled = False
+        self.reset()
+
+    def reset(self) -> None:
+        self.origin = time.perf_counter()
+        self.events: List[dict] = []
+        self.stage_totals: Dict[str, float] = {}
+        self.stage_calls: Dict[str, int] = {}
+        self.counters: Dict[str, int] = {}
+        self.peaks: Dict[str, int] = {}
+
+    def enable(self) -> None:
+        self.reset()
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def stage(self, name: str, **args) -> _Stage | _NullStage:
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name, args)
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def peak(self, name: str, value: int) -> None:
+        if value > self.peaks.get(name, -1):
+            self.peaks[name] = value
+
+    def timestamp(self) -> float:
+        # Microseconds since reset(), the unit of the Chrome trace format
+        return (time.perf_counter() - self.origin) * 1e6
+
+    def end_stage(self, name: str, start: float, args: dict) -> None:
+        end = self.timestamp()
+        duration = end - start
+        self.stage_totals[name] = self.stage_totals.get(name, 0.0) + duration / 1e6
+        self.stage_calls[name] = self.stage_calls.get(name, 0) + 1
+        event = {'name': name, 'cat': 'stage', 'ph': 'X', 'ts': start, 'dur': duration,
+                 'pid': os.getpid(), 'tid': threading.get_ident()}
+        if args:
+            event['args'] = args
+        self.events.append(event)
+        if self.counters:
+            self.events.append({'name': 'counters', 'ph': 'C', 'ts': end, 'pid': os.getpid(),
+                                'args': dict(self.counters)})
+        if self.peaks:
+            self.events.append({'name': 'peaks', 'ph': 'C', 'ts': end, 'pid': os.getpid(),
+                                'args': dict(self.peaks)})
+
+    def summary(self) -> dict:
+        return {
+            'stages': {name: {'calls': self.stage_calls[name], 'seconds': total}
+                       for name, total in self.stage_totals.items()},
+            'counters': dict(self.counters),
+            'peaks': dict(self.peaks),
+        }
+
+    def chrome_trace(self) -> dict:
+        # Loadable by chrome://tracing and Perfetto
+        return {'traceEvents': list(self.events), 'displayTimeUnit': 'ms'}
+
+    def export(self, path: str, trace_format: str = 'chrome') -> None:
+        if trace_format == 'chrome':
+            data = self.chrome_trace()
+        elif trace_format == 'json':
+            data = self.summary()
+        else:
+            raise ValueError(f'Unknown trace format {trace_format}')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=1)
+
+
+class _Stage:
+    __slots__ = ('tracer', 'name', 'args', 'start')
+
+    def __init__(self, tracer: Tracer, name: str, args: dict) -> None:
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = 0.0
+
+    def __enter__(self) -> _Stage:
+        self.start = self.tracer.timestamp()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.tracer.end_stage(self.name, self.start, self.args)
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self) -> _NullStage:
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        return None
+
+
+_NULL_STAGE = _NullStage()
+
+tracer = Tracer()
+
+TRACE_FORMATS = ('chrome', 'json')
+
+
+__all__ = ['Tracer', 'tracer', 'TRACE_FORMATS']
@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+from typing import Callable, Dict, Optional
+
+Handler = Callable[[object, object], object]
+
+
+# Per-stage table of handlers keyed by node class.
+#
+# Handlers are registered with @dispatcher.register(NodeClass) in a class body and
+# called as dispatcher(visitor, node). The handler for a concrete class is resolved
+# once through its MRO and cached, so dispatch is a single dict lookup regardless of
+# how many node types the stage knows about.
+class Dispatcher:
+    def __init__(self, name: str, default: Optional[Handler] = None) -> None:
+        self.name = name
+        self.default = default
+        self.handlers: Dict[type, Handler] = {}
+        self.cache: Dict[type, Handler] = {}
+
+    def register(self, *node_types: type) -> Callable[[Handler], Handler]:
+        def decorator(handler: Handler) -> Handler:
+            for node_type in node_types:
+                self.handlers[node_type] = handler
+            self.cache.clear()
+            return handler
+        return decorator
+
+    def resolve(self, node_type: type) -> Handler:
+        for base in node_type.__mro__:
+            handler = self.handlers.get(base)
+            if handler is not None:
+                break
+        else:
+            handler = self.default
+            if handler is None:
+                raise NotImplementedError(f'{self.name}: no handler for {node_type.__name__}')
+        self.cache[node_type] = handler
+        return handler
+
+    def __call__(self, visitor, node):
+        try:
+            handler = self.cache[node.__class__]
+        except KeyError:
+            handler = self.resolve(node.__class__)
+        return handler(visitor, node)
+
+
+__all__ = ['Dispatcher']
@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from common.tracing import tracer
+from driver.cache import CacheStats, CompilationCache
+from driver.compiler import Compiler, CompileOptions
+
+import logging
+
+logger = logging.getLogger('Batch')
+
+SOURCE_SUFFIX = '.leg'
+OUTPUT_SUFFIX = '.words'
+
+
+@dataclass
+class FileResult:
+    path: str
+    output: Optional[str]
+    words: int
+    error: Optional[str] = None
+    cache_hit: bool = False
+
+
+@dataclass
+class BatchReport:
+    results: List[FileResult]
+    elapsed: float
+
+    @property
+    def failed(self) -> List[FileResult]:
+        return [result for result in self.results if result.error is not None]
+
+    @property
+    def files_per_second(self) -> float:
+        return len(self.results) / self.elapsed if self.elapsed > 0 else float('inf')
+
+    @property
+    def cache_stats(self) -> CacheStats:
+        hits = sum(1 for result in self.results if result.cache_hit)
+        return CacheStats(hits=hits, misses=len(self.results) - hits)
+
+
+# One cache per worker process so its in-memory LRU survives across files
+_worker_caches: Dict[str, CompilationCache] = {}
+
+
+def worker_cache(cache_dir: Optional[str]) -> Optional[CompilationCache]:
+    if cache_dir is None:
+        return None
+    if cache_dir not in _worker_caches:
+        _worker_caches[cache_dir] = CompilationCache(cache_dir)
+    return _worker_caches[cache_dir]
+
+
+def collect_sources(paths: Iterable[str], suffix: str = SOURCE_SUFFIX) -> List[str]:
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            sources.extend(sorted(str(p) for p in Path(path).rglob(f'*{suffix}') if p.is_file()))
+        else:
+            sources.append(path)
+    return sources
+
+
+def output_path(source_path: str, output_dir: Optional[str]) -> str:
+    target = Path(source_path).with_suffix(OUTPUT_SUFFIX)
+    if output_dir is not None:
+        target = Path(output_dir) / target.name
+    return str(target)
+
+
+def compile_file(source_path: str,
+                 options: CompileOptions,
+                 output_dir: Optional[str] = None,
+                 cache_dir: Optional[str] = None) -> FileResult:
+    try:
+        with open(source_path, encoding='utf-8') as f:
+            source = f.read()
+        cache = worker_cache(cache_dir)
+        hits_before = cache.stats.hits if cache is not None else 0
+        with tracer.stage('compile_file', path=source_path):
+            words = Compiler(options, cache=cache).compile(source)
+        target = output_path(source_path, output_dir)
+        with open(target, 'w', encoding='utf-8') as f:
+            f.writelines(f'{word} {imm}\n' for word, imm in words)
+        return FileResult(
+            path=source_path,
+            output=target,
+            words=len(words),
+            cache_hit=cache is not None and cache.stats.hits > hits_before
+        )
+    except Exception as e:
+        return FileResult(path=source_path, output=None, words=0, error=f'{type(e).__name__}: {e}')
+
+
+def run_batch(sources: List[str],
+              options: CompileOptions,
+              output_dir: Optional[str] = None,
+              jobs: Optional[int] = None,
+              cache_dir: Optional[str] = None) -> BatchReport:
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    jobs = jobs or os.cpu_count() or 1
+    started = time.perf_counter()
+    if jobs == 1 or len(sources) <= 1:
+        results = [compile_file(source, options, output_dir, cache_dir) for source in sources]
+    else:
+        # Small sources compile in well under a millisecond, so hand them to workers in chunks
+        chunksize = max(1, len(sources) // (jobs * 8))
+        logger.info('Compiling %d files with %d workers (chunksize %d)', len(sources), jobs, chunksize)
+        # Workers are processes of their own, where pausing the GC while parsing affects
+        # nothing else
+        worker_options = replace(options, pause_gc=True)
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(
+                compile_file, sources,
+                [worker_options] * len(sources),
+                [output_dir] * len(sources),
+                [cache_dir] * len(sources),
+                chunksize=chunksize
+            ))
+    return BatchReport(results=results, elapsed=time.perf_counter() - started)
+
+
+__all__ = ['FileResult', 'BatchReport', 'collect_sources', 'compile_file', 'run_batch']
@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import pickle
+import tempfile
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to rename-only safety
+    fcntl = None
+
+import logging
+
+logger = logging.getLogger('Cache')
+
+# Bump whenever the layout of an entry changes. Changes to what the stages produce are
+# covered by compiler_fingerprint, which every key includes.
+CACHE_FORMAT_VERSION = 3
+# Packages whose code decides what a source compiles to, and what a cached entry unpickles to
+COMPILER_PACKAGES = ('backend', 'common', 'driver', 'frontend', 'ir', 'sim')
+ENTRY_SUFFIX = '.pkl'
+LOCK_NAME = '.lock'
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    memory_hits: int = 0
+    disk_hits: int = 0
+    stores: int = 0
+    # Entries kept in memory only: writing them to disk failed
+    store_failures: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+# Hash of the compiler's own sources, read once per process: entries written by any other
+# version of the compiler, in a persistent cache directory, are never served
+@lru_cache(maxsize=None)
+def compiler_fingerprint() -> str:
+    root = Path(__file__).resolve().parent.parent
+    digest = hashlib.sha256()
+    for package in COMPILER_PACKAGES:
+        for path in sorted((root / package).glob('*.py')):
+            digest.update(f'{package}/{path.name}\0'.encode('utf-8'))
+            digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def cache_key(source: str, fingerprint: str) -> str:
+    digest = hashlib.sha256()
+    digest.update(f'{CACHE_FORMAT_VERSION}\0{compiler_fingerprint()}\0{fingerprint}\0'.encode('utf-8'))
+    digest.update(source.encode('utf-8'))
+    return digest.hexdigest()
+
+
+# In-memory LRU bounded by entry count in front of an on-disk store bounded by bytes.
+# Entries are written to a temp file and renamed into place, so concurrent workers never
+# read a partial entry; disk eviction runs under an exclusive flock on the cache directory.
+class CompilationCache:
+    def __init__(self,
+                 directory: Optional[str] = None,
+                 max_memory_entries: int = 256,
+                 max_disk_bytes: int = 256 * 1024 * 1024) -> None:
+        self.directory = directory
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.stats = CacheStats()
+        self.memory: OrderedDict[str, object] = OrderedDict()
+        self.disk_bytes: Optional[int] = None
+        if directory is not None:
+            try:
+                os.makedirs(directory, exist_ok=True)
+            except OSError as e:
+                logger.warning('Caching in memory only, cannot create %s: %s', directory, e)
+                self.directory = None
+
+    def get(self, key: str):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.stats.hits += 1
+            self.stats.memory_hits += 1
+            return self.memory[key]
+
+        value = self.read_disk(key)
+        if value is None:
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        self.stats.disk_hits += 1
+        self.remember(key, value)
+        return value
+
+    def put(self, key: str, value) -> None:
+        self.stats.stores += 1
+        self.remember(key, value)
+        try:
+            self.write_disk(key, value)
+        except Exception as e:
+            # A full disk, a read-only directory or a value that does not pickle costs a
+            # miss next time, never the compile that produced the value
+            self.stats.store_failures += 1
+            logger.warning('Could not store cache entry %s: %s', key, e)
+
+    def remember(self, key: str, value) -> None:
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ENTRY_SUFFIX)
+
+    def read_disk(self, key: str):
+        if self.directory is None:
+            return None
+        path = self.entry_path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning('Dropping unreadable cache entry %s: %s', path, e)
+            self.remove(path)
+            return None
+        try:
+            # mtime doubles as the LRU clock for disk eviction
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def write_disk(self, key: str, value) -> None:
+        if self.directory is None:
+            return
+        path = self.entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            self.remove(tmp_path)
+            raise
+
+        if self.disk_bytes is None:
+            self.disk_bytes = self.scan_disk_bytes()
+        else:
+            self.disk_bytes += len(data)
+        if self.disk_bytes > self.max_disk_bytes:
+            self.evict_disk()
+
+    def scan_disk_bytes(self) -> int:
+        return sum(size for _, _, size in self.disk_entries())
+
+    def disk_entries(self):
+        entries = []
+        for bucket in os.scandir(self.directory):
+            if not bucket.is_dir():
+                continue
+            for entry in os.scandir(bucket.path):
+                if not entry.name.endswith(ENTRY_SUFFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, entry.path, stat.st_size))
+        return entries
+
+    def evict_disk(self) -> None:
+        with self.directory_lock():
+            entries = sorted(self.disk_entries())
+            total = sum(size for _, _, size in entries)
+            # Evict down to 90% so that the next few stores do not trigger another scan
+            target = self.max_disk_bytes * 9 // 10
+            for _, path, size in entries:
+                if total <= target:
+                    break
+                if self.remove(path):
+                    self.stats.evictions += 1
+                total -= size
+            self.disk_bytes = total
+        logger.info('Evicted cache down to %d bytes', total)
+
+    @contextmanager
+    def directory_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, LOCK_NAME), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def remove(path: str) -> bool:
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def clear_memory(self) -> None:
+        self.memory.clear()
+
+
+__all__ = ['CACHE_FORMAT_VERSION', 'CacheStats', 'CompilationCache', 'cache_key', 'compiler_fingerprint']
@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import sys
+from contextlib import nullcontext
+from dataclasses import dataclass, replace
+from typing import List, Optional, TextIO
+
+from backend.cpu_instr import ISAInstruction
+from backend.encoder import Encoder, EncodedWord
+from backend.global_alloc import GLOBAL_REGISTERS
+from backend.lowerer import Lowerer
+from common.tracing import tracer
+from driver.cache import CompilationCache, cache_key
+from frontend.ast_leg import Program
+from frontend.lexer import Lexer
+from frontend.parser import Parser, gc_paused
+from frontend.symbol_table import SemanticAnalyzer, SymbolTable
+from frontend.token_stream import TokenStream
+from ir.builder import IRBuilder, PackedIRBuilder
+from ir.constprop import propagate_constants
+from ir.gvn import number_values
+from ir.isel import select_instructions
+from ir.memopt import optimize_memory
+from ir.program import ProgrammIRInstruction
+from ir.soa import PackedProgram
+from ir.ssa import from_ssa, to_ssa
+from ir.strength import reduce_strength
+
+import logging
+
+logger = logging.getLogger('Compiler')
+
+
+@dataclass(frozen=True)
+class CompileOptions:
+    dump_stages: bool = False
+    # Build and lower the struct-of-arrays IR instead of IRInstruction objects
+    packed_ir: bool = False
+    # A key of backend.regalloc.REGISTER_ALLOCATORS
+    register_allocator: str = 'linear_scan'
+    # Evaluate the operand needing more registers first (Sethi-Ullman order)
+    reorder_operands: bool = True
+    # Keep variables in registers: promote slots to SSA temps (ir.ssa) and give the temps
+    # live across blocks registers of their own
+    ssa: bool = False
+    # Fold operations on constants, replace loads of slots with known values and remove
+    # branches that always or never go one way (ir.constprop)
+    fold_constants: bool = False
+    # Forward stored values to later loads, drop dead stores and keep the hottest
+    # variables of each loop nest in registers (ir.memopt). Under ssa, which already keeps
+    # variables in registers, loops are left to it.
+    optimize_memory: bool = False
+    # Reuse the temp of an identical load in the same block, or of an identical operation
+    # in the same block or one dominating it, instead of computing it again (ir.gvn)
+    value_numbering: bool = False
+    # Clean up the lowered instructions: MOV MAR of the slot MAR already holds, loads of a
+    # slot a register still holds, constants moved into a register for one ALU operation,
+    # jumps to the next instruction (backend.peephole)
+    peephole: bool = False
+    # Fold constant operands into immediates and pick the cheapest form of each operation
+    # and branch on constants, right before lowering (ir.isel)
+    select_instructions: bool = False
+    # Multiply, divide and take remainders by constants with shifts, masks, adds and the
+    # high word of a product where backend.isa.ALU_CYCLES has them cheaper (ir.strength)
+    reduce_strength: bool = False
+    # Switch the cyclic GC off while parsing (frontend.parser.gc_paused). The collector is
+    # process-wide, so this is for programs owning the process: the CLI and batch workers.
+    pause_gc: bool = False
+
+    def fingerprint(self) -> str:
+        # Only options that change the produced code take part in the cache key
+        return repr(replace(self, dump_stages=False, pause_gc=False))
+
+
+@dataclass
+class CompileResult:
+    tokens: TokenStream
+    ast: Program
+    symbol_table: SymbolTable
+    ir_program: ProgrammIRInstruction | PackedProgram
+    cpu_instructions: List[ISAInstruction]
+    words: List[EncodedWord]
+
+
+class Compiler:
+    def __init__(self,
+                 options: Optional[CompileOptions] = None,
+                 out: TextIO = sys.stdout,
+                 cache: Optional[CompilationCache] = None) -> None:
+        self.options = options or CompileOptions()
+        self.out = out
+        self.cache = cache
+
+    # The cache holds the encoded words only: a flat list of int pairs, which is all compile
+    # returns and pickles without recursing over the AST however long an expression is
+    def compile(self, source: str) -> List[EncodedWord]:
+        if self.cache is None or self.options.dump_stages:
+            # Dumps come from running the stages, so they never depend on a warm cache
+            return self.run_stages(source).words
+
+        key = cache_key(source, self.options.fingerprint())
+        words = self.cache.get(key)
+        if words is not None:
+            logger.debug('Cache hit %s', key)
+            if tracer.enabled:
+                tracer.count('cache.hits')
+            return words
+        words = self.run_stages(source).words
+        self.cache.put(key, words)
+        return words
+
+    # Every stage's result, for tools that look at the intermediate ones; never cached
+    def compile_stages(self, source: str) -> CompileResult:
+        return self.run_stages(source)
+
+    def run_stages(self, source: str) -> CompileResult:
+        with tracer.stage('lex'):
+            tokens = Lexer(source).token_stream()
+            if tracer.enabled:
+                tracer.count('tokens', len(tokens))
+        self.dump('tokens', format_tokens(tokens))
+
+        with tracer.stage('parse'), (gc_paused() if self.options.pause_gc else nullcontext()):
+            ast = Parser(tokens).parse_program()
+        self.dump('leg_ast', ast)
+
+        with tracer.stage('semantic'):
+            analyzer = SemanticAnalyzer()
+            analyzer.visit(ast)
+        self.dump('symbol_table', analyzer.table.symbols)
+
+        with tracer.stage('build_ir'):
+            builder_cls = PackedIRBuilder if self.options.packed_ir else IRBuilder
+            builder = builder_cls(symbol_table=analyzer.table, reorder_operands=self.options.reorder_operands)
+            ir_program = builder.build_program(ast)
+            if tracer.enabled:
+                # Totals are read off the builder once, so its hot paths need no counting
+                tracer.count('temps', builder.temp_counter)
+                tracer.count('labels', builder.label_counter)
+                tracer.count('ir_instructions', len(builder.program) if self.options.packed_ir
+                             else len(ir_program.instructions))
+        self.dump('ir_program', ir_program)
+
+        lowered_ir = ir_program
+        if self.options.fold_constants:
+            with tracer.stage('constprop'):
+                if isinstance(lowered_ir, PackedProgram):
+                    lowered_ir = lowered_ir.to_program()
+                lowered_ir, _ = propagate_constants(lowered_ir)
+            self.dump('constprop_program', lowered_ir)
+
+        if self.options.value_numbering:
+            with tracer.stage('gvn'):
+                if isinstance(lowered_ir, PackedProgram):
+                    lowered_ir = lowered_ir.to_program()
+                lowered_ir, _ = number_values(lowered_ir)
+            self.dump('gvn_program', lowered_ir)
+
+        if self.options.optimize_memory:
+            with tracer.stage('memopt'):
+                if isinstance(lowered_ir, PackedProgram):
+                    lowered_ir = lowered_ir.to_program()
+                lowered_ir, _ = optimize_memory(lowered_ir, 0 if self.options.ssa else len(GLOBAL_REGISTERS))
+            self.dump('memopt_program', lowered_ir)
+
+        if self.options.ssa:
+            with tracer.stage('ssa'):
+                if isinstance(lowered_ir, PackedProgram):
+                    lowered_ir = lowered_ir.to_program()
+                # Variables live across blocks beyond the global registers stay in memory
+                lowered_ir = to_ssa(lowered_ir, len(GLOBAL_REGISTERS))
+            self.dump('ssa_program', lowered_ir)
+            with tracer.stage('out_of_ssa'):
+                lowered_ir = from_ssa(lowered_ir)
+
+        if self.options.reduce_strength:
+            with tracer.stage('strength'):
+                if isinstance(lowered_ir, PackedProgram):
+                    lowered_ir = lowered_ir.to_program()
+                lowered_ir, _ = reduce_strength(lowered_ir)
+            self.dump('strength_program', lowered_ir)
+
+        if self.options.select_instructions:
+            with tracer.stage('isel'):
+                if isinstance(lowered_ir, PackedProgram):
+                    lowered_ir = lowered_ir.to_program()
+                lowered_ir, _ = select_instructions(lowered_ir)
+            self.dump('isel_program', lowered_ir)
+
+        with tracer.stage('lower'):
+            # Only the IR passes leave temps read outside the block writing them
+            cross_block_temps = self.options.ssa or self.options.optimize_memory or self.options.value_numbering
+            cpu_instructions = Lowerer(lowered_ir, self.options.register_allocator,
+                                       cross_block_temps=cross_block_temps,
+                                       peephole=self.options.peephole).lower()
+            if tracer.enabled:
+                tracer.count('cpu_instructions', len(cpu_instructions))
+        self.dump('lowered_program', '\n'.join(map(repr, cpu_instructions)))
+
+        with tracer.stage('encode'):
+            words = Encoder().encode_program(lowered_program=cpu_instructions)
+            if tracer.enabled:
+                tracer.count('words', len(words))
+        self.dump('encoded_program', '\n'.join(format_word(word) for word in words))
+
+        return CompileResult(
+            tokens=tokens,
+            ast=ast,
+            symbol_table=analyzer.table,
+            ir_program=ir_program,
+            cpu_instructions=cpu_instructions,
+            words=words
+        )
+
+    def dump(self, stage: str, value) -> None:
+        if self.options.dump_stages:
+            print(stage + '-' * 10, file=self.out)
+            print(value, file=self.out)
+
+
+def format_tokens(tokens: TokenStream) -> str:
+    return '\n'.join(f'{tok_type:8} | {tok_value}' for tok_type, tok_value in tokens)
+
+
+def format_word(word: EncodedWord) -> str:
+    s = f'{word[0]:016b}'
+    return f'{s[:3]} {s[3:7]} {s[7:10]} {s[10:13]} {s[13:]} {word[1]}'
+
+
+def compile(source: str,
+            options: Optional[CompileOptions] = None,
+            cache: Optional[CompilationCache] = None) -> List[EncodedWord]:
+    return Compiler(options, cache=cache).compile(source)
+
+
+__all__ = ['CompileOptions', 'CompileResult', 'Compiler', 'compile', 'format_word']
@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from backend.cpu_instr import ISABranch
+from backend.encoder import Encoder, EncodedWord
+from backend.isa import Register
+from backend.lowerer import Lowerer
+from backend.regalloc import RegisterAllocator
+from frontend.ast_leg import BinaryOp, Block, IfStmt, Print, Stmt, VarDecl, VarRef, WhileStmt
+from frontend.lexer import Lexer
+from frontend.parser import Parser
+from frontend.symbol_table import SemanticAnalyzer, SymbolTable
+from ir.builder import IRBuilder
+from ir.instructions import IRInstruction
+from ir.program import ProgrammIRInstruction
+
+import logging
+
+logger = logging.getLogger('Incremental')
+
+
+@dataclass
+class StatementUnit:
+    stmt: Stmt
+    names: Tuple[str, ...]
+    slots: Tuple[int, ...]
+    entry_registers: Tuple[Register, ...]
+    exit_registers: Tuple[Register, ...]
+    ir: List[IRInstruction]
+    # Encoded with branch targets relative to the start of this statement
+    words: List[EncodedWord]
+    branch_words: List[int]
+    base: int = 0
+    # First spill slot, when the statement spilled; None otherwise
+    spill_base: Optional[int] = None
+
+
+@dataclass
+class IncrementalStats:
+    reused: int = 0
+    rebuilt: int = 0
+
+
+def statement_names(stmt: Stmt) -> Tuple[str, ...]:
+    names = []
+    stack = [stmt]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, VarDecl):
+            names.append(node.name)
+            stack.append(node.expr)
+        elif isinstance(node, VarRef):
+            names.append(node.name)
+        elif isinstance(node, BinaryOp):
+            stack.append(node.right)
+            stack.append(node.left)
+        elif isinstance(node, Print):
+            stack.append(node.expr)
+        elif isinstance(node, IfStmt):
+            stack.append(node.else_block)
+            stack.append(node.then_block)
+            stack.append(node.condition)
+        elif isinstance(node, WhileStmt):
+            stack.append(node.body_block)
+            stack.append(node.condition)
+        elif isinstance(node, Block):
+            stack.extend(reversed(node.statements))
+    return tuple(dict.fromkeys(names))
+
+
+# Recompiles only the top-level statements touched by an edit.
+#
+# Every temp the builder creates is consumed inside its own top-level statement, so the
+# register file is free at statement boundaries and a statement's code depends only on
+# the slots of the names it touches, the order of the free register list on entry, and
+# its position (through absolute branch targets). Units whose statement, slots and entry
+# registers are unchanged are reused as is and only their branch targets are re-patched.
+# Spill slots come after all variable slots, so a statement that spilled also depends on
+# the number of variables.
+class IncrementalCompiler:
+    def __init__(self) -> None:
+        self.units: List[StatementUnit] = []
+        self.words: List[EncodedWord] = []
+        self.encoder = Encoder()
+        self.stats = IncrementalStats()
+
+    def compile(self, source: str) -> List[EncodedWord]:
+        tokens = Lexer(source).token_stream()
+        ast = Parser(tokens).parse_program()
+        analyzer = SemanticAnalyzer()
+        analyzer.visit(ast)
+        table = analyzer.table
+
+        old_units = self.units
+        statements = ast.statements
+        prefix = 0
+        while prefix < min(len(old_units), len(statements)) and old_units[prefix].stmt == statements[prefix]:
+            prefix += 1
+        suffix = 0
+        while (suffix < min(len(old_units), len(statements)) - prefix
+               and old_units[-1 - suffix].stmt == statements[-1 - suffix]):
+            suffix += 1
+        logger.debug('Edit spans statements %d..%d of %d', prefix, len(statements) - suffix, len(statements))
+
+        units: List[StatementUnit] = []
+        registers = tuple(RegisterAllocator().free_registers)
+        for index, stmt in enumerate(statements):
+            if index < prefix:
+                candidate = old_units[index]
+            elif index >= len(statements) - suffix:
+                candidate = old_units[len(old_units) - (len(statements) - index)]
+            else:
+                candidate = None
+
+            if candidate is not None and self.reusable(candidate, table, registers):
+                unit = candidate
+                self.stats.reused += 1
+            else:
+                unit = self.build_unit(stmt, table, registers)
+                self.stats.rebuilt += 1
+            units.append(unit)
+            registers = unit.exit_registers
+
+        self.words = self.assemble(units, old_units)
+        self.units = units
+        return self.words
+
+    @staticmethod
+    def reusable(unit: StatementUnit, table: SymbolTable, registers: Tuple[Register, ...]) -> bool:
+        if unit.entry_registers != registers:
+            return False
+        if unit.spill_base is not None and unit.spill_base != table.next_slot:
+            return False
+        return unit.slots == tuple(table.lookup(name).slot for name in unit.names)
+
+    def build_unit(self, stmt: Stmt, table: SymbolTable, registers: Tuple[Register, ...]) -> StatementUnit:
+        builder = IRBuilder(symbol_table=table)
+        builder.build_stmt(stmt)
+        program = ProgrammIRInstruction(instructions=builder.instructions, slots=list(builder.slots_map.values()))
+
+        lowerer = Lowerer(program, spill_base=table.next_slot)
+        lowerer.register_allocator.free_registers = list(registers)
+        # Patching against a statement-local label table yields offsets relative to the unit start
+        cpu_instructions = lowerer.lower()
+        names = statement_names(stmt)
+        return StatementUnit(
+            stmt=stmt,
+            names=names,
+            slots=tuple(table.lookup(name).slot for name in names),
+            entry_registers=registers,
+            exit_registers=tuple(lowerer.register_allocator.free_registers),
+            ir=builder.instructions,
+            words=self.encoder.encode_program(cpu_instructions),
+            branch_words=[i for i, instr in enumerate(cpu_instructions) if isinstance(instr, ISABranch)],
+            spill_base=table.next_slot if lowerer.register_allocator.stats.slots else None
+        )
+
+    def assemble(self, units: List[StatementUnit], old_units: List[StatementUnit]) -> List[EncodedWord]:
+        # The encoded prefix shared with the previous compile is copied in one slice
+        shared = 0
+        while shared < min(len(units), len(old_units)) and units[shared] is old_units[shared]:
+            shared += 1
+        words = self.words[:units[shared - 1].base + len(units[shared - 1].words)] if shared else []
+
+        for unit in units[shared:]:
+            unit.base = len(words)
+            if not unit.branch_words or unit.base == 0:
+                words.extend(unit.words)
+                continue
+            relocated = list(unit.words)
+            offset = unit.base * 2
+            for i in unit.branch_words:
+                word, imm = relocated[i]
+                relocated[i] = (word, imm + offset)
+            words.extend(relocated)
+        return words
+
+    def reset(self) -> None:
+        self.units = []
+        self.words = []
+
+
+__all__ = ['IncrementalCompiler', 'IncrementalStats', 'StatementUnit']
@@ -4,18 +4,23 @@ from dataclasses import dataclass
 from typing import List, Optional
 
 
-class Node: pass
+class Node:
+    __slots__ = ()
 
-class Expr(Node): pass
+class Expr(Node):
+    __slots__ = ()
 
-class Stmt(Node): pass
+class Stmt(Node):
+    __slots__ = ()
 
 @dataclass
 class Block(Stmt):
+    __slots__ = ('statements',)
     statements: List[Stmt]
 
 @dataclass
 class Number(Expr):
+    __slots__ = ('value',)
     value: int
 
     def __repr__(self) -> str:
@@ -23,6 +28,7 @@ class Number(Expr):
 
 @dataclass
 class VarRef(Expr):
+    __slots__ = ('name',)
     name: str
 
     def __repr__(self) -> str:
@@ -30,15 +36,34 @@ class VarRef(Expr):
 
 @dataclass
 class BinaryOp(Expr):
+    __slots__ = ('left', 'op', 'right')
     left: Expr
     op: str
     right: Expr
 
+    def __eq__(self, other: object) -> bool:
+        # With an explicit stack: driver.incremental compares whole statements, and the
+        # dataclass __eq__ would recurse once per operand
+        if type(other) is not BinaryOp:
+            return NotImplemented
+        stack = [(self, other)]
+        while stack:
+            first, second = stack.pop()
+            if type(first) is BinaryOp and type(second) is BinaryOp:
+                if first.op != second.op:
+                    return False
+                stack.append((first.right, second.right))
+                stack.append((first.left, second.left))
+            elif first != second:
+                return False
+        return True
+
     def __repr__(self) -> str:
         return f"BinaryOp({self.left}, {self.op}, {self.right})"
 
 @dataclass
 class VarDecl(Stmt):
+    __slots__ = ('name', 'expr')
     name: str
     expr: Expr
 
@@ -47,6 +72,7 @@ class VarDecl(Stmt):
 
 @dataclass
 class Print(Stmt):
+    __slots__ = ('expr',)
     expr: Expr
 
     def __repr__(self):
@@ -54,6 +80,7 @@ class Print(Stmt):
 
 @dataclass
 class IfStmt(Stmt):
+    __slots__ = ('condition', 'then_block', 'else_block')
     condition: BinaryOp
     then_block: Block
     else_block: Block | None
@@ -63,11 +90,13 @@ class IfStmt(Stmt):
 
 @dataclass
 class WhileStmt(Stmt):
+    __slots__ = ('condition', 'body_block')
     condition: BinaryOp
     body_block: Block
 
 @dataclass
 class Program(Node):
+    __slots__ = ('statements',)
     statements: List[Stmt]
 
     def __repr__(self):
@@ -1,7 +1,64 @@
+from __future__ import annotations
+
+import mmap
 import re
-from typing import List, Tuple
+import sys
+from array import array
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple, Union
+
+from frontend.token_stream import KIND_IDS, Token, TokenStream
+
+PositionedToken = Tuple[str, str, int, int]  # (type, value, line, column)
+Source = Union[str, bytes, bytearray, memoryview, mmap.mmap]
+
+KEYWORDS = {
+    'print': 'PRINT',
+    'var': 'VAR',
+    'if': 'IF',
+    'else': 'ELSE',
+    'while': 'WHILE',
+    'rol': 'ROL',
+    'ror': 'ROR',
+}
+
+OPERATORS = {
+    ';': 'SEMI',
+    '=': 'ASSIGN',
+    '<<': 'SHL',
+    '>>': 'SHR',
+    '+': 'PLUS',
+    '-': 'MINUS',
+    '*': 'MUL',
+    '/': 'DIV',
+    '%': 'MOD',
+    '&': 'AND',
+    '|': 'OR',
+    '^': 'XOR',
+    '~': 'NOT',
+    '{': 'LBRACE',
+    '}': 'RBRACE',
+    '(': 'LPAREN',
+    ')': 'RPAREN',
+    ':': 'COLON',
+    '==': 'EQ',
+    '!=': 'NE',
+    '>=': 'GE',
+    '<=': 'LE',
+    '>': 'GT',
+    '<': 'LT',
+}
+
+CLASSIFY = {**KEYWORDS, **OPERATORS}
+CLASSIFY_KIND_IDS = {text.encode('ascii'): KIND_IDS[kind] for text, kind in CLASSIFY.items()}
+DIGITS = frozenset('0123456789')
+IDENT_START = frozenset('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_')
+DIGIT_BYTES = frozenset(b'0123456789')
+IDENT_START_BYTES = frozenset(b'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_')
+
+# Tokens never span lines, so the streaming lexer decodes the source in line-aligned chunks
+CHUNK_SIZE = 1 << 16
 
-Token = Tuple[str, str]  # (type, value)
 
 class Lexer:
     token_specification = [
@@ -57,16 +114,148 @@ class Lexer:
     # Pattern generator use to create big regexp pattern, like r'(?P<SKIP>[ \\t\\n]+)|(?P<COMMENT>//.*)|(?
     master_pattern = re.compile('|'.join(f'(?P<{name}>{pat})' for name, pat in token_specification))
 
+    # One alternation for words, numbers and operators (longest first); the kind is then a dict lookup
+    token_pattern = re.compile(r'//[^\n]*|\d+|[a-zA-Z_][a-zA-Z0-9_]*|<<|>>|==|!=|>=|<=|\S', re.ASCII)
+    token_bytes_pattern = re.compile(token_pattern.pattern.encode('ascii'))
+    # The grammar of the original master pattern for text that is not pure ASCII: identifiers
+    # go on with any Unicode letter or digit after an ASCII first character, like café, and
+    # numbers may use any decimal digits
+    unicode_token_pattern = re.compile(r'//[^\n]*|\d+|[a-zA-Z_]\w*|<<|>>|==|!=|>=|<=|\S')
+
     def __init__(self,
-                 code: str) -> None:
-        self.code = code.strip()
+                 code: Source) -> None:
+        # Text is encoded once; bytes and mmap sources are scanned in place
+        if isinstance(code, str):
+            code = code.encode('utf-8')
+        elif isinstance(code, (bytearray, memoryview)):
+            code = bytes(code)
+        self.code = code
+
+    @classmethod
+    @contextmanager
+    def from_file(cls, path: str) -> Iterator[Lexer]:
+        with open(path, 'rb') as f:
+            try:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty files cannot be mapped
+                yield cls(b'')
+                return
+            try:
+                yield cls(buffer)
+            finally:
+                buffer.close()
 
     def tokenize(self) -> List[Token]:
+        return list(self.iter_tokens())
+
+    def token_stream(self) -> TokenStream:
+        classify = CLASSIFY_KIND_IDS.get
+        ident, number = KIND_IDS['IDENT'], KIND_IDS['NUMBER']
+        kinds = array('B')
+        starts = array('I')
+        ends = array('I')
+        add_kind, add_start, add_end = kinds.append, starts.append, ends.append
+        for mo in self.token_bytes_pattern.finditer(self.code):
+            value = mo.group()
+            kind = classify(value)
+            if kind is None:
+                first = value[0]
+                if first in IDENT_START_BYTES:
+                    kind = ident
+                elif first in DIGIT_BYTES:
+                    kind = number
+                elif value[:2] == b'//':
+                    continue
+                elif not bytes(self.code).isascii():
+                    # Non-ASCII text takes the slower str path with the Unicode grammar
+                    return TokenStream.from_tokens(self.tokenize())
+                else:
+                    # Error path only: rescan with positions to report line and column
+                    for _ in self.iter_positioned_tokens():
+                        pass
+            add_kind(kind)
+            start, end = mo.span()
+            add_start(start)
+            add_end(end)
+        add_kind(KIND_IDS['EOF'])
+        add_start(len(self.code))
+        add_end(len(self.code))
+        source = self.code
+        if isinstance(source, bytes) and source.isascii():
+            source = source.decode('ascii')
+        return TokenStream(source, kinds, starts, ends)
+
+    def iter_tokens(self) -> Iterator[Token]:
+        classify = CLASSIFY.get
+        intern = sys.intern
+        for text in self.iter_chunks():
+            pattern = self.token_pattern if text.isascii() else self.unicode_token_pattern
+            for value in pattern.findall(text):
+                kind = classify(value)
+                if kind is not None:
+                    yield kind, value
+                elif value[0] in IDENT_START:
+                    yield 'IDENT', intern(value)
+                elif value[0] in DIGITS or value[0].isdecimal():
+                    yield 'NUMBER', value
+                elif value[:2] == '//':
+                    continue
+                else:
+                    # Error path only: rescan with positions to report line and column
+                    for _ in self.iter_positioned_tokens():
+                        pass
+        yield 'EOF', ''
+
+    def iter_chunks(self) -> Iterator[str]:
+        code = self.code
+        size = len(code)
+        pos = 0
+        while pos < size:
+            end = min(size, pos + CHUNK_SIZE)
+            if end < size:
+                newline = code.rfind(b'\n', pos, end)
+                if newline < pos:
+                    newline = code.find(b'\n', end)
+                end = size if newline < 0 else newline + 1
+            yield bytes(code[pos:end]).decode('utf-8')
+            pos = end
+
+    def iter_positioned_tokens(self) -> Iterator[PositionedToken]:
+        classify = CLASSIFY.get
+        line_no = 0
+        line = ''
+        for text in self.iter_chunks():
+            finditer = (self.token_pattern if text.isascii() else self.unicode_token_pattern).finditer
+            # Chunks end on a line break, so line numbers are just a running count of lines
+            for line in text.split('\n'):
+                line_no += 1
+                for mo in finditer(line):
+                    value = mo.group()
+                    kind = classify(value)
+                    if kind is None:
+                        if value[0] in IDENT_START:
+                            kind = 'IDENT'
+                            value = sys.intern(value)
+                        elif value[0] in DIGITS or value[0].isdecimal():
+                            kind = 'NUMBER'
+                        elif value[:2] == '//':
+                            continue
+                        else:
+                            raise RuntimeError(f'Unexpected symbol {value!r} string {line_no}, column {mo.start() + 1}')
+                    yield kind, value, line_no, mo.start() + 1
+            # split() yields one extra empty piece after the trailing line break of a chunk
+            line_no -= 1
+        yield 'EOF', '', line_no + 1, len(line) + 1
+
+    def tokenize_master_pattern(self) -> List[Token]:
+        # Reference implementation kept for benchmarks against token_pattern
+        code = self.code if isinstance(self.code, str) else bytes(self.code).decode('utf-8')
+        code = code.strip()
         lex_tokens = []
         line_no = 1
         line_start = 0
         # self.master_pattern.finditer(self.code) is iterator with found items
-        for mo in self.master_pattern.finditer(self.code):
+        for mo in self.master_pattern.finditer(code):
             kind = mo.lastgroup
             value = mo.group()
             if kind == 'SKIP':
@@ -1,131 +1,189 @@
 from __future__ import annotations
 
-from typing import List
+import gc
+import logging
+from contextlib import contextmanager
+from typing import Iterator, List, Union
 from frontend.ast_leg import VarDecl, BinaryOp, Number, VarRef, Program, Print, Stmt, Expr, IfStmt, Block, WhileStmt
 from ir.builder import logger
 from frontend.lexer import Token
+from frontend.token_stream import KIND_NAMES, KIND_TEXT, Kind, TokenStream
+
+# The AST is acyclic, so cyclic GC passes over millions of fresh nodes are pure overhead.
+# The collector is process-wide, so only code owning the process (the CLI, batch workers,
+# benchmarks) pauses it around a parse; Parser itself never does.
+@contextmanager
+def gc_paused() -> Iterator[None]:
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+# Binding power of binary operators, lowest first (same order as Python)
+BINARY_PRECEDENCE = {
+    Kind.GT: 1, Kind.LT: 1, Kind.GE: 1, Kind.LE: 1, Kind.EQ: 1, Kind.NE: 1,
+    Kind.OR: 2,
+    Kind.XOR: 3,
+    Kind.AND: 4,
+    Kind.SHL: 5, Kind.SHR: 5, Kind.ROL: 5, Kind.ROR: 5,
+    Kind.PLUS: 6, Kind.MINUS: 6,
+    Kind.MUL: 7, Kind.DIV: 7, Kind.MOD: 7,
+}
 
 class Parser:
-    def __init__(self, tokens: List[Token]) -> None:
-        self.tokens: List[Token] = tokens
+    def __init__(self, tokens: Union[TokenStream, List[Token]]) -> None:
+        if not isinstance(tokens, TokenStream):
+            tokens = TokenStream.from_tokens(tokens)
+        self.tokens: TokenStream = tokens
+        self.kinds = tokens.kinds
         self.pos: int = 0
+        self.debug_enabled = logger.isEnabledFor(logging.DEBUG)
 
     def peek(self) -> Token:
         return self.tokens[self.pos]
 
-    def consume(self, expected_type):
-        tok_type, value = self.peek()
-        if tok_type != expected_type:
-            raise SyntaxError(f'Token type {tok_type} is not expeted {expected_type}')
+    def peek_kind(self) -> int:
+        return self.kinds[self.pos]
+
+    def expect(self, expected_kind: int) -> None:
+        kind = self.kinds[self.pos]
+        if kind != expected_kind:
+            raise SyntaxError(f'Token type {KIND_NAMES[kind]} is not expeted {KIND_NAMES[expected_kind]}')
         self.pos += 1
-        return value
+
+    def consume(self, expected_kind: int) -> str:
+        self.expect(expected_kind)
+        if expected_kind == Kind.IDENT:
+            return self.tokens.name(self.pos - 1)
+        return self.tokens.text(self.pos - 1)
 
     def parse_statement(self) -> Stmt:
-        tok_type, _ = self.peek()
-        logger.debug(f'Parsing statement {tok_type}')
+        kind = self.kinds[self.pos]
+        if self.debug_enabled:
+            logger.debug('Parsing statement %s', KIND_NAMES[kind])
 
-        if tok_type == 'VAR':
+        if kind == Kind.VAR:
             return self.parse_var_decl()
-        elif tok_type == 'PRINT':
+        elif kind == Kind.PRINT:
             return self.parse_print()
-        elif tok_type == 'IF':
+        elif kind == Kind.IF:
             return  self.parse_if()
-        elif tok_type == 'WHILE':
+        elif kind == Kind.WHILE:
             return self.parse_while()
         else:
             raise SyntaxError("Unknown statement")
 
     def parse_block(self) -> Block:
         statements = []
-        self.consume('LBRACE')
-        tok_type = ''
-        while tok_type != 'RBRACE':
+        self.expect(Kind.LBRACE)
+        kind = None
+        while kind != Kind.RBRACE:
             statements.append(self.parse_statement())
-            tok_type, value = self.peek()
-        self.consume('RBRACE')
-        logger.debug(f'Parced block {statements}')
+            kind = self.kinds[self.pos]
+        self.expect(Kind.RBRACE)
+        if self.debug_enabled:
+            logger.debug('Parced block %s', statements)
         return Block(statements=statements)
 
     def parse_if(self) -> IfStmt:
-        self.consume('IF')
+        self.expect(Kind.IF)
         condition = self.parse_expr()
-        logger.debug(f'Parced if condition {condition}')
-        self.consume('COLON')
+        if self.debug_enabled:
+            logger.debug('Parced if condition %s', condition)
+        self.expect(Kind.COLON)
         block = self.parse_block()
-        logger.debug(f'Parced if block {block}')
-        tok_type, value = self.peek()
-        if tok_type == 'ELSE':
-            self.consume('ELSE')
+        if self.debug_enabled:
+            logger.debug('Parced if block %s', block)
+        if self.kinds[self.pos] == Kind.ELSE:
+            self.expect(Kind.ELSE)
             else_block = self.parse_block()
         else:
             else_block = Block([])
-        logger.debug(f'Parced else block {block}')
+        if self.debug_enabled:
+            logger.debug('Parced else block %s', block)
         return IfStmt(condition, block, else_block)
 
     def parse_while(self) -> WhileStmt:
-        self.consume('WHILE')
+        self.expect(Kind.WHILE)
         condition = self.parse_expr()
-        logger.debug(f'Parced While condition {condition}')
-        self.consume('COLON')
+        if self.debug_enabled:
+            logger.debug('Parced While condition %s', condition)
+        self.expect(Kind.COLON)
         block = self.parse_block()
-        logger.debug(f'Parced While block {block}')
+        if self.debug_enabled:
+            logger.debug('Parced While block %s', block)
         return WhileStmt(condition, block)
 
     def parse_var_decl(self) -> VarDecl:
-        self.consume('VAR')
-        name = self.consume('IDENT')
-        self.consume('ASSIGN')
+        self.expect(Kind.VAR)
+        name = self.consume(Kind.IDENT)
+        self.expect(Kind.ASSIGN)
         expr = self.parse_expr()
-        self.consume('SEMI')
+        self.expect(Kind.SEMI)
         return VarDecl(name, expr)
 
     def parse_print(self) -> Print:
-        self.consume('PRINT')
-        name = self.consume('IDENT')
+        self.expect(Kind.PRINT)
+        name = self.consume(Kind.IDENT)
         return Print(VarRef(name))
 
     def parse_expr(self) -> Expr | BinaryOp:
-        left = self.parse_term()
-        while self.pos < len(self.tokens):
-            tok_type, value = self.peek()
-            if tok_type in (
-                'PLUS', 'MINUS', 'MOD', 'MUL','DIV',
-                'AND', 'OR', 'XOR', 'SHL', 'SHR', 'ROL', 'ROR',
-                'GT', 'LT', 'GE', 'LE', 'EQ', 'NE'
-            ):
-                op = value
-                self.pos += 1
-                right = self.parse_term()
-                left = BinaryOp(left, op, right)
-            else:
-                break
-        return left
-
-    def parse_term(self) -> Expr:
-        tok_type, value = self.peek()
-
-        if tok_type == 'NOT':
-            self.pos += 1
-            expr = self.parse_term()
-            return BinaryOp(Number(0), value, expr)
-
-        if tok_type == 'NUMBER':
+        # Precedence climbing with explicit operand/operator stacks, so neither long operator
+        # chains nor deep nesting recurse. Every binary operator is left associative.
+        kinds = self.kinds
+        precedence_of = BINARY_PRECEDENCE.get
+        parse_term = self.parse_term
+        operands: List[Expr] = [parse_term()]
+        precedences: List[int] = []
+        ops: List[str] = []
+        precedence = precedence_of(kinds[self.pos])
+        while precedence is not None:
+            while precedences and precedences[-1] >= precedence:
+                precedences.pop()
+                right = operands.pop()
+                operands[-1] = BinaryOp(operands[-1], ops.pop(), right)
+            precedences.append(precedence)
+            ops.append(KIND_TEXT[kinds[self.pos]])
             self.pos += 1
-            return Number(int(value))
+            operands.append(parse_term())
+            precedence = precedence_of(kinds[self.pos])
+        while ops:
+            right = operands.pop()
+            operands[-1] = BinaryOp(operands[-1], ops.pop(), right)
+        return operands[0]
 
-        elif tok_type == 'IDENT':
+    def parse_term(self) -> Expr:
+        kinds = self.kinds
+        kind = kinds[self.pos]
+        self.pos += 1
+        if kind == Kind.IDENT:
+            return VarRef(self.tokens.name(self.pos - 1))
+        elif kind == Kind.NUMBER:
+            return Number(int(self.tokens.text(self.pos - 1)))
+        self.pos -= 1
+
+        nots = 0
+        while kinds[self.pos] == Kind.NOT:
+            nots += 1
             self.pos += 1
-            return VarRef(value)
-
-        elif tok_type in ('MUL', 'DIV'):
-            raise SyntaxError("Binary operator without left operand")
-
-        else:
+        if nots == 0:
+            if kind in (Kind.MUL, Kind.DIV):
+                raise SyntaxError("Binary operator without left operand")
             raise SyntaxError("Expected number or identifier")
 
+        term = self.parse_term()
+        for _ in range(nots):
+            term = BinaryOp(Number(0), KIND_TEXT[Kind.NOT], term)
+        return term
+
     def parse_program(self) -> Program:
         stmts = []
-        while self.peek()[0] != 'EOF':
-            logger.debug(f'Parsing program from token {self.peek()}')
+        while self.kinds[self.pos] != Kind.EOF:
+            if self.debug_enabled:
+                logger.debug('Parsing program from token %s', self.peek())
             stmts.append(self.parse_statement())
         return Program(stmts)
@@ -1,11 +1,13 @@
 from dataclasses import dataclass
 import logging
+from common.visitor import Dispatcher
 from frontend.ast_leg import VarDecl, BinaryOp, Number, VarRef, Program, Print, Node, IfStmt, Block, WhileStmt
 
 logger = logging.getLogger('semantic')
 
 @dataclass
 class Symbol:
+    __slots__ = ('name', 'slot')
     name: str
     slot: int
 
@@ -17,7 +19,7 @@ class SymbolTable:
     def declare(self, name) -> Symbol:
         sym = Symbol(name=name, slot=self.next_slot)
         if name in self.symbols:
-            logger.debug(f"{name} already declared {self.symbols}")
+            logger.debug("%s already declared %s", name, self.symbols)
         else:
             self.symbols[name] = sym
             self.next_slot += 1
@@ -33,43 +35,66 @@ class SymbolTable:
 
 
 class SemanticAnalyzer:
+    visitors = Dispatcher('SemanticAnalyzer', default=lambda self, node: None)
+
     def __init__(self):
         self.table = SymbolTable()
+        self.debug_enabled = logger.isEnabledFor(logging.DEBUG)
 
     def visit(self, node: Node) -> None:
-        logger.debug(f"Visiting {type(node).__name__}")
-
-        if isinstance(node, Program):
-            for s in node.statements:
-                self.visit(s)
-
-        elif isinstance(node, VarDecl):
-            self.table.declare(node.name)
-            logger.debug(f"{node.name} declared")
-            self.visit(node.expr)
-
-        elif isinstance(node, BinaryOp):
-            self.visit(node.left)
-            self.visit(node.right)
-
-        elif isinstance(node, VarRef):
-            self.table.lookup(node.name)
-
-        elif isinstance(node, IfStmt):
-            self.visit(node.condition)
-            self.visit(node.then_block)
-            self.visit(node.else_block)
-
-        elif isinstance(node, WhileStmt):
-            self.visit(node.condition)
-            self.visit(node.body_block)
-
-        elif isinstance(node, Block):
-            for block_node in node.statements:
-                self.visit(block_node)
-
-        elif isinstance(node, Number):
-            pass
-
-        elif isinstance(node, Print):
-            self.visit(node.expr)
+        if self.debug_enabled:
+            logger.debug("Visiting %s", type(node).__name__)
+        self.visitors(self, node)
+
+    @visitors.register(Program)
+    def visit_program(self, node: Program) -> None:
+        for s in node.statements:
+            self.visit(s)
+
+    @visitors.register(VarDecl)
+    def visit_var_decl(self, node: VarDecl) -> None:
+        self.table.declare(node.name)
+        if self.debug_enabled:
+            logger.debug("%s declared", node.name)
+        self.visit(node.expr)
+
+    # Operands are walked with an explicit stack, left before right, so expressions of any
+    # depth (a + a + ... or ~~~~a) are checked without recursion, as the parser builds them
+    @visitors.register(BinaryOp)
+    def visit_binary_op(self, node: BinaryOp) -> None:
+        stack = [node.right, node.left]
+        while stack:
+            operand = stack.pop()
+            if type(operand) is BinaryOp:
+                stack.append(operand.right)
+                stack.append(operand.left)
+            else:
+                self.visit(operand)
+
+    @visitors.register(VarRef)
+    def visit_var_ref(self, node: VarRef) -> None:
+        self.table.lookup(node.name)
+
+    @visitors.register(IfStmt)
+    def visit_if(self, node: IfStmt) -> None:
+        self.visit(node.condition)
+        self.visit(node.then_block)
+        self.visit(node.else_block)
+
+    @visitors.register(WhileStmt)
+    def visit_while(self, node: WhileStmt) -> None:
+        self.visit(node.condition)
+        self.visit(node.body_block)
+
+    @visitors.register(Block)
+    def visit_block(self, node: Block) -> None:
+        for block_node in node.statements:
+            self.visit(block_node)
+
+    @visitors.register(Number)
+    def visit_number(self, node: Number) -> None:
+        pass
+
+    @visitors.register(Print)
+    def visit_print(self, node: Print) -> None:
+        self.visit(node.expr)
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import sys
+from array import array
+from typing import Iterator, List, Optional, Tuple, Union
+
+Token = Tuple[str, str]  # (type, value)
+
+KIND_NAMES = (
+    'EOF', 'IDENT', 'NUMBER',
+    'PRINT', 'VAR', 'IF', 'ELSE', 'WHILE',
+    'SEMI', 'ASSIGN', 'LBRACE', 'RBRACE', 'LPAREN', 'RPAREN', 'COLON',
+    'PLUS', 'MINUS', 'MUL', 'DIV', 'MOD',
+    'AND', 'OR', 'XOR', 'NOT',
+    'SHL', 'SHR', 'ROL', 'ROR',
+    'EQ', 'NE', 'GE', 'LE', 'GT', 'LT',
+)
+KIND_IDS = {name: kind for kind, name in enumerate(KIND_NAMES)}
+
+
+class Kind:
+    EOF = KIND_IDS['EOF']
+    IDENT = KIND_IDS['IDENT']
+    NUMBER = KIND_IDS['NUMBER']
+    PRINT = KIND_IDS['PRINT']
+    VAR = KIND_IDS['VAR']
+    IF = KIND_IDS['IF']
+    ELSE = KIND_IDS['ELSE']
+    WHILE = KIND_IDS['WHILE']
+    SEMI = KIND_IDS['SEMI']
+    ASSIGN = KIND_IDS['ASSIGN']
+    LBRACE = KIND_IDS['LBRACE']
+    RBRACE = KIND_IDS['RBRACE']
+    LPAREN = KIND_IDS['LPAREN']
+    RPAREN = KIND_IDS['RPAREN']
+    COLON = KIND_IDS['COLON']
+    PLUS = KIND_IDS['PLUS']
+    MINUS = KIND_IDS['MINUS']
+    MUL = KIND_IDS['MUL']
+    DIV = KIND_IDS['DIV']
+    MOD = KIND_IDS['MOD']
+    AND = KIND_IDS['AND']
+    OR = KIND_IDS['OR']
+    XOR = KIND_IDS['XOR']
+    NOT = KIND_IDS['NOT']
+    SHL = KIND_IDS['SHL']
+    SHR = KIND_IDS['SHR']
+    ROL = KIND_IDS['ROL']
+    ROR = KIND_IDS['ROR']
+    EQ = KIND_IDS['EQ']
+    NE = KIND_IDS['NE']
+    GE = KIND_IDS['GE']
+    LE = KIND_IDS['LE']
+    GT = KIND_IDS['GT']
+    LT = KIND_IDS['LT']
+
+
+# Spelling of every kind whose text is fixed, so the parser never has to slice the source for them
+KIND_TEXT = {
+    Kind.PRINT: 'print', Kind.VAR: 'var', Kind.IF: 'if', Kind.ELSE: 'else', Kind.WHILE: 'while',
+    Kind.SEMI: ';', Kind.ASSIGN: '=', Kind.LBRACE: '{', Kind.RBRACE: '}',
+    Kind.LPAREN: '(', Kind.RPAREN: ')', Kind.COLON: ':',
+    Kind.PLUS: '+', Kind.MINUS: '-', Kind.MUL: '*', Kind.DIV: '/', Kind.MOD: '%',
+    Kind.AND: '&', Kind.OR: '|', Kind.XOR: '^', Kind.NOT: '~',
+    Kind.SHL: '<<', Kind.SHR: '>>', Kind.ROL: 'rol', Kind.ROR: 'ror',
+    Kind.EQ: '==', Kind.NE: '!=', Kind.GE: '>=', Kind.LE: '<=', Kind.GT: '>', Kind.LT: '<',
+    Kind.EOF: '',
+}
+
+
+# Token kinds in a byte array plus [start, end) offsets into the source. The source is a str
+# when it is pure ASCII (offsets are the same in both encodings), otherwise the raw bytes.
+# Text is only materialized by value() for the tokens the parser actually needs it for.
+class TokenStream:
+    __slots__ = ('source', 'kinds', 'starts', 'ends', 'values')
+
+    def __init__(self,
+                 source: Union[str, bytes],
+                 kinds: array,
+                 starts: array,
+                 ends: array,
+                 values: Optional[List[str]] = None) -> None:
+        self.source = source
+        self.kinds = kinds
+        self.starts = starts
+        self.ends = ends
+        self.values = values
+
+    @classmethod
+    def from_tokens(cls, tokens: List[Token]) -> TokenStream:
+        kinds = array('B', [KIND_IDS[tok_type] for tok_type, _ in tokens])
+        return cls('', kinds, array('I'), array('I'), values=[value for _, value in tokens])
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def __iter__(self) -> Iterator[Token]:
+        for i in range(len(self.kinds)):
+            yield KIND_NAMES[self.kinds[i]], self.value(i)
+
+    def __getitem__(self, index: int) -> Token:
+        return KIND_NAMES[self.kinds[index]], self.value(index)
+
+    def kind_name(self, index: int) -> str:
+        return KIND_NAMES[self.kinds[index]]
+
+    def value(self, index: int) -> str:
+        if self.values is not None:
+            return self.values[index]
+        text = KIND_TEXT.get(self.kinds[index])
+        if text is not None:
+            return text
+        return self.text(index)
+
+    def name(self, index: int) -> str:
+        # Identifiers are interned once here and the same str object is shared by the AST,
+        # the SymbolTable keys, IRBuilder.slots_map and IRSlot.name
+        return sys.intern(self.text(index))
+
+    def text(self, index: int) -> str:
+        # Source slice of an IDENT or NUMBER token
+        if self.values is not None:
+            return self.values[index]
+        text = self.source[self.starts[index]:self.ends[index]]
+        return text if isinstance(text, str) else text.decode('ascii')
+
+    def __repr__(self):
+        return f"TokenStream({len(self.kinds)} tokens)"
+
+
+__all__ = ['KIND_NAMES', 'KIND_IDS', 'KIND_TEXT', 'Kind', 'TokenStream']
@@ -1,12 +1,30 @@
 from .values import *
 from .instructions import *
 from .program import *
+from .soa import *
 from .builder import *
+from .cfg import *
+from .dataflow import *
+from .ssa import *
+from .constprop import *
+from .memopt import *
+from .gvn import *
+from .isel import *
+from .strength import *
 
 
 __all__ = (
     values.__all__
     + instructions.__all__
     + program.__all__
+    + soa.__all__
     + builder.__all__
+    + cfg.__all__
+    + dataflow.__all__
+    + ssa.__all__
+    + constprop.__all__
+    + memopt.__all__
+    + gvn.__all__
+    + isel.__all__
+    + strength.__all__
 )
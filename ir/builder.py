@@ -1,11 +1,13 @@
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
 from frontend.ast_leg import Expr, Number, VarRef, BinaryOp, Print, VarDecl, Program, IfStmt, WhileStmt
 from .instructions import *
 from .instructions import BranchIRInstruction, JumpIRInstruction, LabelIRInstruction
 from .values import *
 from .program import ProgrammIRInstruction
+from .soa import PackedProgram, OPERATOR_IDS, OP_CONST, OP_LOAD, OP_STORE, OP_BINOP, OP_PRINT, OP_LABEL, OP_JUMP, OP_BRANCH
 from frontend.symbol_table import SymbolTable
+from common.visitor import Dispatcher
 
 import logging
 
@@ -13,124 +15,224 @@ from .values import IRLabel
 
 logger = logging.getLogger('Builder')
 
+OP_INVERSION = {
+    '==': '!=',
+    '!=': '==',
+    '>=': '<',
+    '<=': '>',
+    '<': '>=',
+    '>': '<='
+}
+
 def invert_op_command(op) -> str:
-    op_inversion = {
-        '==': '!=',
-        '!=': '==',
-        '>=': '<',
-        '<=': '>',
-        '<': '>=',
-        '>': '<='
-    }
-    return op_inversion[op]
+    return OP_INVERSION[op]
+
+def _unknown_expr(builder, node):
+    raise NotImplementedError(f"Expression type {type(node)} not implemented")
+
+def _unknown_stmt(builder, node):
+    raise NotImplementedError(f"Statement type {type(node)} not implemented")
 
 class IRBuilder:
-    def __init__(self, symbol_table: SymbolTable):
+    expr_builders = Dispatcher('IRBuilder.build_expr', default=_unknown_expr)
+    stmt_builders = Dispatcher('IRBuilder.build_stmt', default=_unknown_stmt)
+
+    def __init__(self, symbol_table: SymbolTable, reorder_operands: bool = True):
         self.instructions: List[IRInstruction] = []
         self.temp_counter: int = 0
         self.label_counter: int = 0
         self.symbol_table: SymbolTable = symbol_table
         self.slots_map: dict[str, IRSlot] = {}
+        self.reorder_operands = reorder_operands
+        # Sethi-Ullman labels of the BinaryOp nodes seen so far, by id of the node
+        self.register_needs: Dict[int, int] = {}
+        self.debug_enabled = logger.isEnabledFor(logging.DEBUG)
 
     def get_slot(self, name: str) -> IRSlot:
         if name not in self.slots_map:
             index = self.symbol_table.lookup(name).slot
-            self.slots_map[name] = IRSlot(index=index, name=name)
-            logger.debug(f'Slotting IRSlot {name} {index}')
+            self.slots_map[name] = IRSlot.of(index, name)
+            if self.debug_enabled:
+                logger.debug('Slotting IRSlot %s %s', name, index)
         return self.slots_map[name]
 
     def new_temp(self) -> IRTemp:
-        logger.debug(f'Creating new temp: t{self.temp_counter}')
+        if self.debug_enabled:
+            logger.debug('Creating new temp: t%s', self.temp_counter)
         temp = IRTemp(self.temp_counter)
         self.temp_counter += 1
         return temp
 
     def new_label(self) -> IRLabel:
-        logger.debug(f'Creating new label: l{self.label_counter}')
+        if self.debug_enabled:
+            logger.debug('Creating new label: l%s', self.label_counter)
         label = IRLabel(self.label_counter)
         self.label_counter += 1
         return label
     
     def emit(self, instruction: IRInstruction) -> None:
-        logger.debug(f'Emitting instruction: {instruction}')
+        if self.debug_enabled:
+            logger.debug('Emitting instruction: %s', instruction)
         self.instructions.append(instruction)
 
+    # One emit_* per instruction kind, so a subclass can change the representation
+    def emit_const(self, value: int, dst: IRTemp) -> None:
+        self.emit(ConstIRInstruction(src=IRConst.of(value), dst=dst))
+
+    def emit_load(self, slot: IRSlot, dst: IRTemp) -> None:
+        self.emit(LoadIRInstruction(dst=dst, src=slot))
+
+    def emit_store(self, src: IRTemp, slot: IRSlot) -> None:
+        self.emit(StoreIRInstruction(src=src, dst=slot))
+
+    def emit_binop(self, op: str, left: IRTemp, right: IRTemp, dst: IRTemp) -> None:
+        self.emit(BinOpIRInstruction(left=left, right=right, op=op, dst=dst))
+
+    def emit_print(self, value: IRTemp) -> None:
+        self.emit(PrintIRInstruction(value=value))
+
+    def emit_label(self, label: IRLabel) -> None:
+        self.emit(LabelIRInstruction(label))
+
+    def emit_jump(self, label: IRLabel) -> None:
+        self.emit(JumpIRInstruction(label))
+
+    def emit_branch(self, op: str, left: IRTemp, right: IRTemp, label: IRLabel) -> None:
+        self.emit(BranchIRInstruction(left=left, right=right, op=op, label=label))
+
     def build_expr(self, node: Expr) -> IRTemp:
-        logger.debug(f'Building expression for node: {node}')
-        if isinstance(node, Number):
-            temp: IRTemp = self.new_temp()
-            constanta: IRConst = IRConst(value=node.value)
-            self.emit(ConstIRInstruction(src=constanta, dst=temp))
-            return temp
-        elif isinstance(node, VarRef):
-            slot = self.get_slot(node.name)
-            temp: IRTemp = self.new_temp()
-            self.emit(LoadIRInstruction(dst=temp, src=slot))
-            return temp
-        elif isinstance(node, BinaryOp):
-            left_temp = self.build_expr(node.left)
-            right_temp = self.build_expr(node.right)
-            result_temp: IRTemp = self.new_temp()
-            self.emit(BinOpIRInstruction(left=left_temp, right=right_temp, op=node.op, dst=result_temp))
-            return result_temp
-        else:
-            raise NotImplementedError(f"Expression type {type(node)} not implemented")
+        if self.debug_enabled:
+            logger.debug('Building expression for node: %s', node)
+        return self.expr_builders(self, node)
 
+    @expr_builders.register(Number)
+    def build_number(self, node: Number) -> IRTemp:
+        temp: IRTemp = self.new_temp()
+        self.emit_const(node.value, temp)
+        return temp
+
+    @expr_builders.register(VarRef)
+    def build_var_ref(self, node: VarRef) -> IRTemp:
+        slot = self.get_slot(node.name)
+        temp: IRTemp = self.new_temp()
+        self.emit_load(slot, temp)
+        return temp
+
+    # Registers needed to evaluate node without spilling: one for a leaf; for an operation,
+    # the larger need of its operands, or one more when both need the same. Computed
+    # bottom-up with an explicit stack, so deep expressions do not recurse.
+    def register_need(self, node: Expr) -> int:
+        if type(node) is not BinaryOp:
+            return 1
+        needs = self.register_needs
+        need = needs.get(id(node))
+        if need is not None:
+            return need
+        stack = [node]
+        while stack:
+            top = stack[-1]
+            pending = [operand for operand in (top.left, top.right)
+                       if type(operand) is BinaryOp and id(operand) not in needs]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            left = needs[id(top.left)] if type(top.left) is BinaryOp else 1
+            right = needs[id(top.right)] if type(top.right) is BinaryOp else 1
+            needs[id(top)] = left + 1 if left == right else max(left, right)
+        return needs[id(node)]
+
+    # Whether to evaluate right before left: the operand that needs more registers goes
+    # first, while the other one holds none (Sethi-Ullman order). Expressions have no side
+    # effects, so only the order of the IR changes, never the operands of the operation:
+    # this holds for - and << as much as for the commutative operators.
+    def right_first(self, left: Expr, right: Expr) -> bool:
+        return (self.reorder_operands and type(right) is BinaryOp
+                and self.register_need(right) > self.register_need(left))
+
+    def build_operands(self, left: Expr, right: Expr) -> Tuple[IRTemp, IRTemp]:
+        if self.right_first(left, right):
+            right_temp = self.build_expr(right)
+            return self.build_expr(left), right_temp
+        left_temp = self.build_expr(left)
+        return left_temp, self.build_expr(right)
+
+    # Post-order walk with an explicit stack instead of recursion, so expressions millions
+    # of operands long or deep build like short ones. Each operation is visited twice: first
+    # to push its operands in evaluation order, then, with their temps on results, to emit
+    # it. Leaves go through expr_builders.
+    @expr_builders.register(BinaryOp)
+    def build_binary_op(self, node: BinaryOp) -> IRTemp:
+        results: List[IRTemp] = []
+        # (node, None) is still to expand; (node, swapped) has its operands built
+        stack: List[Tuple[Expr, Optional[bool]]] = [(node, None)]
+        while stack:
+            current, swapped = stack.pop()
+            if type(current) is not BinaryOp:
+                results.append(self.expr_builders(self, current))
+            elif swapped is None:
+                swapped = self.right_first(current.left, current.right)
+                stack.append((current, swapped))
+                if swapped:
+                    stack.append((current.left, None))
+                    stack.append((current.right, None))
+                else:
+                    stack.append((current.right, None))
+                    stack.append((current.left, None))
+            else:
+                second = results.pop()
+                first = results.pop()
+                left_temp, right_temp = (second, first) if swapped else (first, second)
+                result_temp: IRTemp = self.new_temp()
+                self.emit_binop(current.op, left_temp, right_temp, result_temp)
+                results.append(result_temp)
+        return results[0]
+
+    @stmt_builders.register(WhileStmt)
     def build_while_stmt(self, node:WhileStmt):
         start_label = self.new_label()
         stop_label = self.new_label()
-        self.emit(LabelIRInstruction(start_label))
-        self.emit(
-            BranchIRInstruction(
-                left=self.build_expr(node.condition.left),
-                right=self.build_expr(node.condition.right),
-                op=invert_op_command(node.condition.op),
-                label=stop_label
-            )
-        )
+        self.emit_label(start_label)
+        left_temp, right_temp = self.build_operands(node.condition.left, node.condition.right)
+        self.emit_branch(invert_op_command(node.condition.op), left_temp, right_temp, stop_label)
         for stmt in node.body_block.statements:
             self.build_stmt(stmt)
-        self.emit(JumpIRInstruction(start_label))
-        self.emit(LabelIRInstruction(stop_label))
+        self.emit_jump(start_label)
+        self.emit_label(stop_label)
 
+    @stmt_builders.register(IfStmt)
     def build_if_stmt(self, node:IfStmt):
         else_label = self.new_label()
         end_label = self.new_label()
-        self.emit(
-            BranchIRInstruction(
-                left=self.build_expr(node.condition.left),
-                right=self.build_expr(node.condition.right),
-                op=invert_op_command(node.condition.op),
-                label=else_label
-            )
-        )
+        left_temp, right_temp = self.build_operands(node.condition.left, node.condition.right)
+        self.emit_branch(invert_op_command(node.condition.op), left_temp, right_temp, else_label)
         for stmt in node.then_block.statements:
             self.build_stmt(stmt)
-        self.emit(JumpIRInstruction(end_label))
-        self.emit(LabelIRInstruction(else_label))
+        self.emit_jump(end_label)
+        self.emit_label(else_label)
         if node.else_block.statements:
             for stmt in node.else_block.statements:
                 self.build_stmt(stmt)
-        self.emit(LabelIRInstruction(end_label))
+        self.emit_label(end_label)
 
     def build_stmt(self, node) -> None:
-        logger.debug(f'Building statement for node: {node}')
-        if isinstance(node, VarDecl):
-            expr_temp: IRTemp = self.build_expr(node.expr)
-            slot = self.get_slot(node.name)
-            self.emit(StoreIRInstruction(src=expr_temp, dst=slot))
-        elif isinstance(node, IfStmt):
-            self.build_if_stmt(node)
-        elif isinstance(node, WhileStmt):
-            self.build_while_stmt(node)
-        elif isinstance(node, Print):
-            expr_temp: IRTemp = self.build_expr(node.expr)
-            self.emit(PrintIRInstruction(value=expr_temp))
-        else:
-            raise NotImplementedError(f"Statement type {type(node)} not implemented")
+        if self.debug_enabled:
+            logger.debug('Building statement for node: %s', node)
+        self.stmt_builders(self, node)
+
+    @stmt_builders.register(VarDecl)
+    def build_var_decl(self, node: VarDecl) -> None:
+        expr_temp: IRTemp = self.build_expr(node.expr)
+        slot = self.get_slot(node.name)
+        self.emit_store(expr_temp, slot)
+
+    @stmt_builders.register(Print)
+    def build_print(self, node: Print) -> None:
+        expr_temp: IRTemp = self.build_expr(node.expr)
+        self.emit_print(expr_temp)
         
     def build_program(self, ast_tree: Program) -> ProgrammIRInstruction:
-        logger.debug(f'Building program {ast_tree}')
+        logger.debug('Building program %s', ast_tree)
         if self.instructions:
             raise Exception('IRBuilder can only build one program per instance.')
         for stmt in ast_tree.statements:
@@ -139,5 +241,57 @@ class IRBuilder:
             instructions=self.instructions,
             slots=list(self.slots_map.values())
         )
-    
-__all__ = ['IRBuilder']
\ No newline at end of file
+
+
+# Builds straight into a PackedProgram: temps and labels are plain ints and no
+# instruction objects are created.
+class PackedIRBuilder(IRBuilder):
+    def __init__(self, symbol_table: SymbolTable, reorder_operands: bool = True):
+        super().__init__(symbol_table, reorder_operands)
+        self.program = PackedProgram()
+
+    def new_temp(self) -> int:
+        temp = self.temp_counter
+        self.temp_counter += 1
+        return temp
+
+    def new_label(self) -> int:
+        label = self.label_counter
+        self.label_counter += 1
+        return label
+
+    def emit_const(self, value: int, dst: int) -> None:
+        self.program.append(OP_CONST, dst=dst, imm=value)
+
+    def emit_load(self, slot: IRSlot, dst: int) -> None:
+        self.program.append(OP_LOAD, dst=dst, imm=slot.index)
+
+    def emit_store(self, src: int, slot: IRSlot) -> None:
+        self.program.append(OP_STORE, src1=src, imm=slot.index)
+
+    def emit_binop(self, op: str, left: int, right: int, dst: int) -> None:
+        self.program.append(OP_BINOP, OPERATOR_IDS[op], dst=dst, src1=left, src2=right)
+
+    def emit_print(self, value: int) -> None:
+        self.program.append(OP_PRINT, src1=value)
+
+    def emit_label(self, label: int) -> None:
+        self.program.append(OP_LABEL, label=label)
+
+    def emit_jump(self, label: int) -> None:
+        self.program.append(OP_JUMP, label=label)
+
+    def emit_branch(self, op: str, left: int, right: int, label: int) -> None:
+        self.program.append(OP_BRANCH, OPERATOR_IDS[op], src1=left, src2=right, label=label)
+
+    def build_program(self, ast_tree: Program) -> PackedProgram:
+        if len(self.program):
+            raise Exception('IRBuilder can only build one program per instance.')
+        for stmt in ast_tree.statements:
+            self.build_stmt(stmt)
+        for slot in self.slots_map.values():
+            self.program.add_slot(slot)
+        return self.program
+
+
+__all__ = ['IRBuilder', 'PackedIRBuilder']
\ No newline at end of file
@@ -0,0 +1,285 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+from .instructions import BranchIRInstruction, JumpIRInstruction, LabelIRInstruction
+from .program import ProgrammIRInstruction
+from .soa import PackedProgram, OP_LABEL, OP_JUMP, OP_BRANCH
+
+import logging
+logger = logging.getLogger('CFG')
+
+# Control flow of one IR position, as far as splitting into blocks is concerned
+FLOW_NONE = 0
+FLOW_LABEL = 1
+FLOW_JUMP = 2
+FLOW_BRANCH = 3
+
+_PACKED_FLOW = {OP_LABEL: FLOW_LABEL, OP_JUMP: FLOW_JUMP, OP_BRANCH: FLOW_BRANCH}
+
+
+# Instructions start..end - 1 of the program. A block opens at a label or after a jump or
+# branch, and only its last instruction transfers control. successors lists the
+# fall-through block first, then the branch or jump target.
+@dataclass
+class BasicBlock:
+    __slots__ = ('index', 'start', 'end', 'label', 'successors', 'predecessors')
+    index: int
+    start: int
+    end: int
+    # Label index when the block opens with a label, else None
+    label: Optional[int]
+    successors: List[int]
+    predecessors: List[int]
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+
+# A natural loop: header dominates every block of the loop, latches jump back to it
+@dataclass
+class Loop:
+    header: int
+    latches: List[int]
+    blocks: Set[int]
+    # Index of the innermost enclosing loop in ControlFlowGraph.loops(), None at top level
+    parent: Optional[int] = None
+    depth: int = 1
+
+
+@dataclass
+class ControlFlowGraph:
+    program: ProgrammIRInstruction | PackedProgram = field(repr=False)
+    blocks: List[BasicBlock] = field(default_factory=list)
+    block_of_label: Dict[int, int] = field(default_factory=dict)
+    # Computed on first use
+    _order: Optional[List[int]] = field(default=None, repr=False)
+    _idom: Optional[List[int]] = field(default=None, repr=False)
+    # Pre- and postorder numbers of each block in the dominator tree
+    _dom_pre: Optional[List[int]] = field(default=None, repr=False)
+    _dom_post: Optional[List[int]] = field(default=None, repr=False)
+    _loops: Optional[List[Loop]] = field(default=None, repr=False)
+
+    @property
+    def entry(self) -> Optional[BasicBlock]:
+        return self.blocks[0] if self.blocks else None
+
+    def block_at(self, position: int) -> BasicBlock:
+        # Binary search over block starts
+        low, high = 0, len(self.blocks) - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.blocks[middle].start <= position:
+                low = middle
+            else:
+                high = middle - 1
+        return self.blocks[low]
+
+    def reverse_postorder(self) -> List[int]:
+        # Blocks reachable from the entry; unreachable ones are left out. Targets are
+        # explored before fall-through, so a while exit comes after the whole loop body
+        # rather than ahead of it.
+        if self._order is None:
+            order: List[int] = []
+            if self.blocks:
+                visited = [False] * len(self.blocks)
+                visited[0] = True
+                stack = [(0, reversed(self.blocks[0].successors))]
+                while stack:
+                    index, successors = stack[-1]
+                    for successor in successors:
+                        if not visited[successor]:
+                            visited[successor] = True
+                            stack.append((successor, reversed(self.blocks[successor].successors)))
+                            break
+                    else:
+                        stack.pop()
+                        order.append(index)
+                order.reverse()
+            self._order = order
+        return self._order
+
+    def immediate_dominators(self) -> List[int]:
+        # Cooper, Harvey and Kennedy's iterative algorithm over the reverse postorder. The
+        # entry is its own dominator; unreachable blocks get -1. Structured code such as
+        # the builder's if/while converges in two passes.
+        if self._idom is None:
+            order = self.reverse_postorder()
+            rank = [-1] * len(self.blocks)
+            for number, index in enumerate(order):
+                rank[index] = number
+            idom = [-1] * len(self.blocks)
+            if order:
+                idom[order[0]] = order[0]
+            changed = True
+            while changed:
+                changed = False
+                for index in order[1:]:
+                    new_idom = -1
+                    for predecessor in self.blocks[index].predecessors:
+                        if idom[predecessor] == -1:
+                            continue
+                        if new_idom == -1:
+                            new_idom = predecessor
+                            continue
+                        a, b = predecessor, new_idom
+                        while a != b:
+                            while rank[a] > rank[b]:
+                                a = idom[a]
+                            while rank[b] > rank[a]:
+                                b = idom[b]
+                        new_idom = a
+                    if idom[index] != new_idom:
+                        idom[index] = new_idom
+                        changed = True
+            self._idom = idom
+        return self._idom
+
+    def dominates(self, a: int, b: int) -> bool:
+        # a dominates b iff b lies in the subtree of a in the dominator tree. Walking idom
+        # instead would be linear in the tree depth, which grows with straight-line code.
+        if self._dom_pre is None:
+            self.number_dominator_tree()
+        pre = self._dom_pre
+        return pre[b] != -1 and pre[a] <= pre[b] and self._dom_post[b] <= self._dom_post[a]
+
+    def number_dominator_tree(self) -> None:
+        idom = self.immediate_dominators()
+        children: List[List[int]] = [[] for _ in self.blocks]
+        for index in self.reverse_postorder()[1:]:
+            children[idom[index]].append(index)
+        pre = [-1] * len(self.blocks)
+        post = [-1] * len(self.blocks)
+        counter = 0
+        if self.blocks:
+            stack = [(0, iter(children[0]))]
+            pre[0] = counter
+            counter += 1
+            while stack:
+                index, pending = stack[-1]
+                child = next(pending, None)
+                if child is None:
+                    stack.pop()
+                    post[index] = counter
+                    counter += 1
+                else:
+                    pre[child] = counter
+                    counter += 1
+                    stack.append((child, iter(children[child])))
+        self._dom_pre, self._dom_post = pre, post
+
+    def loops(self) -> List[Loop]:
+        # One loop per header, with the bodies of all its back edges merged; outer loops
+        # come before the loops nested in them
+        if self._loops is None:
+            by_header: Dict[int, Loop] = {}
+            for index in self.reverse_postorder():
+                for successor in self.blocks[index].successors:
+                    if self.dominates(successor, index):
+                        loop = by_header.get(successor)
+                        if loop is None:
+                            loop = by_header[successor] = Loop(header=successor, latches=[], blocks={successor})
+                        loop.latches.append(index)
+                        self.collect_loop_body(loop, index)
+            loops = sorted(by_header.values(), key=lambda loop: -len(loop.blocks))
+            innermost: Dict[int, int] = {}
+            for number, loop in enumerate(loops):
+                # Bigger loops were seen first, so the current owner of the header encloses it
+                parent = innermost.get(loop.header)
+                if parent is not None:
+                    loop.parent = parent
+                    loop.depth = loops[parent].depth + 1
+                for index in loop.blocks:
+                    innermost[index] = number
+            self._loops = loops
+        return self._loops
+
+    def collect_loop_body(self, loop: Loop, latch: int) -> None:
+        stack = [latch]
+        while stack:
+            index = stack.pop()
+            if index in loop.blocks:
+                continue
+            loop.blocks.add(index)
+            stack.extend(self.blocks[index].predecessors)
+
+    def loop_depths(self) -> List[int]:
+        depths = [0] * len(self.blocks)
+        for loop in self.loops():
+            for index in loop.blocks:
+                depths[index] = max(depths[index], loop.depth)
+        return depths
+
+
+# Splits a program into basic blocks and links them, in one pass over the instructions
+# and one over the blocks
+class CFGBuilder:
+    def __init__(self,
+                 program: ProgrammIRInstruction | PackedProgram):
+        self.program = program
+
+    def flow(self) -> List[tuple]:
+        # (position, FLOW_*, label index) of every label, jump and branch
+        if isinstance(self.program, PackedProgram):
+            labels = self.program.label
+            return [(position, _PACKED_FLOW[opcode], labels[position])
+                    for position, opcode in enumerate(self.program.opcodes) if opcode in _PACKED_FLOW]
+        flow = []
+        for position, instr in enumerate(self.program.instructions):
+            instr_type = type(instr)
+            if instr_type is LabelIRInstruction:
+                flow.append((position, FLOW_LABEL, instr.label.index))
+            elif instr_type is JumpIRInstruction:
+                flow.append((position, FLOW_JUMP, instr.label.index))
+            elif instr_type is BranchIRInstruction:
+                flow.append((position, FLOW_BRANCH, instr.label.index))
+        return flow
+
+    def build(self) -> ControlFlowGraph:
+        logger.info('Building control flow graph')
+        cfg = ControlFlowGraph(program=self.program)
+        size = len(self.program) if isinstance(self.program, PackedProgram) else len(self.program.instructions)
+        if size == 0:
+            return cfg
+
+        blocks = cfg.blocks
+        # Last transfer of control of each block, indexed like blocks
+        exits: List[Optional[tuple]] = []
+        start = 0
+        label: Optional[int] = None
+        for position, kind, target in self.flow():
+            if kind == FLOW_LABEL:
+                if position > start:
+                    blocks.append(BasicBlock(len(blocks), start, position, label, [], []))
+                    exits.append(None)
+                start, label = position, target
+                cfg.block_of_label[target] = len(blocks)
+            else:
+                blocks.append(BasicBlock(len(blocks), start, position + 1, label, [], []))
+                exits.append((kind, target))
+                start, label = position + 1, None
+        if start < size:
+            blocks.append(BasicBlock(len(blocks), start, size, label, [], []))
+            exits.append(None)
+
+        last = len(blocks) - 1
+        for block, transfer in zip(blocks, exits):
+            successors = block.successors
+            if transfer is None or transfer[0] == FLOW_BRANCH:
+                if block.index < last:
+                    successors.append(block.index + 1)
+            if transfer is not None:
+                target = cfg.block_of_label[transfer[1]]
+                if target not in successors:
+                    successors.append(target)
+            for successor in successors:
+                blocks[successor].predecessors.append(block.index)
+        return cfg
+
+
+def build_cfg(program: ProgrammIRInstruction | PackedProgram) -> ControlFlowGraph:
+    return CFGBuilder(program).build()
+
+
+__all__ = ['BasicBlock', 'Loop', 'ControlFlowGraph', 'CFGBuilder', 'build_cfg']
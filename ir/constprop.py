@@ -0,0 +1,230 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from heapq import heappop, heappush
+from typing import Dict, List, Optional, Tuple
+
+from backend.isa import ALUOp, ALU_OP_MAP, BRANCH_OP_MAP
+from common.tracing import tracer
+from sim.alu import MASK, alu, branch_taken
+from .cfg import BasicBlock, ControlFlowGraph, build_cfg
+from .instructions import *
+from .instructions import BranchIRInstruction, JumpIRInstruction, LabelIRInstruction
+from .program import ProgrammIRInstruction
+from .ssa import remove_dead_values
+from .values import *
+
+import logging
+logger = logging.getLogger('Constant Propagation')
+
+# Lattice value of a temp or slot holding different values on different paths. A value
+# that is an int is known at compile time; a slot missing from a state is VARYING.
+VARYING = None
+
+# Known values of the slots at one point, by slot index
+SlotState = Dict[int, int]
+
+
+@dataclass
+class ConstantPropagationStats:
+    # Operations and loads replaced by their value
+    folded: int = 0
+    loads: int = 0
+    # Branches turned into jumps (always taken) or dropped (never taken)
+    branches: int = 0
+    unreachable_blocks: int = 0
+    instructions_before: int = 0
+    instructions_after: int = 0
+
+    @property
+    def removed(self) -> int:
+        return self.instructions_before - self.instructions_after
+
+
+# Sparse conditional constant propagation (Wegman and Zadeck) over the slots. Each block
+# is entered with the values the slots are known to hold there, starting from all zero at
+# the entry, and only the edges a branch can actually take carry a state on: a branch
+# whose operands are known goes one way, so code it never reaches neither runs nor spoils
+# the values at the joins. The worklist is ordered by reverse postorder like the dataflow
+# solver's, and a block is revisited only when the state entering it drops.
+#
+# Operations are evaluated with sim.alu, the arithmetic of the simulators, through the
+# Lowerer's operator maps, so a folded value is bit for bit the one the program would
+# compute. Temps are only followed within their block, which is all the builder's IR
+# needs; a temp read in another block is taken as VARYING.
+class ConstantPropagator:
+    def __init__(self, program: ProgrammIRInstruction):
+        self.program = program
+        self.cfg: ControlFlowGraph = build_cfg(program)
+        self.stats = ConstantPropagationStats(instructions_before=len(program.instructions))
+
+    def run(self) -> ProgrammIRInstruction:
+        logger.info('Propagating constants over %s blocks', len(self.cfg.blocks))
+        states = self.solve()
+        program = self.rewrite(states)
+        stats = self.stats
+        stats.instructions_after = len(program.instructions)
+        logger.info('Constant propagation removed %s of %s instructions (%s folded, %s loads, '
+                    '%s branches, %s unreachable blocks)', stats.removed, stats.instructions_before,
+                    stats.folded, stats.loads, stats.branches, stats.unreachable_blocks)
+        if tracer.enabled:
+            tracer.count('constprop.removed', stats.removed)
+            tracer.count('constprop.folded', stats.folded + stats.loads)
+            tracer.count('constprop.branches', stats.branches)
+        return program
+
+    def solve(self) -> List[Optional[SlotState]]:
+        # State entering each block; None for blocks no executable edge reaches
+        blocks = self.cfg.blocks
+        states: List[Optional[SlotState]] = [None] * len(blocks)
+        if not blocks:
+            return states
+        order = self.cfg.reverse_postorder()
+        rank = [0] * len(blocks)
+        for number, index in enumerate(order):
+            rank[index] = number
+
+        states[0] = {slot.index: 0 for slot in self.program.slots}
+        worklist = [rank[0]]
+        queued = [False] * len(blocks)
+        queued[0] = True
+        while worklist:
+            index = order[heappop(worklist)]
+            queued[index] = False
+            block = blocks[index]
+            state = dict(states[index])
+            temps: Dict[int, int] = {}
+            for position in range(block.start, block.end):
+                self.evaluate(self.program.instructions[position], state, temps)
+            for successor in self.executable_successors(block, temps):
+                merged = self.meet(states[successor], state)
+                if merged is not None:
+                    states[successor] = merged
+                    if not queued[successor]:
+                        queued[successor] = True
+                        heappush(worklist, rank[successor])
+        return states
+
+    @staticmethod
+    def meet(current: Optional[SlotState], incoming: SlotState) -> Optional[SlotState]:
+        # The new state entering a block, or None when it does not change
+        if current is None:
+            return dict(incoming)
+        merged = {slot: value for slot, value in current.items() if incoming.get(slot, VARYING) == value}
+        return merged if len(merged) != len(current) else None
+
+    def evaluate(self, instr: IRInstruction, state: SlotState, temps: Dict[int, int]) -> Optional[int]:
+        # Applies instr to state and temps; returns the value it defines, if known
+        instr_type = type(instr)
+        value = VARYING
+        if instr_type is ConstIRInstruction:
+            value = instr.src.value & MASK
+        elif instr_type is LoadIRInstruction:
+            value = state.get(instr.src.index, VARYING)
+        elif instr_type is BinOpIRInstruction:
+            left = self.operand(instr.left, temps)
+            right = self.operand(instr.right, temps)
+            if left is not VARYING and right is not VARYING:
+                value = alu(ALU_OP_MAP.get(instr.op, ALUOp.ADD), left, right)
+        elif instr_type is CopyIRInstruction:
+            value = temps.get(instr.src.id, VARYING)
+        elif instr_type is StoreIRInstruction:
+            stored = self.operand(instr.src, temps)
+            if stored is VARYING:
+                state.pop(instr.dst.index, None)
+            else:
+                state[instr.dst.index] = stored
+            return VARYING
+        for temp in instr.defined_temps():
+            if value is VARYING:
+                temps.pop(temp.id, None)
+            else:
+                temps[temp.id] = value
+        return value
+
+    @staticmethod
+    def operand(value: IRValue, temps: Dict[int, int]) -> Optional[int]:
+        if isinstance(value, IRConst):
+            return value.value & MASK
+        return temps.get(value.id, VARYING)
+
+    def branch_outcome(self, instr: BranchIRInstruction, temps: Dict[int, int]) -> Optional[bool]:
+        # Whether the branch is taken, None when that depends on the run
+        left = self.operand(instr.left, temps)
+        right = self.operand(instr.right, temps)
+        if left is VARYING or right is VARYING:
+            return None
+        return branch_taken(BRANCH_OP_MAP[instr.op], left, right)
+
+    def executable_successors(self, block: BasicBlock, temps: Dict[int, int]) -> List[int]:
+        last = self.program.instructions[block.end - 1]
+        if type(last) is BranchIRInstruction:
+            taken = self.branch_outcome(last, temps)
+            if taken is True:
+                return [self.cfg.block_of_label[last.label.index]]
+            if taken is False:
+                return [block.index + 1] if block.index + 1 < len(self.cfg.blocks) else []
+        return block.successors
+
+    def rewrite(self, states: List[Optional[SlotState]]) -> ProgrammIRInstruction:
+        stats = self.stats
+        instructions = self.program.instructions
+        result: List[IRInstruction] = []
+        for block, state in zip(self.cfg.blocks, states):
+            if state is None:
+                # No executable edge enters it, so neither does any jump left in the program
+                stats.unreachable_blocks += 1
+                continue
+            state = dict(state)
+            temps: Dict[int, int] = {}
+            for position in range(block.start, block.end):
+                instr = instructions[position]
+                instr_type = type(instr)
+                if instr_type is BranchIRInstruction:
+                    taken = self.branch_outcome(instr, temps)
+                    if taken is not None:
+                        stats.branches += 1
+                        if taken:
+                            result.append(JumpIRInstruction(label=instr.label))
+                        continue
+                value = self.evaluate(instr, state, temps)
+                if value is not VARYING and instr_type in (BinOpIRInstruction, LoadIRInstruction):
+                    if instr_type is BinOpIRInstruction:
+                        stats.folded += 1
+                    else:
+                        stats.loads += 1
+                    instr = ConstIRInstruction(src=IRConst.of(value), dst=instr.dst)
+                result.append(instr)
+        # The operands of what was folded are now unused
+        result = remove_dead_values(remove_jumps_to_next(result))
+        return ProgrammIRInstruction(instructions=result, slots=self.program.slots)
+
+
+# Drops jumps to a label that directly follows them (labels only in between), as left by
+# an if whose else branch was removed
+def remove_jumps_to_next(instructions: List[IRInstruction]) -> List[IRInstruction]:
+    result: List[IRInstruction] = []
+    for position, instr in enumerate(instructions):
+        if type(instr) is JumpIRInstruction and jumps_to_next(instructions, position):
+            continue
+        result.append(instr)
+    return result
+
+
+def jumps_to_next(instructions: List[IRInstruction], position: int) -> bool:
+    target = instructions[position].label.index
+    for following in range(position + 1, len(instructions)):
+        instr = instructions[following]
+        if type(instr) is not LabelIRInstruction:
+            return False
+        if instr.label.index == target:
+            return True
+    return False
+
+
+def propagate_constants(program: ProgrammIRInstruction) -> Tuple[ProgrammIRInstruction, ConstantPropagationStats]:
+    propagator = ConstantPropagator(program)
+    return propagator.run(), propagator.stats
+
+
+__all__ = ['ConstantPropagationStats', 'ConstantPropagator', 'remove_jumps_to_next', 'propagate_constants']
@@ -0,0 +1,294 @@
+from __future__ import annotations
+
+from bisect import bisect_left
+from heapq import heappop, heappush
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .cfg import BasicBlock, ControlFlowGraph
+from .instructions import *
+from .program import ProgrammIRInstruction
+from .soa import PackedProgram, NO_TEMP, OP_LOAD, OP_STORE
+
+import logging
+logger = logging.getLogger('Dataflow')
+
+
+# Sets are Python ints used as bitsets: bit i stands for temp i, slot i or definition i,
+# depending on the problem. Union, intersection and difference are then single big-int
+# operations instead of per-element work.
+def bits(mask: int) -> Iterator[int]:
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+# A problem gives the direction, the meet and, per block, gen and kill. The transfer
+# function of a block is out = gen | (in & ~kill), with in and out taken in the direction
+# of the problem.
+class DataflowProblem:
+    forward = True
+    # Union for "may" problems (liveness, reaching definitions), intersection for "must"
+    meet_union = True
+
+    def __init__(self, cfg: ControlFlowGraph):
+        self.cfg = cfg
+
+    def boundary(self) -> int:
+        # Value flowing into the entry (forward) or out of blocks without successors (backward)
+        return 0
+
+    def top(self) -> int:
+        # Initial value of every block; the identity of the meet
+        return 0
+
+    def gen_kill(self, block: BasicBlock) -> Tuple[int, int]:
+        raise NotImplementedError(f'{type(self).__name__} does not define gen_kill')
+
+
+@dataclass
+class DataflowResult:
+    # Value at the start and at the end of each block, whatever the direction
+    block_in: List[int]
+    block_out: List[int]
+    # Transfer functions applied until the fixed point
+    visits: int = 0
+
+
+# Worklist solver. The worklist is a heap keyed by the position of the block in reverse
+# postorder (postorder for backward problems), so a block is only revisited once every
+# block before it has settled: acyclic regions take one visit and each loop one more
+# round per nesting level. A FIFO worklist would instead let every change inside a loop
+# ripple through the whole rest of the program again.
+class DataflowSolver:
+    def __init__(self, problem: DataflowProblem):
+        self.problem = problem
+
+    def solve(self) -> DataflowResult:
+        problem = self.problem
+        blocks = problem.cfg.blocks
+        count = len(blocks)
+        logger.info('Solving %s over %s blocks', type(problem).__name__, count)
+        gen: List[int] = []
+        kill: List[int] = []
+        for block in blocks:
+            block_gen, block_kill = problem.gen_kill(block)
+            gen.append(block_gen)
+            kill.append(block_kill)
+
+        order = problem.cfg.reverse_postorder()
+        if len(order) < count:
+            reached = set(order)
+            order = order + [index for index in range(count) if index not in reached]
+        if problem.forward:
+            sources = [block.predecessors for block in blocks]
+            targets = [block.successors for block in blocks]
+            edge = [block.index == 0 for block in blocks]
+        else:
+            order = order[::-1]
+            sources = [block.successors for block in blocks]
+            targets = [block.predecessors for block in blocks]
+            edge = [not block.successors for block in blocks]
+
+        rank = [0] * count
+        for number, index in enumerate(order):
+            rank[index] = number
+
+        top, boundary, union = problem.top(), problem.boundary(), problem.meet_union
+        before = [top] * count
+        after = [top] * count
+        worklist = list(range(count))
+        queued = [True] * count
+        visits = 0
+        while worklist:
+            index = order[heappop(worklist)]
+            queued[index] = False
+            visits += 1
+            incoming = sources[index]
+            if edge[index]:
+                value = boundary
+                if union:
+                    for source in incoming:
+                        value |= after[source]
+                else:
+                    for source in incoming:
+                        value &= after[source]
+            elif not incoming:
+                value = top
+            elif union:
+                value = 0
+                for source in incoming:
+                    value |= after[source]
+            else:
+                value = after[incoming[0]]
+                for source in incoming[1:]:
+                    value &= after[source]
+            before[index] = value
+            value = gen[index] | (value & ~kill[index])
+            if value != after[index]:
+                after[index] = value
+                for target in targets[index]:
+                    if not queued[target]:
+                        queued[target] = True
+                        heappush(worklist, rank[target])
+
+        if problem.forward:
+            return DataflowResult(block_in=before, block_out=after, visits=visits)
+        return DataflowResult(block_in=after, block_out=before, visits=visits)
+
+
+def solve(problem: DataflowProblem) -> DataflowResult:
+    return DataflowSolver(problem).solve()
+
+
+# Temps read and written by each instruction, for both IR forms
+def temp_effects(program: ProgrammIRInstruction | PackedProgram) -> Iterator[Tuple[List[int], List[int]]]:
+    if isinstance(program, PackedProgram):
+        for src1, src2, dst in zip(program.src1, program.src2, program.dst):
+            used = [temp for temp in (src1, src2) if temp != NO_TEMP]
+            yield used, ([dst] if dst != NO_TEMP else [])
+        return
+    for instr in program.instructions:
+        yield [temp.id for temp in instr.used_temps()], [temp.id for temp in instr.defined_temps()]
+
+
+# Slot loaded and slot stored by each instruction, -1 for none
+def slot_effects(program: ProgrammIRInstruction | PackedProgram) -> Iterator[Tuple[int, int]]:
+    if isinstance(program, PackedProgram):
+        for opcode, imm in zip(program.opcodes, program.imm):
+            if opcode == OP_LOAD:
+                yield imm, -1
+            elif opcode == OP_STORE:
+                yield -1, imm
+            else:
+                yield -1, -1
+        return
+    for instr in program.instructions:
+        instr_type = type(instr)
+        if instr_type is LoadIRInstruction:
+            yield instr.src.index, -1
+        elif instr_type is StoreIRInstruction:
+            yield -1, instr.dst.index
+        else:
+            yield -1, -1
+
+
+# Backward problems see each block's instructions in reverse, so the per-instruction
+# effects are collected once and sliced per block
+class _LocalEffects(DataflowProblem):
+    forward = False
+
+    def __init__(self, cfg: ControlFlowGraph):
+        super().__init__(cfg)
+        self.effects = list(self.collect_effects())
+
+    def collect_effects(self) -> Iterator:
+        raise NotImplementedError(f'{type(self).__name__} does not define collect_effects')
+
+
+# Only temps read in a block other than the one defining them can be live across blocks,
+# and only those get a bit: bit i is temp members[i]. Numbering them densely keeps the
+# bitsets short; bits indexed by temp id would grow with the program.
+class TempLiveness(_LocalEffects):
+    def __init__(self, cfg: ControlFlowGraph):
+        super().__init__(cfg)
+        self.members: List[int] = []
+        self.bit_of: Dict[int, int] = {}
+        effects = self.effects
+        for block in cfg.blocks:
+            defined = set()
+            for position in range(block.start, block.end):
+                used, written = effects[position]
+                for temp in used:
+                    if temp not in defined and temp not in self.bit_of:
+                        self.bit_of[temp] = len(self.members)
+                        self.members.append(temp)
+                defined.update(written)
+
+    def collect_effects(self) -> Iterator[Tuple[List[int], List[int]]]:
+        return temp_effects(self.cfg.program)
+
+    def temps(self, mask: int) -> List[int]:
+        return [self.members[bit] for bit in bits(mask)]
+
+    def gen_kill(self, block: BasicBlock) -> Tuple[int, int]:
+        use = define = 0
+        effects, bit_of = self.effects, self.bit_of
+        for position in range(block.end - 1, block.start - 1, -1):
+            used, written = effects[position]
+            for temp in written:
+                bit = bit_of.get(temp)
+                if bit is not None:
+                    define |= 1 << bit
+                    use &= ~(1 << bit)
+            for temp in used:
+                bit = bit_of.get(temp)
+                if bit is not None:
+                    use |= 1 << bit
+        return use, define
+
+
+# Slots are live at the end of the program, where memory is the observable result, unless
+# live_at_exit says otherwise
+class SlotLiveness(_LocalEffects):
+    def __init__(self, cfg: ControlFlowGraph, live_at_exit: Optional[int] = None):
+        super().__init__(cfg)
+        if live_at_exit is None:
+            live_at_exit = 0
+            for slot in cfg.program.slots:
+                live_at_exit |= 1 << slot.index
+        self.live_at_exit = live_at_exit
+
+    def collect_effects(self) -> Iterator[Tuple[int, int]]:
+        return slot_effects(self.cfg.program)
+
+    def boundary(self) -> int:
+        return self.live_at_exit
+
+    def gen_kill(self, block: BasicBlock) -> Tuple[int, int]:
+        use = define = 0
+        effects = self.effects
+        for position in range(block.end - 1, block.start - 1, -1):
+            loaded, stored = effects[position]
+            if stored >= 0:
+                define |= 1 << stored
+                use &= ~(1 << stored)
+            elif loaded >= 0:
+                use |= 1 << loaded
+        return use, define
+
+
+# Definitions are the stores to slots, numbered in program order: bit i of a set is the
+# store at position definitions[i], which writes slot definition_slot[i]
+class ReachingDefinitions(DataflowProblem):
+    forward = True
+
+    def __init__(self, cfg: ControlFlowGraph):
+        super().__init__(cfg)
+        self.definitions: List[int] = []
+        self.definition_slot: List[int] = []
+        # All definitions of each slot, by slot index
+        self.slot_definitions: Dict[int, int] = {}
+        for position, (_, stored) in enumerate(slot_effects(cfg.program)):
+            if stored >= 0:
+                number = len(self.definitions)
+                self.definitions.append(position)
+                self.definition_slot.append(stored)
+                self.slot_definitions[stored] = self.slot_definitions.get(stored, 0) | (1 << number)
+
+    def block_definitions(self, block: BasicBlock) -> range:
+        # Numbers of the definitions inside block, in order
+        return range(bisect_left(self.definitions, block.start), bisect_left(self.definitions, block.end))
+
+    def gen_kill(self, block: BasicBlock) -> Tuple[int, int]:
+        gen = kill = 0
+        for number in self.block_definitions(block):
+            slot_mask = self.slot_definitions[self.definition_slot[number]]
+            kill |= slot_mask
+            gen = (gen & ~slot_mask) | (1 << number)
+        return gen, kill
+
+
+__all__ = ['bits', 'DataflowProblem', 'DataflowResult', 'DataflowSolver', 'solve',
+           'TempLiveness', 'SlotLiveness', 'ReachingDefinitions']
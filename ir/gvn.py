@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple, Union
+
+from common.tracing import tracer
+from .cfg import ControlFlowGraph, build_cfg
+from .instructions import *
+from .program import ProgrammIRInstruction
+from .ssa import remove_dead_values, rename_uses
+from .values import *
+
+import logging
+logger = logging.getLogger('Value Numbering')
+
+# Operators whose operands may be swapped without changing the result
+COMMUTATIVE = frozenset(('+', '*', '&', '|', '^'))
+
+# Value number of an operand: the id of the temp first computing the value, or
+# ('const', value) for a constant, so equal constants match whichever temp holds them
+ValueNumber = Union[int, Tuple[str, int]]
+
+
+def operand_order(number: ValueNumber) -> Tuple[int, int]:
+    # Temps before constants, so a + 1 and 1 + a get the same key
+    return (1, number[1]) if type(number) is tuple else (0, number)
+
+
+@dataclass
+class ValueNumberingStats:
+    # Loads of a slot holding a known constant, which become that constant
+    consts: int = 0
+    # Loads and operations whose value an earlier temp already held
+    loads: int = 0
+    operations: int = 0
+    instructions_before: int = 0
+    instructions_after: int = 0
+
+    @property
+    def removed(self) -> int:
+        return self.instructions_before - self.instructions_after
+
+
+# Dominator-based value numbering (Briggs, Cooper and Simpson). Blocks are visited down
+# the dominator tree with a scoped table from (op, value numbers of the operands) to the
+# temp computing it, so a block reuses what any block dominating it computed; the temp of
+# a dropped instruction is renamed to that one everywhere.
+#
+# Loads are numbered by slot in a table of the values the slots hold, which a store
+# updates, so a load reuses the temp last loaded from or stored to its slot. A temp is
+# never reused across blocks for a load: outside the block it would need one of the few
+# global registers or a slot of its own, no cheaper than loading again. What does carry
+# down the tree is which slots hold a constant, less the slots stored on some path from
+# the immediate dominator to the block (the blocks reaching it without going through the
+# dominator, which for a loop header is the whole loop).
+#
+# Constants are never reused: a load of a slot known to hold one becomes a MOV of the
+# immediate, and each MOV keeps its own temp, since in a long block one temp per constant
+# would stay live throughout and be spilled.
+#
+# An operation reused from a dominating block is read outside its own block, so the
+# Lowerer needs cross_block_temps to keep it in a register (or memory) across the blocks
+# in between. With dominator_scope off every block is numbered on its own.
+class ValueNumbering:
+    def __init__(self,
+                 program: ProgrammIRInstruction,
+                 dominator_scope: bool = True):
+        self.program = program
+        self.dominator_scope = dominator_scope
+        self.cfg: ControlFlowGraph = build_cfg(program)
+        self.stats = ValueNumberingStats(instructions_before=len(program.instructions))
+        # Temps written once, the only ones whose value can be reused
+        definitions: Dict[int, int] = {}
+        for instr in program.instructions:
+            for temp in instr.defined_temps():
+                definitions[temp.id] = definitions.get(temp.id, 0) + 1
+        self.single = {temp_id for temp_id, count in definitions.items() if count == 1}
+        self.alias: Dict[int, IRTemp] = {}
+        # Value number of each constant temp
+        self.constants: Dict[int, ValueNumber] = {}
+
+    def run(self) -> ProgrammIRInstruction:
+        logger.info('Numbering values over %s blocks', len(self.cfg.blocks))
+        rewritten = self.number()
+        # The operands of a reused operation may now be read by nothing
+        instructions = remove_dead_values([instr for block in rewritten for instr in block])
+        stats = self.stats
+        stats.instructions_after = len(instructions)
+        logger.info('Value numbering removed %s of %s instructions (%s constants, %s loads, %s operations)',
+                    stats.removed, stats.instructions_before, stats.consts, stats.loads, stats.operations)
+        if tracer.enabled:
+            tracer.count('gvn.removed', stats.removed)
+        return ProgrammIRInstruction(instructions=instructions, slots=self.program.slots)
+
+    def number(self) -> List[List[IRInstruction]]:
+        cfg = self.cfg
+        rewritten: List[List[IRInstruction]] = [[] for _ in cfg.blocks]
+        order = cfg.reverse_postorder()
+        if not self.dominator_scope:
+            for block in cfg.blocks:
+                rewritten[block.index] = self.number_block(block.index, {}, {})
+            return rewritten
+
+        idom = cfg.immediate_dominators()
+        children: List[List[int]] = [[] for _ in cfg.blocks]
+        for index in order[1:]:
+            children[idom[index]].append(index)
+        stored = self.stored_slots()
+        # Memory state at the end of each block with children in the dominator tree
+        memory_out: Dict[int, Dict[int, ValueNumber]] = {}
+        expressions: Dict[tuple, IRTemp] = {}
+        # Depth-first down the dominator tree: ('enter', block) then ('leave', keys to undo)
+        stack: List[tuple] = [('enter', order[0])] if order else []
+        while stack:
+            action, payload = stack.pop()
+            if action == 'leave':
+                for key in payload:
+                    del expressions[key]
+                continue
+            index = payload
+            memory: Dict[int, ValueNumber] = {}
+            if index != order[0]:
+                killed = self.killed_slots(idom[index], index, stored)
+                memory = {slot: value for slot, value in memory_out[idom[index]].items()
+                          if slot not in killed and type(value) is tuple}
+            added: List[tuple] = []
+            rewritten[index] = self.number_block(index, memory, expressions, added)
+            if children[index]:
+                memory_out[index] = memory
+            stack.append(('leave', added))
+            for child in reversed(children[index]):
+                stack.append(('enter', child))
+        # Blocks no path reaches are numbered on their own
+        reached = set(order)
+        for block in cfg.blocks:
+            if block.index not in reached:
+                rewritten[block.index] = self.number_block(block.index, {}, {})
+        return rewritten
+
+    def stored_slots(self) -> List[set]:
+        stored: List[set] = []
+        instructions = self.program.instructions
+        for block in self.cfg.blocks:
+            stored.append({instructions[position].dst.index for position in range(block.start, block.end)
+                           if type(instructions[position]) is StoreIRInstruction})
+        return stored
+
+    def killed_slots(self, dominator: int, index: int, stored: List[set]) -> set:
+        # Slots stored in the blocks on paths from dominator to index, found backwards
+        # from index without passing dominator
+        blocks = self.cfg.blocks
+        predecessors = blocks[index].predecessors
+        if predecessors == [dominator]:
+            return set()
+        killed: set = set()
+        seen = {dominator}
+        pending = list(predecessors)
+        while pending:
+            current = pending.pop()
+            if current in seen:
+                continue
+            seen.add(current)
+            killed |= stored[current]
+            pending.extend(blocks[current].predecessors)
+        return killed
+
+    def value_number(self, value: IRValue) -> Optional[ValueNumber]:
+        # None for temps written more than once, whose value may change between reads
+        if type(value) is IRConst:
+            return ('const', value.value)
+        value = self.alias.get(value.id, value)
+        if value.id not in self.single:
+            return None
+        return self.constants.get(value.id, value.id)
+
+    def number_block(self,
+                     index: int,
+                     memory: Dict[int, ValueNumber],
+                     expressions: Dict[tuple, IRTemp],
+                     added: Optional[List[tuple]] = None) -> List[IRInstruction]:
+        block = self.cfg.blocks[index]
+        alias, stats = self.alias, self.stats
+
+        def value(temp):
+            return alias.get(temp.id, temp) if type(temp) is IRTemp else temp
+
+        result: List[IRInstruction] = []
+        for position in range(block.start, block.end):
+            instr = self.program.instructions[position]
+            if alias:
+                instr = rename_uses(instr, value)
+            instr_type = type(instr)
+            if instr_type is ConstIRInstruction and instr.dst.id in self.single:
+                self.constants[instr.dst.id] = ('const', instr.src.value)
+            elif instr_type is LoadIRInstruction and instr.dst.id in self.single:
+                slot_index = instr.src.index
+                known = memory.get(slot_index)
+                if type(known) is tuple:
+                    # The slot holds a constant, rematerialized rather than reused
+                    instr = ConstIRInstruction(src=IRConst.of(known[1]), dst=instr.dst)
+                    self.constants[instr.dst.id] = known
+                    stats.consts += 1
+                elif known is not None:
+                    alias[instr.dst.id] = IRTemp(known)
+                    stats.loads += 1
+                    continue
+                else:
+                    memory[slot_index] = instr.dst.id
+            elif instr_type is StoreIRInstruction:
+                stored = self.value_number(instr.src)
+                if stored is None:
+                    memory.pop(instr.dst.index, None)
+                else:
+                    memory[instr.dst.index] = stored
+            elif instr_type is BinOpIRInstruction and instr.dst.id in self.single:
+                left = self.value_number(instr.left)
+                right = self.value_number(instr.right)
+                if left is not None and right is not None:
+                    if instr.op in COMMUTATIVE and operand_order(right) < operand_order(left):
+                        left, right = right, left
+                    key = (instr.op, left, right)
+                    held = expressions.get(key)
+                    if held is not None:
+                        alias[instr.dst.id] = held
+                        stats.operations += 1
+                        continue
+                    expressions[key] = instr.dst
+                    if added is not None:
+                        added.append(key)
+            result.append(instr)
+        return result
+
+
+def number_values(program: ProgrammIRInstruction,
+                  dominator_scope: bool = True) -> Tuple[ProgrammIRInstruction, ValueNumberingStats]:
+    numbering = ValueNumbering(program, dominator_scope)
+    return numbering.run(), numbering.stats
+
+
+__all__ = ['ValueNumberingStats', 'ValueNumbering', 'number_values']
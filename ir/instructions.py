@@ -1,35 +1,44 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import List
+from typing import Dict, List, Optional
 from .values import *
 from .values import IRLabel
 
 
 @dataclass
 class IRInstruction:
-    pass
+    __slots__ = ()
     def used_temps(self) -> List[IRTemp]:
         return []
+    def defined_temps(self) -> List[IRTemp]:
+        return []
 
 @dataclass
 class ConstIRInstruction(IRInstruction):
+    __slots__ = ('src', 'dst')
     src: IRConst
     dst: IRTemp
     def __repr__(self):
         return f"ConstIRInstruction(src={self.src}, dst={self.dst})"
+    def defined_temps(self) -> List[IRTemp]:
+        return [self.dst]
 
 
 @dataclass 
 class LoadIRInstruction(IRInstruction):
+    __slots__ = ('src', 'dst')
     src: IRSlot
     dst: IRTemp
     def __repr__(self):    
         return f"LoadIRInstruction(src={self.src}, dst={self.dst})"
+    def defined_temps(self) -> List[IRTemp]:
+        return [self.dst]
 
 
 @dataclass
 class StoreIRInstruction(IRInstruction):
+    __slots__ = ('src', 'dst')
     src: IRValue
     dst: IRSlot
     def __repr__(self):
@@ -43,6 +52,7 @@ class StoreIRInstruction(IRInstruction):
 
 @dataclass
 class BinOpIRInstruction(IRInstruction):
+    __slots__ = ('left', 'right', 'op', 'dst')
     left: IRTemp
     right: IRTemp | IRConst
     op: str
@@ -56,10 +66,13 @@ class BinOpIRInstruction(IRInstruction):
         if isinstance(self.right, IRTemp):
             used.append(self.right)
         return used
+    def defined_temps(self) -> List[IRTemp]:
+        return [self.dst]
 
 
 @dataclass
 class PrintIRInstruction(IRInstruction) :
+    __slots__ = ('value',)
     value: IRValue
     def __repr__(self):
         return f"PrintIRInstruction(value={self.value})"
@@ -72,18 +85,21 @@ class PrintIRInstruction(IRInstruction) :
 
 @dataclass
 class LabelIRInstruction(IRInstruction):
+    __slots__ = ('label',)
     label: IRLabel
     def __repr__(self):
         return f"LabelIRInstruction(name={self.label})"
 
 @dataclass
 class JumpIRInstruction(IRInstruction):
+    __slots__ = ('label',)
     label: IRLabel
     def __repr__(self):
         return f"JumpIRInstruction(name={self.label})"
 
 @dataclass
 class BranchIRInstruction(IRInstruction):
+    __slots__ = ('left', 'right', 'label', 'op')
     left: IRTemp
     right: IRTemp
     label: IRLabel
@@ -98,5 +114,36 @@ class BranchIRInstruction(IRInstruction):
             used.append(self.right)
         return used
 
+# dst = src between temps. Only produced when leaving SSA form.
+@dataclass
+class CopyIRInstruction(IRInstruction):
+    __slots__ = ('src', 'dst')
+    src: IRTemp
+    dst: IRTemp
+    def __repr__(self):
+        return f"CopyIRInstruction(src={self.src}, dst={self.dst})"
+    def used_temps(self) -> List[IRTemp]:
+        return [self.src]
+    def defined_temps(self) -> List[IRTemp]:
+        return [self.dst]
+
+
+# SSA join of the values of slot reaching a block: sources maps the index of each
+# predecessor block (in ir.cfg.build_cfg of the program) to the value on that edge.
+# Phis sit right after the label of their block and never reach the Lowerer.
+@dataclass
+class PhiIRInstruction(IRInstruction):
+    __slots__ = ('dst', 'sources', 'slot')
+    dst: IRTemp
+    sources: Dict[int, IRTemp]
+    slot: Optional[IRSlot]
+    def __repr__(self):
+        return f"PhiIRInstruction(dst={self.dst}, sources={self.sources}, slot={self.slot})"
+    def used_temps(self) -> List[IRTemp]:
+        return list(self.sources.values())
+    def defined_temps(self) -> List[IRTemp]:
+        return [self.dst]
+
 __all__ = ['IRInstruction', 'ConstIRInstruction', 'LoadIRInstruction',
-           'StoreIRInstruction', 'BinOpIRInstruction', 'PrintIRInstruction']
+           'StoreIRInstruction', 'BinOpIRInstruction', 'PrintIRInstruction',
+           'CopyIRInstruction', 'PhiIRInstruction']
@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from backend.isa import ALUOp, ALU_OP_MAP, BRANCH_OP_MAP
+from common.tracing import tracer
+from sim.alu import MASK, WORD_BITS, alu, branch_taken
+from .instructions import *
+from .instructions import BranchIRInstruction, JumpIRInstruction
+from .program import ProgrammIRInstruction
+from .ssa import max_temp_id, remove_dead_values, rename_uses
+from .values import *
+
+import logging
+logger = logging.getLogger('Instruction Selection')
+
+# ALU operations whose operands may be swapped, so a constant on the left can become the
+# immediate
+COMMUTATIVE_OPS = frozenset((ALUOp.ADD, ALUOp.MUL, ALUOp.AND, ALUOp.OR, ALUOp.XOR))
+
+# Right operands leaving the left one unchanged, under sim.alu: x % 0 is x there
+IDENTITIES = frozenset((
+    (ALUOp.ADD, 0), (ALUOp.SUB, 0), (ALUOp.OR, 0), (ALUOp.XOR, 0), (ALUOp.SHL, 0), (ALUOp.SHR, 0),
+    (ALUOp.MUL, 1), (ALUOp.DIV, 1), (ALUOp.DIVH, 0), (ALUOp.AND, MASK),
+))
+
+# Right operands giving the same result whatever the left one is: x / 0 is 0xFFFF
+ABSORBING = {
+    (ALUOp.MUL, 0): 0, (ALUOp.AND, 0): 0, (ALUOp.DIVH, 1): 0, (ALUOp.OR, MASK): MASK, (ALUOp.DIV, 0): MASK,
+}
+
+
+def absorbed(op: ALUOp, right: int) -> Optional[int]:
+    if op in (ALUOp.SHL, ALUOp.SHR) and right >= WORD_BITS:
+        return 0
+    return ABSORBING.get((op, right))
+
+
+@dataclass
+class InstructionSelectionStats:
+    # Constant operands turned into the immediate of the ISACalcImm form
+    immediates: int = 0
+    # Operations needing no instruction: the result is an operand or a constant
+    identities: int = 0
+    folded: int = 0
+    # Branches decided at compile time, and branches whose constant was moved next to them
+    branches: int = 0
+    rematerialized: int = 0
+    instructions_before: int = 0
+    instructions_after: int = 0
+
+    @property
+    def removed(self) -> int:
+        return self.instructions_before - self.instructions_after
+
+
+# Instruction selection on the IR, right before lowering: each operation and branch is
+# matched against the shapes of its operands, a constant (a temp written once by a
+# ConstIRInstruction, wherever it is) or anything else, and given the cheapest LEG-16
+# form for it:
+#   - const op const is computed here, with sim.alu through the Lowerer's operator map;
+#   - x op const is the ISACalcImm form, which needs neither the MOV nor the register of
+#     the constant, or no instruction at all when the constant leaves x unchanged (x + 0,
+#     x * 1) or fixes the result (x * 0, x & 0);
+#   - const op x is the same with the operands swapped when op is commutative, and stays
+#     as it is otherwise: LEG-16 has no reversed subtraction or shift;
+#   - a branch on two constants, or on a temp and itself, becomes a jump or nothing. LEG-16
+#     has no compare with an immediate, so a constant operand of a branch still needs a
+#     register; it is rematerialized right before the branch, holding it for one
+#     instruction instead of from wherever it was computed.
+# Constants whose uses all became immediates are removed with the other dead values.
+class InstructionSelector:
+    def __init__(self, program: ProgrammIRInstruction):
+        self.program = program
+        self.stats = InstructionSelectionStats(instructions_before=len(program.instructions))
+        definitions: Dict[int, int] = {}
+        for instr in program.instructions:
+            for temp in instr.defined_temps():
+                definitions[temp.id] = definitions.get(temp.id, 0) + 1
+        # Temps written once, the only ones whose constant value holds at every read
+        self.single = {temp_id for temp_id, count in definitions.items() if count == 1}
+        self.constants: Dict[int, int] = {}
+        self.alias: Dict[int, IRTemp] = {}
+        self.next_temp = max_temp_id(program) + 1
+
+    def run(self) -> ProgrammIRInstruction:
+        logger.info('Selecting instructions for %s IR instructions', len(self.program.instructions))
+        result: List[IRInstruction] = []
+        for instr in self.program.instructions:
+            if self.alias:
+                instr = rename_uses(instr, self.value)
+            instr_type = type(instr)
+            if instr_type is ConstIRInstruction and instr.dst.id in self.single:
+                self.constants[instr.dst.id] = instr.src.value & MASK
+            elif instr_type is BinOpIRInstruction:
+                instr = self.select_binop(instr)
+            elif instr_type is BranchIRInstruction:
+                result.extend(self.select_branch(instr, result))
+                continue
+            if instr is not None:
+                result.append(instr)
+        if self.alias:
+            # Reads placed before the operation they now skip, as on a loop's back edge
+            result = [rename_uses(instr, self.value) for instr in result]
+        result = remove_dead_values(result)
+        stats = self.stats
+        stats.instructions_after = len(result)
+        logger.info('Instruction selection removed %s of %s instructions (%s immediates, %s identities, '
+                    '%s folded, %s branches, %s rematerialized)', stats.removed, stats.instructions_before,
+                    stats.immediates, stats.identities, stats.folded, stats.branches, stats.rematerialized)
+        if tracer.enabled:
+            tracer.count('isel.removed', stats.removed)
+            tracer.count('isel.immediates', stats.immediates)
+        return ProgrammIRInstruction(instructions=result, slots=self.program.slots)
+
+    def value(self, temp: IRTemp) -> IRTemp:
+        return self.alias.get(temp.id, temp)
+
+    def constant(self, value: IRValue) -> Optional[int]:
+        if isinstance(value, IRConst):
+            return value.value & MASK
+        return self.constants.get(value.id)
+
+    def select_binop(self, instr: BinOpIRInstruction) -> Optional[IRInstruction]:
+        # The instruction computing instr's value, None when an operand already holds it
+        op = ALU_OP_MAP.get(instr.op, ALUOp.ADD)
+        left, right = self.constant(instr.left), self.constant(instr.right)
+        dst = instr.dst
+        stats = self.stats
+        if left is not None and right is not None:
+            stats.folded += 1
+            return self.define_constant(dst, alu(op, left, right))
+        operand = instr.left
+        if left is not None:
+            if op not in COMMUTATIVE_OPS:
+                return instr
+            operand, right = instr.right, left
+        if right is None:
+            return instr
+        if (op, right) in IDENTITIES and dst.id in self.single and operand.id in self.single:
+            stats.identities += 1
+            self.alias[dst.id] = operand
+            return None
+        fixed = absorbed(op, right)
+        if fixed is not None:
+            stats.identities += 1
+            return self.define_constant(dst, fixed)
+        if operand is instr.left and isinstance(instr.right, IRConst):
+            return instr
+        stats.immediates += 1
+        return BinOpIRInstruction(left=operand, right=IRConst.of(right), op=instr.op, dst=dst)
+
+    def define_constant(self, dst: IRTemp, value: int) -> ConstIRInstruction:
+        if dst.id in self.single:
+            self.constants[dst.id] = value
+        return ConstIRInstruction(src=IRConst.of(value), dst=dst)
+
+    def select_branch(self, instr: BranchIRInstruction, emitted: List[IRInstruction]) -> List[IRInstruction]:
+        left, right = self.constant(instr.left), self.constant(instr.right)
+        if instr.left.id == instr.right.id and left is None:
+            # Any value compares to itself as to an equal constant
+            left = right = 0
+        if left is not None and right is not None:
+            self.stats.branches += 1
+            if branch_taken(BRANCH_OP_MAP[instr.op], left, right):
+                return [JumpIRInstruction(label=instr.label)]
+            return []
+        placed: List[IRInstruction] = []
+        operands = [instr.left, instr.right]
+        for index, value in ((0, left), (1, right)):
+            if value is None or self.defined_just_before(operands[index], emitted):
+                continue
+            temp = IRTemp(self.next_temp)
+            self.next_temp += 1
+            placed.append(ConstIRInstruction(src=IRConst.of(value), dst=temp))
+            operands[index] = temp
+            self.stats.rematerialized += 1
+        if not placed:
+            return [instr]
+        placed.append(BranchIRInstruction(left=operands[0], right=operands[1], label=instr.label, op=instr.op))
+        return placed
+
+    @staticmethod
+    def defined_just_before(temp: IRTemp, emitted: List[IRInstruction]) -> bool:
+        # Written by one of the two instructions before the branch, which compute its
+        # operands
+        return any(temp in instr.defined_temps() for instr in emitted[-2:])
+
+
+def select_instructions(program: ProgrammIRInstruction) -> Tuple[ProgrammIRInstruction, InstructionSelectionStats]:
+    selector = InstructionSelector(program)
+    return selector.run(), selector.stats
+
+
+__all__ = ['InstructionSelectionStats', 'InstructionSelector', 'select_instructions']
@@ -0,0 +1,351 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, replace
+from typing import Dict, List, Optional, Set, Tuple
+
+from common.tracing import tracer
+from .cfg import ControlFlowGraph, Loop, build_cfg
+from .dataflow import SlotLiveness, TempLiveness, solve
+from .instructions import *
+from .instructions import BranchIRInstruction, JumpIRInstruction
+from .program import ProgrammIRInstruction
+from .ssa import max_temp_id, remove_dead_values, rename_uses
+from .values import *
+
+import logging
+logger = logging.getLogger('Memory Optimization')
+
+
+@dataclass
+class MemoryOptimizationStats:
+    # Loads replaced by a temp already holding the value
+    forwarded: int = 0
+    # Stores of the value the slot already holds, or overwritten before any read
+    dead_stores: int = 0
+    # Slots kept in a temp through a loop nest, counted once per nest
+    promoted: int = 0
+    loads_before: int = 0
+    stores_before: int = 0
+    loads_after: int = 0
+    stores_after: int = 0
+
+    @property
+    def removed(self) -> int:
+        return self.loads_before + self.stores_before - self.loads_after - self.stores_after
+
+
+def count_memory_ops(program: ProgrammIRInstruction) -> Tuple[int, int]:
+    loads = stores = 0
+    for instr in program.instructions:
+        instr_type = type(instr)
+        if instr_type is LoadIRInstruction:
+            loads += 1
+        elif instr_type is StoreIRInstruction:
+            stores += 1
+    return loads, stores
+
+
+# A nest of loops whose hottest slots live in temps while it runs
+@dataclass
+class PromotedNest:
+    loop: Loop
+    # Temp holding each promoted slot, by slot index
+    temps: Dict[int, IRTemp]
+    # Where the slots are loaded before the loop and stored back after it
+    entry: int
+    exits: List[int]
+
+
+# Removes the loads and stores a variable does not need, in three steps:
+#   - promotion: in each outermost loop nest the promote_limit slots accessed most
+#     (weighted by 10 ** loop depth) are loaded into a temp once before the loop, read
+#     and written in that temp inside it and stored back once at its exits. Such a temp
+#     is written in several blocks, so the Lowerer needs cross_block_temps to give it a
+#     register. None promotes every slot of every nest, 0 none;
+#   - forwarding: within a block, a load of a slot whose value a temp already holds
+#     (stored from it or loaded into it) reads that temp instead, and storing a slot the
+#     value it already holds is dropped;
+#   - dead stores: a store is removed when the slot is written again before any read on
+#     every path. Memory at the end of the program is its result, so every slot is live
+#     there.
+class MemoryOptimizer:
+    def __init__(self,
+                 program: ProgrammIRInstruction,
+                 promote_limit: Optional[int] = None):
+        self.program = program
+        self.promote_limit = promote_limit
+        self.stats = MemoryOptimizationStats()
+
+    def run(self) -> ProgrammIRInstruction:
+        stats = self.stats
+        stats.loads_before, stats.stores_before = count_memory_ops(self.program)
+        logger.info('Optimizing %s loads and %s stores', stats.loads_before, stats.stores_before)
+        program = self.program
+        if self.promote_limit != 0:
+            program = self.promote_loops(program)
+        program = self.forward(program)
+        program = self.remove_dead_stores(program)
+        # Forwarding drops stores but not the loads feeding them, and promotion writes
+        # temps of slots dead at a loop's exits: the Lowerer expects every temp to be read
+        program = ProgrammIRInstruction(instructions=remove_dead_values(program.instructions), slots=program.slots)
+        stats.loads_after, stats.stores_after = count_memory_ops(program)
+        logger.info('Memory optimization removed %s of %s loads and stores (%s forwarded, %s dead stores, '
+                    '%s slots promoted in loops)', stats.removed, stats.loads_before + stats.stores_before,
+                    stats.forwarded, stats.dead_stores, stats.promoted)
+        if tracer.enabled:
+            tracer.count('memopt.removed', stats.removed)
+            tracer.count('memopt.promoted', stats.promoted)
+        return program
+
+    # Promotion
+
+    def promote_loops(self, program: ProgrammIRInstruction) -> ProgrammIRInstruction:
+        cfg = build_cfg(program)
+        nests = [loop for loop in cfg.loops() if loop.parent is None]
+        if not nests:
+            return program
+        live_in = solve(SlotLiveness(cfg)).block_in
+        next_temp = max_temp_id(program) + 1
+        promoted: List[PromotedNest] = []
+        for loop in nests:
+            nest = self.promote_nest(cfg, loop, next_temp)
+            if nest is not None:
+                next_temp += len(nest.temps)
+                promoted.append(nest)
+        if not promoted:
+            return program
+
+        slots = {slot.index: slot for slot in program.slots}
+        instructions = program.instructions
+        # Code to place ahead of a position: exit stores of one nest go before the
+        # entry loads of the next, which may read them
+        exit_code: Dict[int, List[IRInstruction]] = {}
+        entry_code: Dict[int, List[IRInstruction]] = {}
+        block_temps: Dict[int, Dict[int, IRTemp]] = {}
+        for nest in promoted:
+            self.stats.promoted += len(nest.temps)
+            stored: Set[int] = set()
+            for index in nest.loop.blocks:
+                block_temps[index] = nest.temps
+                block = cfg.blocks[index]
+                for position in range(block.start, block.end):
+                    instr = instructions[position]
+                    if type(instr) is StoreIRInstruction and instr.dst.index in nest.temps:
+                        stored.add(instr.dst.index)
+            for slot_index, temp in sorted(nest.temps.items()):
+                if live_in[nest.loop.header] >> slot_index & 1:
+                    entry_code.setdefault(nest.entry, []).append(
+                        LoadIRInstruction(src=slots[slot_index], dst=temp))
+            for exit_index in nest.exits:
+                exit_block = cfg.blocks[exit_index]
+                position = exit_block.start + (1 if exit_block.label is not None else 0)
+                for slot_index, temp in sorted(nest.temps.items()):
+                    if slot_index in stored and live_in[exit_index] >> slot_index & 1:
+                        exit_code.setdefault(position, []).append(
+                            StoreIRInstruction(src=temp, dst=slots[slot_index]))
+
+        uses: Dict[int, int] = {}
+        for instr in instructions:
+            for temp in instr.used_temps():
+                uses[temp.id] = uses.get(temp.id, 0) + 1
+        result: List[IRInstruction] = []
+        for block in cfg.blocks:
+            temps = block_temps.get(block.index)
+            if temps is None:
+                for position in range(block.start, block.end):
+                    result.extend(exit_code.pop(position, ()))
+                    result.extend(entry_code.pop(position, ()))
+                    result.append(instructions[position])
+                continue
+            # Of the code placed, only the entry of the nest lands in it, before the header
+            result.extend(exit_code.pop(block.start, ()))
+            result.extend(entry_code.pop(block.start, ()))
+            self.rewrite_promoted(instructions, block.start, block.end, temps, uses, result)
+        # Stores after a loop ending the program
+        for position in sorted(set(exit_code) | set(entry_code)):
+            result.extend(exit_code.get(position, ()))
+            result.extend(entry_code.get(position, ()))
+        return ProgrammIRInstruction(instructions=result, slots=program.slots)
+
+    def promote_nest(self, cfg: ControlFlowGraph, loop: Loop, next_temp: int) -> Optional[PromotedNest]:
+        header = cfg.blocks[loop.header]
+        instructions = cfg.program.instructions
+        # Loads go right before the header's label, which only works when the loop is
+        # entered by falling into it
+        outside = [index for index in header.predecessors if index not in loop.blocks]
+        if header.label is None or outside != [header.index - 1]:
+            return None
+        last = instructions[cfg.blocks[header.index - 1].end - 1]
+        if type(last) in (JumpIRInstruction, BranchIRInstruction) and last.label.index == header.label:
+            return None
+        # Stores go at the start of the exit blocks, so nothing else may enter them
+        exits = sorted({successor for index in loop.blocks for successor in cfg.blocks[index].successors
+                        if successor not in loop.blocks})
+        for exit_index in exits:
+            if any(index not in loop.blocks for index in cfg.blocks[exit_index].predecessors):
+                return None
+
+        depths = cfg.loop_depths()
+        weights: Dict[int, int] = {}
+        for index in loop.blocks:
+            block = cfg.blocks[index]
+            for position in range(block.start, block.end):
+                instr = instructions[position]
+                instr_type = type(instr)
+                if instr_type is LoadIRInstruction:
+                    slot_index = instr.src.index
+                elif instr_type is StoreIRInstruction:
+                    slot_index = instr.dst.index
+                else:
+                    continue
+                weights[slot_index] = weights.get(slot_index, 0) + 10 ** depths[index]
+        ranked = sorted(weights, key=lambda slot_index: (-weights[slot_index], slot_index))
+        if self.promote_limit is not None:
+            ranked = ranked[:self.promote_limit]
+        if not ranked:
+            return None
+        temps = {slot_index: IRTemp(next_temp + number) for number, slot_index in enumerate(ranked)}
+        return PromotedNest(loop=loop, temps=temps, entry=header.start, exits=exits)
+
+    @staticmethod
+    def rewrite_promoted(instructions: List[IRInstruction],
+                         start: int,
+                         end: int,
+                         temps: Dict[int, IRTemp],
+                         uses: Dict[int, int],
+                         result: List[IRInstruction]) -> None:
+        # Loads of a promoted slot become its temp, stores write the temp. The temp of a
+        # load is renamed to the slot's temp unless the slot is written before that temp
+        # is last read, and the instruction computing a stored value writes the slot's temp
+        # directly when nothing reads or writes that temp in between.
+        last_use: Dict[int, int] = {}
+        stores_at: Dict[int, List[int]] = {}
+        for position in range(start, end):
+            instr = instructions[position]
+            for temp in instr.used_temps():
+                last_use[temp.id] = position
+            if type(instr) is StoreIRInstruction and instr.dst.index in temps:
+                stores_at.setdefault(instr.dst.index, []).append(position)
+
+        promoted = {temp.id for temp in temps.values()}
+        alias: Dict[int, IRTemp] = {}
+        # Position in result of the instruction defining each temp of this block, and of
+        # the last one reading or writing each promoted temp
+        defined_at: Dict[int, int] = {}
+        touched_at: Dict[int, int] = {}
+
+        def value(temp):
+            return alias.get(temp.id, temp) if type(temp) is IRTemp else temp
+
+        for position in range(start, end):
+            instr = instructions[position]
+            instr_type = type(instr)
+            if instr_type is LoadIRInstruction and instr.src.index in temps:
+                temp = temps[instr.src.index]
+                read_until = last_use.get(instr.dst.id, position)
+                if not any(position < store <= read_until for store in stores_at.get(instr.src.index, ())):
+                    alias[instr.dst.id] = temp
+                    continue
+                instr = CopyIRInstruction(src=temp, dst=instr.dst)
+            elif instr_type is StoreIRInstruction and instr.dst.index in temps:
+                temp = temps[instr.dst.index]
+                src = value(instr.src)
+                if src == temp:
+                    continue
+                if type(src) is IRConst:
+                    instr = ConstIRInstruction(src=src, dst=temp)
+                else:
+                    at = defined_at.get(src.id)
+                    if at is not None and uses.get(src.id) == 1 and touched_at.get(temp.id, -1) <= at:
+                        result[at] = replace(result[at], dst=temp)
+                        touched_at[temp.id] = at
+                        continue
+                    instr = CopyIRInstruction(src=src, dst=temp)
+            elif alias:
+                instr = rename_uses(instr, value)
+            for temp in instr.used_temps() + instr.defined_temps():
+                if temp.id in promoted:
+                    touched_at[temp.id] = len(result)
+            for temp in instr.defined_temps():
+                defined_at[temp.id] = len(result)
+            result.append(instr)
+
+    # Forwarding
+
+    def forward(self, program: ProgrammIRInstruction) -> ProgrammIRInstruction:
+        cfg = build_cfg(program)
+        # Temps read outside their block keep their load
+        crossing = set(TempLiveness(cfg).members)
+
+        def value(temp):
+            return alias.get(temp.id, temp) if type(temp) is IRTemp else temp
+
+        instructions = program.instructions
+        result: List[IRInstruction] = []
+        for block in cfg.blocks:
+            # Only temps not written again later in the block hold a slot's value, which
+            # then lasts until the end of the block
+            last_definition: Dict[int, int] = {}
+            for position in range(block.start, block.end):
+                for temp in instructions[position].defined_temps():
+                    last_definition[temp.id] = position
+            # Temp holding the current value of each slot, by slot index
+            available: Dict[int, IRTemp] = {}
+            alias: Dict[int, IRTemp] = {}
+            for position in range(block.start, block.end):
+                instr = instructions[position]
+                if alias:
+                    instr = rename_uses(instr, value)
+                instr_type = type(instr)
+                if instr_type is LoadIRInstruction:
+                    held = available.get(instr.src.index)
+                    if held is not None and instr.dst.id not in crossing \
+                            and last_definition.get(instr.dst.id) == position:
+                        alias[instr.dst.id] = held
+                        self.stats.forwarded += 1
+                        continue
+                    if last_definition.get(instr.dst.id) == position:
+                        available[instr.src.index] = instr.dst
+                elif instr_type is StoreIRInstruction:
+                    if available.get(instr.dst.index) == instr.src:
+                        self.stats.dead_stores += 1
+                        continue
+                    if type(instr.src) is IRTemp and last_definition.get(instr.src.id, -1) < position:
+                        available[instr.dst.index] = instr.src
+                    else:
+                        available.pop(instr.dst.index, None)
+                result.append(instr)
+        return ProgrammIRInstruction(instructions=result, slots=program.slots)
+
+    # Dead stores
+
+    def remove_dead_stores(self, program: ProgrammIRInstruction) -> ProgrammIRInstruction:
+        cfg = build_cfg(program)
+        live_out = solve(SlotLiveness(cfg)).block_out
+        instructions = program.instructions
+        dead: Set[int] = set()
+        for block in cfg.blocks:
+            live = live_out[block.index]
+            for position in range(block.end - 1, block.start - 1, -1):
+                instr = instructions[position]
+                instr_type = type(instr)
+                if instr_type is StoreIRInstruction:
+                    if not live >> instr.dst.index & 1:
+                        dead.add(position)
+                    live &= ~(1 << instr.dst.index)
+                elif instr_type is LoadIRInstruction:
+                    live |= 1 << instr.src.index
+        if not dead:
+            return program
+        self.stats.dead_stores += len(dead)
+        result = [instr for position, instr in enumerate(instructions) if position not in dead]
+        return ProgrammIRInstruction(instructions=result, slots=program.slots)
+
+
+def optimize_memory(program: ProgrammIRInstruction,
+                    promote_limit: Optional[int] = None) -> Tuple[ProgrammIRInstruction, MemoryOptimizationStats]:
+    optimizer = MemoryOptimizer(program, promote_limit)
+    return optimizer.run(), optimizer.stats
+
+
+__all__ = ['MemoryOptimizationStats', 'MemoryOptimizer', 'count_memory_ops', 'optimize_memory']
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+from array import array
+from typing import Dict, Iterator, List
+
+from .instructions import *
+from .instructions import BranchIRInstruction, JumpIRInstruction, LabelIRInstruction
+from .program import ProgrammIRInstruction
+from .values import *
+from .values import IRLabel
+
+# Opcodes of the packed representation, one per IRInstruction subclass
+OP_CONST = 0
+OP_LOAD = 1
+OP_STORE = 2
+OP_BINOP = 3
+OP_PRINT = 4
+OP_LABEL = 5
+OP_JUMP = 6
+OP_BRANCH = 7
+
+OPCODE_NAMES = ('const', 'load', 'store', 'binop', 'print', 'label', 'jump', 'branch')
+
+# Operator strings of BinOp/Branch instructions are stored as small ints
+OPERATOR_NAMES = (
+    '', '+', '-', '*', '/', '%', '&', '|', '^', '~', '<<', '>>', 'rol', 'ror',
+    '==', '!=', '>=', '<=', '>', '<', 'mulh',
+)
+OPERATOR_IDS = {name: op for op, name in enumerate(OPERATOR_NAMES)}
+
+NO_TEMP = -1
+
+
+# IR program as parallel columns, one row per instruction. Temps and labels are plain ints
+# and NO_TEMP marks an unused operand.
+#
+#   opcode  ops       dst   src1   src2   imm          label
+#   CONST   -         temp  -      -      value        -
+#   LOAD    -         temp  -      -      slot index   -
+#   STORE   -         -     temp   -      slot index   -
+#   BINOP   operator  temp  temp   temp   value if src2 is NO_TEMP
+#   PRINT   -         -     temp   -      -            -
+#   LABEL   -         -     -      -      -            label
+#   JUMP    -         -     -      -      -            label
+#   BRANCH  operator  -     temp   temp   -            label
+class PackedProgram:
+    __slots__ = ('opcodes', 'ops', 'dst', 'src1', 'src2', 'imm', 'label', 'slots', 'slot_names')
+
+    def __init__(self) -> None:
+        self.opcodes = array('B')
+        self.ops = array('B')
+        self.dst = array('i')
+        self.src1 = array('i')
+        self.src2 = array('i')
+        self.imm = array('q')
+        self.label = array('i')
+        self.slots: List[IRSlot] = []
+        self.slot_names: Dict[int, str] = {}
+
+    def __len__(self) -> int:
+        return len(self.opcodes)
+
+    def append(self, opcode: int, op: int = 0, dst: int = NO_TEMP, src1: int = NO_TEMP,
+               src2: int = NO_TEMP, imm: int = 0, label: int = NO_TEMP) -> None:
+        self.opcodes.append(opcode)
+        self.ops.append(op)
+        self.dst.append(dst)
+        self.src1.append(src1)
+        self.src2.append(src2)
+        self.imm.append(imm)
+        self.label.append(label)
+
+    def add_slot(self, slot: IRSlot) -> None:
+        self.slots.append(slot)
+        self.slot_names[slot.index] = slot.name
+
+    def slot(self, index: int) -> IRSlot:
+        return IRSlot.of(index, self.slot_names[index])
+
+    # View layer: the dataclass form of one row, built on demand
+    def instruction(self, i: int) -> IRInstruction:
+        opcode = self.opcodes[i]
+        if opcode == OP_CONST:
+            return ConstIRInstruction(src=IRConst.of(self.imm[i]), dst=IRTemp(self.dst[i]))
+        elif opcode == OP_LOAD:
+            return LoadIRInstruction(src=self.slot(self.imm[i]), dst=IRTemp(self.dst[i]))
+        elif opcode == OP_STORE:
+            return StoreIRInstruction(src=IRTemp(self.src1[i]), dst=self.slot(self.imm[i]))
+        elif opcode == OP_BINOP:
+            right = IRConst.of(self.imm[i]) if self.src2[i] == NO_TEMP else IRTemp(self.src2[i])
+            return BinOpIRInstruction(left=IRTemp(self.src1[i]), right=right,
+                                      op=OPERATOR_NAMES[self.ops[i]], dst=IRTemp(self.dst[i]))
+        elif opcode == OP_PRINT:
+            return PrintIRInstruction(value=IRTemp(self.src1[i]))
+        elif opcode == OP_LABEL:
+            return LabelIRInstruction(IRLabel(self.label[i]))
+        elif opcode == OP_JUMP:
+            return JumpIRInstruction(IRLabel(self.label[i]))
+        elif opcode == OP_BRANCH:
+            return BranchIRInstruction(left=IRTemp(self.src1[i]), right=IRTemp(self.src2[i]),
+                                       label=IRLabel(self.label[i]), op=OPERATOR_NAMES[self.ops[i]])
+        raise Exception(f'Unknown packed opcode {opcode}')
+
+    def __iter__(self) -> Iterator[IRInstruction]:
+        for i in range(len(self.opcodes)):
+            yield self.instruction(i)
+
+    def to_program(self) -> ProgrammIRInstruction:
+        return ProgrammIRInstruction(instructions=list(self), slots=list(self.slots))
+
+    @classmethod
+    def from_program(cls, program: ProgrammIRInstruction) -> PackedProgram:
+        packed = cls()
+        for slot in program.slots:
+            packed.add_slot(slot)
+        for instr in program.instructions:
+            if isinstance(instr, ConstIRInstruction):
+                packed.append(OP_CONST, dst=instr.dst.id, imm=instr.src.value)
+            elif isinstance(instr, LoadIRInstruction):
+                packed.append(OP_LOAD, dst=instr.dst.id, imm=instr.src.index)
+            elif isinstance(instr, StoreIRInstruction):
+                packed.append(OP_STORE, src1=instr.src.id, imm=instr.dst.index)
+            elif isinstance(instr, BinOpIRInstruction):
+                if isinstance(instr.right, IRConst):
+                    packed.append(OP_BINOP, OPERATOR_IDS[instr.op], dst=instr.dst.id,
+                                  src1=instr.left.id, imm=instr.right.value)
+                else:
+                    packed.append(OP_BINOP, OPERATOR_IDS[instr.op], dst=instr.dst.id,
+                                  src1=instr.left.id, src2=instr.right.id)
+            elif isinstance(instr, PrintIRInstruction):
+                packed.append(OP_PRINT, src1=instr.value.id)
+            elif isinstance(instr, LabelIRInstruction):
+                packed.append(OP_LABEL, label=instr.label.index)
+            elif isinstance(instr, JumpIRInstruction):
+                packed.append(OP_JUMP, label=instr.label.index)
+            elif isinstance(instr, BranchIRInstruction):
+                packed.append(OP_BRANCH, OPERATOR_IDS[instr.op], src1=instr.left.id,
+                              src2=instr.right.id, label=instr.label.index)
+            else:
+                raise Exception(f'Cannot pack {instr}')
+        return packed
+
+    def __repr__(self):
+        return f"PackedProgram(instructions={list(self)}, slots={self.slots})"
+
+
+__all__ = ['PackedProgram']
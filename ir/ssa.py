@@ -0,0 +1,434 @@
+from __future__ import annotations
+
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from .cfg import ControlFlowGraph, build_cfg
+from .dataflow import SlotLiveness, solve
+from .instructions import *
+from .instructions import BranchIRInstruction, JumpIRInstruction, LabelIRInstruction
+from .program import ProgrammIRInstruction
+from .values import *
+from .values import IRLabel
+
+import logging
+logger = logging.getLogger('SSA')
+
+
+def max_temp_id(program: ProgrammIRInstruction) -> int:
+    highest = -1
+    for instr in program.instructions:
+        for temp in instr.defined_temps():
+            if temp.id > highest:
+                highest = temp.id
+    return highest
+
+
+def max_label_index(program: ProgrammIRInstruction) -> int:
+    highest = -1
+    for instr in program.instructions:
+        if type(instr) in (LabelIRInstruction, JumpIRInstruction, BranchIRInstruction):
+            highest = max(highest, instr.label.index)
+    return highest
+
+
+def rename_uses(instr: IRInstruction, value: Callable[[IRTemp], IRTemp]) -> IRInstruction:
+    # The instruction with every temp it reads replaced by value(temp); itself when unchanged
+    instr_type = type(instr)
+    if instr_type is BinOpIRInstruction:
+        left = value(instr.left)
+        right = value(instr.right) if isinstance(instr.right, IRTemp) else instr.right
+        if left is instr.left and right is instr.right:
+            return instr
+        return BinOpIRInstruction(left=left, right=right, op=instr.op, dst=instr.dst)
+    if instr_type is BranchIRInstruction:
+        left, right = value(instr.left), value(instr.right)
+        if left is instr.left and right is instr.right:
+            return instr
+        return BranchIRInstruction(left=left, right=right, label=instr.label, op=instr.op)
+    if instr_type is PrintIRInstruction:
+        src = value(instr.value)
+        return instr if src is instr.value else PrintIRInstruction(value=src)
+    if instr_type is StoreIRInstruction:
+        src = value(instr.src)
+        return instr if src is instr.src else StoreIRInstruction(src=src, dst=instr.dst)
+    if instr_type is CopyIRInstruction:
+        src = value(instr.src)
+        return instr if src is instr.src else CopyIRInstruction(src=src, dst=instr.dst)
+    return instr
+
+
+# Promotes IRSlot variables to SSA temps (Cytron et al.):
+#   - variables only read in the block that stored them are always promoted; of those
+#     live across blocks, whose values then need a register along the way, only the
+#     cross_block_limit with the most reads (weighted by 10 ** loop depth) are, and the
+#     rest stay in memory. None promotes all of them;
+#   - phis go on the iterated dominance frontier of the blocks storing a slot, pruned to
+#     the blocks where the slot is live on entry;
+#   - a walk of the dominator tree drops the loads of slots, renaming each load's temp to
+#     the value of the slot at that point;
+#   - a slot read before any store on some path reads the zero memory starts with, as a
+#     const defined at the start of the program.
+# Stores stay where they are: memory always holds the current value of each variable, so
+# the final memory is the same as without SSA, and a value needs a register only up to
+# its last read rather than to the end of the program.
+# Block structure (labels, jumps, branches) is unchanged, so the block indices of phi
+# sources stay valid for build_cfg of the result.
+class SSAConstructor:
+    def __init__(self, program: ProgrammIRInstruction, cross_block_limit: Optional[int] = None):
+        self.program = program
+        self.cross_block_limit = cross_block_limit
+        self.cfg: ControlFlowGraph = build_cfg(program)
+        self.next_temp = max_temp_id(program) + 1
+        self.slots: Dict[int, IRSlot] = {slot.index: slot for slot in program.slots}
+        # Indices of the slots to promote, chosen by construct()
+        self.promoted: Set[int] = set()
+
+    def new_temp(self) -> IRTemp:
+        temp = IRTemp(self.next_temp)
+        self.next_temp += 1
+        return temp
+
+    def dominance_frontiers(self) -> List[Set[int]]:
+        idom = self.cfg.immediate_dominators()
+        frontiers: List[Set[int]] = [set() for _ in self.cfg.blocks]
+        for block in self.cfg.blocks:
+            predecessors = [p for p in block.predecessors if idom[p] != -1]
+            # The entry is also entered from outside the program, and its own dominator
+            if block.index == 0:
+                for runner in predecessors:
+                    while True:
+                        frontiers[runner].add(0)
+                        if runner == 0:
+                            break
+                        runner = idom[runner]
+                continue
+            if len(predecessors) < 2 or idom[block.index] == -1:
+                continue
+            for runner in predecessors:
+                while runner != idom[block.index]:
+                    frontiers[runner].add(block.index)
+                    runner = idom[runner]
+        return frontiers
+
+    def promoted_slots(self, live_in: List[int]) -> Set[int]:
+        slots = {slot.index for slot in self.program.slots}
+        if self.cross_block_limit is None:
+            return slots
+        # Live on entry to any block but the first, where only the initial zero is read
+        cross_block = 0
+        for mask in live_in[1:]:
+            cross_block |= mask
+        if not cross_block:
+            return slots
+        depths = self.cfg.loop_depths()
+        reads: Dict[int, int] = {}
+        instructions = self.program.instructions
+        for block in self.cfg.blocks:
+            for position in range(block.start, block.end):
+                instr = instructions[position]
+                if type(instr) is LoadIRInstruction and cross_block >> instr.src.index & 1:
+                    reads[instr.src.index] = reads.get(instr.src.index, 0) + 10 ** depths[block.index]
+        ranked = sorted(reads, key=lambda slot_index: (-reads[slot_index], slot_index))
+        return {slot_index for slot_index in slots if not cross_block >> slot_index & 1} \
+            | set(ranked[:self.cross_block_limit])
+
+    def place_phis(self, live_in: List[int]) -> Dict[int, List[PhiIRInstruction]]:
+        cfg = self.cfg
+        instructions = self.program.instructions
+        stored_in: Dict[int, Set[int]] = {}
+        for block in cfg.blocks:
+            for position in range(block.start, block.end):
+                instr = instructions[position]
+                if type(instr) is StoreIRInstruction and instr.dst.index in self.promoted:
+                    stored_in.setdefault(instr.dst.index, set()).add(block.index)
+        frontiers = self.dominance_frontiers()
+
+        phis: Dict[int, List[PhiIRInstruction]] = {}
+        for slot_index, def_blocks in stored_in.items():
+            placed: Set[int] = set()
+            worklist = list(def_blocks)
+            while worklist:
+                for frontier in frontiers[worklist.pop()]:
+                    if frontier in placed:
+                        continue
+                    placed.add(frontier)
+                    if live_in[frontier] >> slot_index & 1:
+                        phis.setdefault(frontier, []).append(
+                            PhiIRInstruction(dst=self.new_temp(), sources={}, slot=self.slots.get(slot_index)))
+                    if frontier not in def_blocks:
+                        worklist.append(frontier)
+        return phis
+
+    def construct(self) -> ProgrammIRInstruction:
+        logger.info('Building SSA form')
+        cfg = self.cfg
+        if not cfg.blocks:
+            return self.program
+        instructions = self.program.instructions
+        idom = cfg.immediate_dominators()
+        # Only reads need a phi; the memory left at exit is kept up to date by the stores
+        live_in = solve(SlotLiveness(cfg, live_at_exit=0)).block_in
+        self.promoted = promoted = self.promoted_slots(live_in)
+        phis = self.place_phis(live_in)
+
+        children: List[List[int]] = [[] for _ in cfg.blocks]
+        for index in cfg.reverse_postorder()[1:]:
+            children[idom[index]].append(index)
+
+        stacks: Dict[int, List[IRTemp]] = {}
+        alias: Dict[int, IRTemp] = {}
+        zero: Dict[int, IRTemp] = {}
+        new_blocks: List[Optional[List[IRInstruction]]] = [None] * len(cfg.blocks)
+
+        def value(temp: IRTemp) -> IRTemp:
+            return alias.get(temp.id, temp)
+
+        def current(slot_index: int) -> IRTemp:
+            stack = stacks.get(slot_index)
+            if stack:
+                return stack[-1]
+            if slot_index not in zero:
+                zero[slot_index] = self.new_temp()
+            return zero[slot_index]
+
+        def enter(index: int) -> List[int]:
+            block = cfg.blocks[index]
+            pushed: List[int] = []
+            out: List[IRInstruction] = []
+            block_phis = phis.get(index, [])
+            for position in range(block.start, block.end):
+                instr = instructions[position]
+                instr_type = type(instr)
+                if instr_type is LoadIRInstruction and instr.src.index in promoted:
+                    alias[instr.dst.id] = current(instr.src.index)
+                    continue
+                if instr_type is StoreIRInstruction and instr.dst.index in promoted:
+                    stacks.setdefault(instr.dst.index, []).append(value(instr.src))
+                    pushed.append(instr.dst.index)
+                out.append(rename_uses(instr, value))
+                if instr_type is LabelIRInstruction and position == block.start:
+                    out.extend(block_phis)
+                    for phi in block_phis:
+                        stacks.setdefault(phi.slot.index, []).append(phi.dst)
+                        pushed.append(phi.slot.index)
+            for successor in block.successors:
+                for phi in phis.get(successor, []):
+                    phi.sources[index] = current(phi.slot.index)
+            new_blocks[index] = out
+            return pushed
+
+        # A while at the very start makes the entry a join, entered once from outside the
+        # program (key -1) with every variable still zero
+        for phi in phis.get(0, []):
+            phi.sources[-1] = current(phi.slot.index)
+        stack: List[Tuple[int, int, List[int]]] = [(0, 0, enter(0))]
+        while stack:
+            index, child, pushed = stack.pop()
+            if child < len(children[index]):
+                stack.append((index, child + 1, pushed))
+                next_index = children[index][child]
+                stack.append((next_index, 0, enter(next_index)))
+            else:
+                for slot_index in pushed:
+                    stacks[slot_index].pop()
+
+        self.remove_dead_phis(phis, new_blocks)
+
+        result: List[IRInstruction] = []
+        for slot_index, temp in sorted(zero.items()):
+            result.append(ConstIRInstruction(src=IRConst.of(0), dst=temp))
+        if result and type(instructions[0]) is LabelIRInstruction:
+            # The consts form a block of their own ahead of the entry: phi sources move
+            # one block down, and the entry edge now comes from the consts
+            for block_phis in phis.values():
+                for phi in block_phis:
+                    phi.sources = {predecessor + 1: src for predecessor, src in phi.sources.items()}
+        for block, out in zip(cfg.blocks, new_blocks):
+            if out is None:
+                # Unreachable: kept as it was, memory operations included
+                result.extend(instructions[block.start:block.end])
+            else:
+                result.extend(out)
+        return ProgrammIRInstruction(instructions=result, slots=list(self.program.slots))
+
+    def remove_dead_phis(self, phis: Dict[int, List[PhiIRInstruction]],
+                         new_blocks: List[Optional[List[IRInstruction]]]) -> None:
+        # A phi is live when something other than a dead phi reads it
+        defining: Dict[int, PhiIRInstruction] = {}
+        for block_phis in phis.values():
+            for phi in block_phis:
+                defining[phi.dst.id] = phi
+        live: Set[int] = set()
+        worklist: List[int] = []
+        for out in new_blocks:
+            for instr in out or ():
+                if type(instr) is PhiIRInstruction:
+                    continue
+                for temp in instr.used_temps():
+                    if temp.id in defining and temp.id not in live:
+                        live.add(temp.id)
+                        worklist.append(temp.id)
+        while worklist:
+            for temp in defining[worklist.pop()].sources.values():
+                if temp.id in defining and temp.id not in live:
+                    live.add(temp.id)
+                    worklist.append(temp.id)
+        for index, out in enumerate(new_blocks):
+            if out is not None and index in phis:
+                new_blocks[index] = [instr for instr in out
+                                     if type(instr) is not PhiIRInstruction or instr.dst.id in live]
+
+
+# Copies dst_i = src_i that all happen at once, as the phis of one edge do, in an order
+# that reads every source before it is overwritten. When only cycles are left (a swap),
+# the old value of one destination is saved to a new temp first.
+def sequentialize_copies(copies: List[Tuple[IRTemp, IRTemp]],
+                         new_temp: Callable[[], IRTemp]) -> List[CopyIRInstruction]:
+    pending = [(dst, src) for dst, src in copies if dst != src]
+    result: List[CopyIRInstruction] = []
+    while pending:
+        sources = {src for _, src in pending}
+        for number, (dst, src) in enumerate(pending):
+            if dst not in sources:
+                result.append(CopyIRInstruction(src=src, dst=dst))
+                del pending[number]
+                break
+        else:
+            blocked = pending[0][0]
+            saved = new_temp()
+            result.append(CopyIRInstruction(src=blocked, dst=saved))
+            pending = [(dst, saved if src == blocked else src) for dst, src in pending]
+    return result
+
+
+# Replaces the phis with copies on the incoming edges:
+#   - a predecessor ending in a jump gets them before the jump, one falling through after
+#     its last instruction;
+#   - on the fall-through edge of a branch they go right after the branch;
+#   - the taken edge of a branch is redirected to a stub, a new label plus the copies,
+#     placed just before the join. Stubs end with a jump to the join except the last one,
+#     which falls into it, and code above that would fall into a stub jumps over it. When
+#     the branch both falls through and jumps to the join, its stub comes first and is
+#     fallen into, so both ways run the copies once.
+# Values left unread are removed from the result, so every temp reaching the Lowerer is
+# read at least once.
+class SSADestructor:
+    def __init__(self, program: ProgrammIRInstruction):
+        self.program = program
+        self.cfg = build_cfg(program)
+        self.next_temp = max_temp_id(program) + 1
+        self.next_label = max_label_index(program) + 1
+
+    def new_temp(self) -> IRTemp:
+        temp = IRTemp(self.next_temp)
+        self.next_temp += 1
+        return temp
+
+    def new_label(self) -> IRLabel:
+        label = IRLabel(self.next_label)
+        self.next_label += 1
+        return label
+
+    def destruct(self) -> ProgrammIRInstruction:
+        logger.info('Leaving SSA form')
+        cfg = self.cfg
+        instructions = self.program.instructions
+        # Copies per edge (predecessor, block), in phi order
+        edge_copies: Dict[Tuple[int, int], List[Tuple[IRTemp, IRTemp]]] = {}
+        for block in cfg.blocks:
+            for position in range(block.start, block.end):
+                instr = instructions[position]
+                if type(instr) is PhiIRInstruction:
+                    for predecessor, src in instr.sources.items():
+                        edge_copies.setdefault((predecessor, block.index), []).append((instr.dst, src))
+
+        at_end: Dict[int, List[IRInstruction]] = {}
+        before_jump: Dict[int, List[IRInstruction]] = {}
+        # Stubs before each block, as (fallen into from the block above, code)
+        stubs: Dict[int, List[Tuple[bool, List[IRInstruction]]]] = {}
+        retarget: Dict[int, IRLabel] = {}
+        for (predecessor, index), copies in edge_copies.items():
+            sequence = sequentialize_copies(copies, self.new_temp)
+            if not sequence:
+                continue
+            last = instructions[cfg.blocks[predecessor].end - 1]
+            if type(last) is JumpIRInstruction:
+                before_jump.setdefault(predecessor, []).extend(sequence)
+            elif type(last) is not BranchIRInstruction or cfg.block_of_label[last.label.index] != index:
+                at_end.setdefault(predecessor, []).extend(sequence)
+            else:
+                stub = self.new_label()
+                retarget[predecessor] = stub
+                fallen_into = predecessor + 1 == index
+                code: List[IRInstruction] = [LabelIRInstruction(stub)]
+                code.extend(sequence)
+                block_stubs = stubs.setdefault(index, [])
+                if fallen_into:
+                    block_stubs.insert(0, (True, code))
+                else:
+                    block_stubs.append((False, code))
+
+        result: List[IRInstruction] = []
+        for block in cfg.blocks:
+            block_stubs = stubs.get(block.index)
+            if block_stubs:
+                join = JumpIRInstruction(IRLabel(block.label))
+                if result and type(result[-1]) is not JumpIRInstruction and not block_stubs[0][0]:
+                    result.append(join)
+                for number, (_, code) in enumerate(block_stubs):
+                    result.extend(code)
+                    if number < len(block_stubs) - 1:
+                        result.append(join)
+            for position in range(block.start, block.end):
+                instr = instructions[position]
+                instr_type = type(instr)
+                if instr_type is PhiIRInstruction:
+                    continue
+                if position == block.end - 1:
+                    if instr_type is JumpIRInstruction:
+                        result.extend(before_jump.get(block.index, ()))
+                    elif instr_type is BranchIRInstruction and block.index in retarget:
+                        instr = BranchIRInstruction(left=instr.left, right=instr.right,
+                                                    label=retarget[block.index], op=instr.op)
+                result.append(instr)
+            result.extend(at_end.get(block.index, ()))
+        return ProgrammIRInstruction(instructions=remove_dead_values(result), slots=list(self.program.slots))
+
+
+# Drops the instructions computing values nothing reads, such as the value of a variable
+# overwritten before any read, which SSA form leaves behind without its store. Values are
+# live when a store, print or branch reads them, or an instruction computing a live value
+# does; the rest can go, as computing a value has no other effect.
+def remove_dead_values(instructions: List[IRInstruction]) -> List[IRInstruction]:
+    definitions: Dict[int, List[IRInstruction]] = {}
+    live: Set[int] = set()
+    worklist: List[int] = []
+    for instr in instructions:
+        defined = instr.defined_temps()
+        for temp in defined:
+            definitions.setdefault(temp.id, []).append(instr)
+        if not defined:
+            for temp in instr.used_temps():
+                if temp.id not in live:
+                    live.add(temp.id)
+                    worklist.append(temp.id)
+    while worklist:
+        for instr in definitions.get(worklist.pop(), ()):
+            for temp in instr.used_temps():
+                if temp.id not in live:
+                    live.add(temp.id)
+                    worklist.append(temp.id)
+    return [instr for instr in instructions
+            if not instr.defined_temps() or any(temp.id in live for temp in instr.defined_temps())]
+
+
+def to_ssa(program: ProgrammIRInstruction, cross_block_limit: Optional[int] = None) -> ProgrammIRInstruction:
+    return SSAConstructor(program, cross_block_limit).construct()
+
+
+def from_ssa(program: ProgrammIRInstruction) -> ProgrammIRInstruction:
+    return SSADestructor(program).destruct()
+
+
+__all__ = ['max_temp_id', 'rename_uses', 'SSAConstructor', 'SSADestructor', 'sequentialize_copies',
+           'remove_dead_values', 'to_ssa', 'from_ssa']
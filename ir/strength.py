@@ -0,0 +1,238 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from backend.isa import ALUOp, ALU_CYCLES, ALU_OP_MAP
+from common.tracing import tracer
+from sim.alu import MASK, WORD_BITS
+from .instructions import *
+from .program import ProgrammIRInstruction
+from .ssa import max_temp_id, remove_dead_values
+from .values import *
+
+import logging
+logger = logging.getLogger('Strength Reduction')
+
+# A product as a sum of the left operand shifted left: (sign, shift) per term
+Terms = List[Tuple[int, int]]
+
+
+def power_of_two(value: int) -> Optional[int]:
+    # k when value is 2 ** k
+    if value and not value & (value - 1):
+        return value.bit_length() - 1
+    return None
+
+
+def signed_digits(value: int) -> Terms:
+    # The non-adjacent form of value, fewest nonzero digits of +1 and -1: 7 is 8 - 1.
+    # Digits at 2 ** 16 and above multiply to 0 in 16 bits and are left out.
+    terms: Terms = []
+    shift = 0
+    while value:
+        if value & 1:
+            digit = 2 - (value & 3)
+            value -= digit
+            if shift < WORD_BITS:
+                terms.append((digit, shift))
+        value >>= 1
+        shift += 1
+    return terms
+
+
+@lru_cache(maxsize=None)
+def division_magic(divisor: int) -> Tuple[int, int]:
+    # (m, s) with x // divisor == (x * m) >> (16 + s) for every 16-bit x (Granlund and
+    # Montgomery): it holds when m is the smallest multiplier reaching 2 ** (16 + s) and
+    # overshoots it by at most 2 ** s. The first s that works gives m below 2 ** 16, which
+    # MULH takes as it is, or, when there is none, below 2 ** 17.
+    shift = 0
+    while True:
+        scale = 1 << (WORD_BITS + shift)
+        multiplier = -(-scale // divisor)
+        if multiplier * divisor - scale <= 1 << shift:
+            return multiplier, shift
+        shift += 1
+
+
+def cycles(ops: List[ALUOp]) -> int:
+    return sum(ALU_CYCLES[op] for op in ops)
+
+
+@dataclass
+class StrengthReductionStats:
+    # Multiplies and divides by a power of two, remainders of one
+    shifts: int = 0
+    masks: int = 0
+    # Multiplies by a sum or difference of powers of two
+    shift_adds: int = 0
+    # Divides and remainders by other constants, through the high word of a product
+    magic_divides: int = 0
+    # Estimated cycles (backend.isa.ALU_CYCLES) of the operations rewritten, once each
+    cycles_before: int = 0
+    cycles_after: int = 0
+
+    @property
+    def cycles_saved(self) -> int:
+        return self.cycles_before - self.cycles_after
+
+
+# Strength reduction of *, / and % by constants (temps written once by a
+# ConstIRInstruction, or IRConst operands), all exact in unsigned 16-bit arithmetic:
+#   - x * 2 ** k is x << k, x / 2 ** k is x >> k and x % 2 ** k is x & (2 ** k - 1);
+#   - x * c is a sum of x shifted left by the signed digits of c, like x * 7 as
+#     (x << 3) - x, when those shifts and adds cost fewer cycles than the MUL;
+#   - x / c is mulh(x, m) >> s for the magic multiplier m of c, and x % c is x minus
+#     that quotient times c, when the multiplier exists and is cheaper than the divider.
+# What is cheaper comes from backend.isa.ALU_CYCLES. Multiplying or dividing by 0 or 1 is
+# left to ir.isel, and constants no longer read are removed.
+class StrengthReducer:
+    def __init__(self, program: ProgrammIRInstruction):
+        self.program = program
+        self.stats = StrengthReductionStats()
+        definitions: Dict[int, int] = {}
+        for instr in program.instructions:
+            for temp in instr.defined_temps():
+                definitions[temp.id] = definitions.get(temp.id, 0) + 1
+        # Temps written once, the only ones whose constant value holds at every read
+        self.single = {temp_id for temp_id, count in definitions.items() if count == 1}
+        self.constants: Dict[int, int] = {}
+        self.next_temp = max_temp_id(program) + 1
+
+    def run(self) -> ProgrammIRInstruction:
+        logger.info('Reducing strength of %s IR instructions', len(self.program.instructions))
+        result: List[IRInstruction] = []
+        for instr in self.program.instructions:
+            instr_type = type(instr)
+            if instr_type is ConstIRInstruction and instr.dst.id in self.single:
+                self.constants[instr.dst.id] = instr.src.value & MASK
+            elif instr_type is BinOpIRInstruction:
+                reduced = self.reduce(instr)
+                if reduced is not None:
+                    result.extend(reduced)
+                    continue
+            result.append(instr)
+        if self.stats.cycles_saved:
+            result = remove_dead_values(result)
+        stats = self.stats
+        logger.info('Strength reduction saved an estimated %s of %s cycles (%s shifts, %s masks, '
+                    '%s shift-adds, %s magic divides)', stats.cycles_saved, stats.cycles_before,
+                    stats.shifts, stats.masks, stats.shift_adds, stats.magic_divides)
+        if tracer.enabled:
+            tracer.count('strength.cycles_saved', stats.cycles_saved)
+        return ProgrammIRInstruction(instructions=result, slots=self.program.slots)
+
+    def constant(self, value: IRValue) -> Optional[int]:
+        if isinstance(value, IRConst):
+            return value.value & MASK
+        return self.constants.get(value.id)
+
+    def new_temp(self) -> IRTemp:
+        temp = IRTemp(self.next_temp)
+        self.next_temp += 1
+        return temp
+
+    def reduce(self, instr: BinOpIRInstruction) -> Optional[List[IRInstruction]]:
+        # The instructions computing instr's value more cheaply, None to keep it
+        op = ALU_OP_MAP.get(instr.op)
+        if op not in (ALUOp.MUL, ALUOp.DIV, ALUOp.DIVH):
+            return None
+        operand, value = instr.left, self.constant(instr.right)
+        if op == ALUOp.MUL and value is None:
+            operand, value = instr.right, self.constant(instr.left)
+        if value is None or value <= 1 or isinstance(operand, IRConst) or self.constant(operand) is not None:
+            # Constant operands are ir.isel's to fold
+            return None
+        stats = self.stats
+        shift = power_of_two(value)
+        if shift is not None:
+            if op == ALUOp.DIVH:
+                stats.masks += 1
+                reduced = [BinOpIRInstruction(left=operand, right=IRConst.of(value - 1), op='&', dst=instr.dst)]
+            else:
+                stats.shifts += 1
+                reduced = [BinOpIRInstruction(left=operand, right=IRConst.of(shift),
+                                              op='<<' if op == ALUOp.MUL else '>>', dst=instr.dst)]
+        elif op == ALUOp.MUL:
+            reduced = self.multiply(operand, value, instr.dst)
+            if reduced is None:
+                return None
+            stats.shift_adds += 1
+        else:
+            reduced = self.divide(operand, value, instr.dst, op == ALUOp.DIVH)
+            if reduced is None:
+                return None
+            stats.magic_divides += 1
+        stats.cycles_before += ALU_CYCLES[op]
+        stats.cycles_after += cycles([ALU_OP_MAP[new_instr.op] for new_instr in reduced])
+        return reduced
+
+    def multiply(self, operand: IRTemp, value: int, dst: IRTemp) -> Optional[List[IRInstruction]]:
+        # operand * value as shifts and adds, None unless cheaper than a MUL
+        terms = sorted(signed_digits(value), reverse=True)
+        if not terms or terms[0][0] < 0:
+            return None
+        ops = [ALUOp.SHL for _, shift in terms if shift] + [ALUOp.ADD] * (len(terms) - 1)
+        if cycles(ops) >= ALU_CYCLES[ALUOp.MUL]:
+            return None
+        reduced: List[IRInstruction] = []
+        parts: List[IRTemp] = []
+        for _, shift in terms:
+            if not shift:
+                parts.append(operand)
+                continue
+            part = dst if len(terms) == 1 else self.new_temp()
+            reduced.append(BinOpIRInstruction(left=operand, right=IRConst.of(shift), op='<<', dst=part))
+            parts.append(part)
+        total = parts[0]
+        for index in range(1, len(terms)):
+            sign = terms[index][0]
+            result = dst if index == len(terms) - 1 else self.new_temp()
+            reduced.append(BinOpIRInstruction(left=total, right=parts[index], op='+' if sign > 0 else '-', dst=result))
+            total = result
+        return reduced
+
+    def divide(self, operand: IRTemp, value: int, dst: IRTemp, remainder: bool) -> Optional[List[IRInstruction]]:
+        # operand / value, or operand % value, through the magic multiplier of value;
+        # None unless cheaper than the divider
+        multiplier, shift = division_magic(value)
+        reduced: List[IRInstruction] = []
+        quotient = dst if not remainder else self.new_temp()
+        if multiplier <= MASK:
+            high = quotient if not shift else self.new_temp()
+            reduced.append(BinOpIRInstruction(left=operand, right=IRConst.of(multiplier), op='mulh', dst=high))
+            if shift:
+                reduced.append(BinOpIRInstruction(left=high, right=IRConst.of(shift), op='>>', dst=quotient))
+        else:
+            # A 17-bit m: with t = mulh(x, m - 2 ** 16), (x + t) >> s is the quotient,
+            # computed as (((x - t) >> 1) + t) >> (s - 1) so the sum never overflows
+            high, difference, half, total = (self.new_temp() for _ in range(4))
+            reduced.append(BinOpIRInstruction(left=operand, right=IRConst.of(multiplier - MASK - 1), op='mulh', dst=high))
+            reduced.append(BinOpIRInstruction(left=operand, right=high, op='-', dst=difference))
+            reduced.append(BinOpIRInstruction(left=difference, right=IRConst.of(1), op='>>', dst=half))
+            if shift > 1:
+                reduced.append(BinOpIRInstruction(left=half, right=high, op='+', dst=total))
+                reduced.append(BinOpIRInstruction(left=total, right=IRConst.of(shift - 1), op='>>', dst=quotient))
+            else:
+                reduced.append(BinOpIRInstruction(left=half, right=high, op='+', dst=quotient))
+        if remainder:
+            product = self.new_temp()
+            times = self.multiply(quotient, value, product)
+            if times is None:
+                times = [BinOpIRInstruction(left=quotient, right=IRConst.of(value), op='*', dst=product)]
+            reduced.extend(times)
+            reduced.append(BinOpIRInstruction(left=operand, right=product, op='-', dst=dst))
+        cost = cycles([ALU_OP_MAP[new_instr.op] for new_instr in reduced])
+        if cost >= ALU_CYCLES[ALUOp.DIVH if remainder else ALUOp.DIV]:
+            return None
+        return reduced
+
+
+def reduce_strength(program: ProgrammIRInstruction) -> Tuple[ProgrammIRInstruction, StrengthReductionStats]:
+    reducer = StrengthReducer(program)
+    return reducer.run(), reducer.stats
+
+
+__all__ = ['StrengthReductionStats', 'StrengthReducer', 'reduce_strength']
@@ -1,40 +1,79 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
+from typing import Dict, Tuple
 
 
-@dataclass
+@dataclass(frozen=True)
 class IRValue:
-    pass
+    __slots__ = ()
 
+    def __reduce__(self):
+        # Frozen slotted instances cannot be restored through setattr, so pickle via the constructor
+        return self.__class__, tuple(getattr(self, field.name) for field in fields(self))
 
-@dataclass
+
+@dataclass(frozen=True)
 class IRTemp(IRValue):
+    __slots__ = ('id',)
     id: int
 
     def __repr__(self):
         return f"IRTemp({self.id})"
  
 
-@dataclass
+@dataclass(frozen=True)
 class IRConst(IRValue):
+    __slots__ = ('value',)
     value: int
 
+    @classmethod
+    def of(cls, value: int) -> 'IRConst':
+        const = _const_pool.get(value)
+        if const is None:
+            const = cls(value)
+            if 0 <= value < CONST_POOL_LIMIT:
+                _const_pool[value] = const
+        return const
+
     def __repr__(self):
         return f"IRConst({self.value})"
 
 
-@dataclass
+@dataclass(frozen=True)
 class IRSlot(IRValue):
+    __slots__ = ('index', 'name')
     index: int
     name: str
+
+    @classmethod
+    def of(cls, index: int, name: str) -> 'IRSlot':
+        key = (index, name)
+        slot = _slot_pool.get(key)
+        if slot is None:
+            if len(_slot_pool) >= SLOT_POOL_LIMIT:
+                _slot_pool.clear()
+            slot = _slot_pool[key] = cls(index, name)
+        return slot
+
     def __repr__(self):
         return f"IRSlot(index={self.index}, name='{self.name}')"
 
 
-@dataclass
+@dataclass(frozen=True)
 class IRLabel(IRValue):
+    __slots__ = ('index',)
     index: int
     def __repr__(self):
         return f"IRLabel(index={self.index})"
 
 
-__all__ = ['IRValue', 'IRTemp', 'IRConst', 'IRSlot']
\ No newline at end of file
+# Immutable values are shared: one IRConst per literal and one IRSlot per (index, name).
+# The pools outlive a compile, so both are bounded for long-running batch and incremental
+# workers: only 16-bit constants are pooled, and the slot pool starts over when full.
+# Sharing saves memory only; values compare equal either way.
+CONST_POOL_LIMIT = 1 << 16
+SLOT_POOL_LIMIT = 4096
+_const_pool: Dict[int, IRConst] = {}
+_slot_pool: Dict[Tuple[int, str], IRSlot] = {}
+
+
+__all__ = ['IRValue', 'IRTemp', 'IRConst', 'IRSlot']
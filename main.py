@@ -1,78 +1,100 @@
-import time
-from typing import List
+import argparse
+import sys
+from dataclasses import replace
 
-from backend.encoder import Encoder
-from backend.lowerer import Lowerer
-from backend.regalloc import RegisterAllocator
-from frontend.lexer import Lexer, Token
-from frontend.parser import Parser
-from frontend.symbol_table import SemanticAnalyzer
-from frontend.ast_leg import Program
-from ir.builder import IRBuilder
+from backend.regalloc import REGISTER_ALLOCATORS
+from common.tracing import TRACE_FORMATS, tracer
+from driver.batch import collect_sources, run_batch
+from driver.compiler import Compiler, CompileOptions
 
 import logging
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(levelname)s:%(name)s:%(message)s'
-)
-
-
-
-code = """
-var n = 6;
-var result = 1;
-
-while n > 1:{
-    var result = result * n;
-    var n = n - 1;
-}
-var aaaa = 0;
-"""
-
-lexer = Lexer(code)
-tokens: List[Token] = lexer.tokenize()
-print('tokens'+'-'*10)
-for tok_type, tok_value in tokens:
-    print(f'{tok_type:8} | {tok_value}')
-
-leg_parser = Parser(tokens)
-leg_ast: Program = leg_parser.parse_program()
-print('leg_ast'+'-'*10)
-print(leg_ast)
-
-analyzer = SemanticAnalyzer()
-analyzer.visit(leg_ast)
-print('symbol_table'+'-'*10)
-print(analyzer.table.symbols)
-
-builder = IRBuilder(symbol_table=analyzer.table)
-ir_program = builder.build_program(leg_ast)
-print('ir_program'+'-'*10)
-print(ir_program)
-
-lowerer = Lowerer(ir_program)
-lowered_program = lowerer.lower()
-
-import pprint
-pprint.pprint(ir_program.instructions) 
-pprint.pprint(ir_program.slots)
-
-print('-------'*10)
-
-pprint.pprint(lowered_program)
-
-print('-------'*10)
-encoder = Encoder()
-code = encoder.encode_program(lowered_program=lowered_program)
-
-time.sleep(1)
-
-for word in code:
-    s = f'{word[0]:016b}'
-    print(f'{s[:3]} {s[3:7]} {s[7:10]} {s[10:13]} {s[13:]} {word[1]}')
-
-for word in code:
-    print(f'{word[0]} {word[1]}')
-
 
+def build_arg_parser() -> argparse.ArgumentParser:
+    arg_parser = argparse.ArgumentParser(description='LEG-16 batch compiler')
+    arg_parser.add_argument('paths', nargs='+',
+                            help='source files or directories (directories are searched for *.leg)')
+    arg_parser.add_argument('-o', '--output-dir',
+                            help='directory for .words files (default: next to each source)')
+    arg_parser.add_argument('-j', '--jobs', type=int, default=None,
+                            help='number of worker processes (default: CPU count)')
+    arg_parser.add_argument('--cache-dir',
+                            help='reuse compile results cached in this directory')
+    arg_parser.add_argument('--dump', action='store_true',
+                            help='print every compiler stage (single file only)')
+    arg_parser.add_argument('--packed-ir', action='store_true',
+                            help='use the struct-of-arrays IR (same output, less memory on large programs)')
+    arg_parser.add_argument('--regalloc', choices=sorted(REGISTER_ALLOCATORS), default='linear_scan',
+                            help='register allocator; spill_all keeps every temp in memory (a baseline)')
+    arg_parser.add_argument('--no-reorder', action='store_true',
+                            help='evaluate operands left to right instead of the costlier one first')
+    arg_parser.add_argument('--ssa', action='store_true',
+                            help='keep variables in registers across statements (SSA form) instead of memory')
+    arg_parser.add_argument('--fold-constants', action='store_true',
+                            help='evaluate constant expressions and branches at compile time')
+    arg_parser.add_argument('--optimize-memory', action='store_true',
+                            help='forward stored values to loads, drop dead stores, keep loop variables in registers')
+    arg_parser.add_argument('--value-numbering', action='store_true',
+                            help='reuse identical loads and operations instead of recomputing them')
+    arg_parser.add_argument('--peephole', action='store_true',
+                            help='remove redundant MAR moves, loads, constant moves and jumps from the lowered code')
+    arg_parser.add_argument('--select-instructions', action='store_true',
+                            help='use immediate operands for constants and decide branches on constants at compile time')
+    arg_parser.add_argument('--reduce-strength', action='store_true',
+                            help='replace multiplies, divides and remainders by constants with cheaper operations')
+    arg_parser.add_argument('--trace',
+                            help='record stage timings and counters and write them to this file '
+                                 '(compiles in-process)')
+    arg_parser.add_argument('--trace-format', choices=TRACE_FORMATS, default='chrome',
+                            help='chrome: trace events for chrome://tracing or Perfetto; json: per-stage summary')
+    arg_parser.add_argument('--log-level', default='WARNING',
+                            help='logging level, e.g. DEBUG or INFO')
+    return arg_parser
+
+
+def main(argv=None) -> int:
+    args = build_arg_parser().parse_args(argv)
+    logging.basicConfig(
+        level=args.log_level.upper(),
+        format='%(levelname)s:%(name)s:%(message)s'
+    )
+
+    if args.trace:
+        tracer.enable()
+    try:
+        return run(args)
+    finally:
+        if args.trace:
+            tracer.export(args.trace, args.trace_format)
+
+
+def run(args) -> int:
+    sources = collect_sources(args.paths)
+    options = CompileOptions(packed_ir=args.packed_ir, register_allocator=args.regalloc,
+                             reorder_operands=not args.no_reorder, ssa=args.ssa,
+                             fold_constants=args.fold_constants, optimize_memory=args.optimize_memory,
+                             value_numbering=args.value_numbering, peephole=args.peephole,
+                             select_instructions=args.select_instructions, reduce_strength=args.reduce_strength,
+                             pause_gc=True)
+    if args.dump:
+        if len(sources) != 1:
+            print('--dump needs exactly one source file', file=sys.stderr)
+            return 2
+        with open(sources[0], encoding='utf-8') as f:
+            Compiler(replace(options, dump_stages=True)).compile(f.read())
+        return 0
+
+    report = run_batch(sources, options, output_dir=args.output_dir,
+                       jobs=1 if args.trace else args.jobs, cache_dir=args.cache_dir)
+    for result in report.failed:
+        print(f'{result.path}: {result.error}', file=sys.stderr)
+    print(f'Compiled {len(report.results) - len(report.failed)}/{len(report.results)} files '
+          f'in {report.elapsed:.3f}s ({report.files_per_second:.1f} files/s)')
+    if args.cache_dir is not None:
+        stats = report.cache_stats
+        print(f'Cache: {stats.hits} hits, {stats.misses} misses ({stats.hit_rate:.0%})')
+    return 1 if report.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
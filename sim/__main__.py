@@ -0,0 +1,52 @@
+import argparse
+import sys
+
+from driver.compiler import compile
+from sim.decoder import read_words
+from sim.interpreter import DEFAULT_MAX_STEPS, SimulationError, Simulator
+from sim.translator import TranslatingSimulator
+
+ENGINES = {'interpret': Simulator, 'translate': TranslatingSimulator}
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    arg_parser = argparse.ArgumentParser(prog='python -m sim', description='Run a LEG-16 program')
+    arg_parser.add_argument('path', help='a .leg source (compiled first) or a .words file')
+    arg_parser.add_argument('--input', type=int, nargs='*', default=[],
+                            help='values returned by reads of the IO register')
+    arg_parser.add_argument('--max-steps', type=int, default=DEFAULT_MAX_STEPS)
+    arg_parser.add_argument('--engine', choices=sorted(ENGINES), default='translate',
+                            help='decode-and-dispatch interpreter or binary translation to Python')
+    arg_parser.add_argument('--stats', action='store_true', help='print execution statistics')
+    return arg_parser
+
+
+def main(argv=None) -> int:
+    args = build_arg_parser().parse_args(argv)
+    if args.path.endswith('.leg'):
+        with open(args.path, encoding='utf-8') as f:
+            words = compile(f.read())
+    else:
+        words = read_words(args.path)
+
+    try:
+        result = ENGINES[args.engine](words, args.input).run(args.max_steps)
+    except SimulationError as e:
+        print(f'{args.path}: {e}', file=sys.stderr)
+        return 1
+
+    for value in result.output:
+        print(value)
+    if args.stats:
+        stats = result.stats
+        print(f'{stats.instructions} instructions in {stats.seconds:.3f}s '
+              f'({stats.instructions_per_second / 1e6:.2f} M instr/s)', file=sys.stderr)
+        print(f'memory traffic: {stats.loads} loads, {stats.stores} stores; '
+              f'{stats.branches} branches; IO {stats.io_reads} in, {stats.io_writes} out', file=sys.stderr)
+        for mnemonic, count in stats.by_opcode.items():
+            print(f'  {mnemonic:16} {count:>12}', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
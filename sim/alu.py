@@ -0,0 +1,89 @@
+from typing import Callable, Dict
+
+from backend.isa import ALUOp, BranchOp
+
+# LEG-16 arithmetic. Registers hold unsigned 16-bit values; every result wraps to 16 bits.
+#
+# Shared by the simulators and by compile-time constant evaluation, so folded code and
+# executed code can never disagree. Semantics of the cases hardware leaves open:
+#   - shifts by 16 or more give 0, rotates use the amount modulo 16
+#   - DIV/DIVH (the / and % of the language) are unsigned; dividing by zero gives
+#     0xFFFF for DIV and the dividend for DIVH
+#   - NOT ignores b, MOV returns b (the immediate in CALC_IMM form)
+
+WORD_BITS = 16
+MASK = 0xFFFF
+SIGN_BIT = 0x8000
+
+
+def to_signed(value: int) -> int:
+    return value - 0x10000 if value & SIGN_BIT else value
+
+
+def _div(a: int, b: int) -> int:
+    return a // b if b else MASK
+
+
+def _rem(a: int, b: int) -> int:
+    return a % b if b else a
+
+
+def _rol(a: int, b: int) -> int:
+    b &= 15
+    return ((a << b) | (a >> (16 - b))) & MASK
+
+
+def _ror(a: int, b: int) -> int:
+    b &= 15
+    return ((a >> b) | (a << (16 - b))) & MASK
+
+
+# Operands are already in 0..MASK
+ALU_FUNCTIONS: Dict[int, Callable[[int, int], int]] = {
+    ALUOp.ADD: lambda a, b: (a + b) & MASK,
+    ALUOp.SUB: lambda a, b: (a - b) & MASK,
+    ALUOp.AND: lambda a, b: a & b,
+    ALUOp.OR: lambda a, b: a | b,
+    ALUOp.NOT: lambda a, b: ~a & MASK,
+    ALUOp.XOR: lambda a, b: a ^ b,
+    ALUOp.SHL: lambda a, b: (a << b) & MASK if b < WORD_BITS else 0,
+    ALUOp.SHR: lambda a, b: a >> b,
+    ALUOp.MUL: lambda a, b: (a * b) & MASK,
+    ALUOp.MULH: lambda a, b: (a * b) >> WORD_BITS,
+    ALUOp.DIV: _div,
+    ALUOp.DIVH: _rem,
+    ALUOp.MOV: lambda a, b: b,
+    ALUOp.ROL: _rol,
+    ALUOp.ROR: _ror,
+}
+
+BRANCH_CONDITIONS: Dict[int, Callable[[int, int], bool]] = {
+    BranchOp.BLE: lambda a, b: to_signed(a) <= to_signed(b),
+    BranchOp.BLT: lambda a, b: to_signed(a) < to_signed(b),
+    BranchOp.BGE: lambda a, b: to_signed(a) >= to_signed(b),
+    BranchOp.BGT: lambda a, b: to_signed(a) > to_signed(b),
+    BranchOp.BLEU: lambda a, b: a <= b,
+    BranchOp.BLTU: lambda a, b: a < b,
+    BranchOp.BGEU: lambda a, b: a >= b,
+    BranchOp.BGTU: lambda a, b: a > b,
+    BranchOp.BEQ: lambda a, b: a == b,
+    BranchOp.BNE: lambda a, b: a != b,
+    BranchOp.JUMP: lambda a, b: True,
+}
+
+
+def alu(op: int, a: int, b: int) -> int:
+    function = ALU_FUNCTIONS.get(op)
+    if function is None:
+        raise NotImplementedError(f'ALU operation {op} is not defined')
+    return function(a & MASK, b & MASK)
+
+
+def branch_taken(op: int, a: int, b: int) -> bool:
+    condition = BRANCH_CONDITIONS.get(op)
+    if condition is None:
+        raise NotImplementedError(f'Branch operation {op} is not defined')
+    return condition(a & MASK, b & MASK)
+
+
+__all__ = ['MASK', 'WORD_BITS', 'to_signed', 'ALU_FUNCTIONS', 'BRANCH_CONDITIONS', 'alu', 'branch_taken']
@@ -0,0 +1,399 @@
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # optional: only the batch simulator needs it
+    np = None
+
+from backend.encoder import EncodedWord
+from backend.isa import ALUOp, BranchOp, DecOp, MemOp
+from sim.alu import ALU_FUNCTIONS, BRANCH_CONDITIONS, MASK
+from sim.decoder import DecodedInstruction, decode_program
+from sim.interpreter import (DEFAULT_MAX_STEPS, IO, MAR, MEMORY_WORDS, SimResult, SimulationError,
+                             collect_stats)
+
+import logging
+
+logger = logging.getLogger('BatchSimulator')
+
+# Instruction kinds lanes are grouped by: (dec_op << 4) | op for everything executed
+# vectorized, plus two kinds of our own
+KIND_IO = 128  # touches the IO register: executed lane by lane
+KIND_HALT = 129  # one past the end of a program
+
+RUNNING, HALTED, FAILED = 0, 1, 2
+
+
+@dataclass
+class BatchResult:
+    # Per lane: the result, or the error the scalar simulator would have raised
+    results: List[Optional[SimResult]]
+    errors: List[Optional[SimulationError]]
+    seconds: float = 0.0
+    lockstep_steps: int = 0
+
+    @property
+    def failed(self) -> List[int]:
+        return [lane for lane, error in enumerate(self.errors) if error is not None]
+
+
+@dataclass
+class _Code:
+    # Every distinct program laid out back to back, each followed by a halt sentinel
+    programs: List[List[DecodedInstruction]] = field(default_factory=list)
+    bases: List[int] = field(default_factory=list)
+    errors: List[Optional[str]] = field(default_factory=list)
+    instructions: List[Optional[DecodedInstruction]] = field(default_factory=list)
+
+
+# Lockstep simulator for many LEG-16 machine instances at once, bit-identical to
+# sim.interpreter.Simulator lane by lane.
+#
+# Registers (R0-R5, MAR), PCs and data memories of all lanes are uint16 NumPy arrays.
+# Each step gathers the instruction every running lane is at, groups the lanes by
+# instruction kind and executes every group with one vectorized operation. Lanes may run
+# different programs (the code of all distinct programs is concatenated) or the same
+# program on different inputs. Halted lanes, lanes over the step limit and lanes whose
+# program the scalar simulator would reject are masked out.
+#
+# IO is inherently sequential per lane, so instructions reading or writing the IO
+# register run lane by lane with the scalar ALU.
+class BatchSimulator:
+    def __init__(self,
+                 programs: Sequence[Sequence[EncodedWord]],
+                 inputs: Optional[Sequence[Iterable[int]]] = None,
+                 memory_words: int = MEMORY_WORDS) -> None:
+        if np is None:
+            raise ImportError('BatchSimulator requires numpy')
+        programs = [list(words) for words in programs]
+        if inputs is not None and len(programs) == 1:
+            # One program over many input sets
+            programs = programs * len(inputs)
+        lanes = len(programs)
+        if inputs is not None and len(inputs) != lanes:
+            raise ValueError(f'{len(inputs)} input sets for {lanes} programs')
+        if not 0 < memory_words <= MEMORY_WORDS:
+            raise ValueError(f'memory_words must be in 1..{MEMORY_WORDS}')
+
+        self.lanes = lanes
+        self.memory_words = memory_words
+        self.input_sets = [list(values) for values in inputs] if inputs is not None else [[]] * lanes
+        self.code = _Code()
+        self.program_of = self.load_programs(programs)
+        self.build_tables()
+
+        self.code_base = np.array([self.code.bases[p] for p in self.program_of], dtype=np.int64)
+        lengths = np.array([len(self.code.programs[p]) + 1 for p in self.program_of], dtype=np.int64)
+        # counts of lane i start at count_base[i]: one slot per instruction plus the sentinel
+        self.count_base = np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(np.int64)
+        self.count_size = int(lengths.sum())
+        self.reset()
+
+    def load_programs(self, programs: List[List[EncodedWord]]) -> List[int]:
+        ids: Dict[Tuple[EncodedWord, ...], int] = {}
+        program_of = []
+        for words in programs:
+            key = tuple(words)
+            if key not in ids:
+                ids[key] = len(self.code.programs)
+                program = decode_program(words)
+                self.code.programs.append(program)
+                self.code.bases.append(len(self.code.instructions))
+                self.code.errors.append(check_program(program))
+                self.code.instructions.extend(program)
+                self.code.instructions.append(None)
+            program_of.append(ids[key])
+        return program_of
+
+    def build_tables(self) -> None:
+        size = len(self.code.instructions)
+        kind = np.full(size, KIND_HALT, dtype=np.uint8)
+        rs1 = np.zeros(size, dtype=np.int64)
+        rs2 = np.zeros(size, dtype=np.int64)
+        rd = np.zeros(size, dtype=np.int64)
+        imm = np.zeros(size, dtype=np.int64)
+        target = np.zeros(size, dtype=np.int64)
+        for p, program in enumerate(self.code.programs):
+            if self.code.errors[p] is not None:
+                continue  # its lanes fail before running
+            base = self.code.bases[p]
+            for index, instr in enumerate(program):
+                at = base + index
+                kind[at] = KIND_IO if uses_io(instr) else (instr.dec_op << 4) | instr.op
+                rs1[at], rs2[at], rd[at], imm[at] = instr.rs1, instr.rs2, instr.rd, instr.imm & MASK
+                if instr.dec_op == DecOp.BRANCH:
+                    target[at] = base + instr.imm // 2
+        self.kind, self.rs1, self.rs2, self.rd, self.imm, self.target = kind, rs1, rs2, rd, imm, target
+
+    def reset(self, inputs: Optional[Sequence[Iterable[int]]] = None) -> None:
+        if inputs is not None:
+            if len(inputs) != self.lanes:
+                raise ValueError(f'{len(inputs)} input sets for {self.lanes} lanes')
+            self.input_sets = [list(values) for values in inputs]
+        # One row per register, one column per lane
+        self.registers = np.zeros((8, self.lanes), dtype=np.uint16)
+        self.memory = np.zeros((self.lanes, self.memory_words), dtype=np.uint16)
+        self.pc = self.code_base.copy()
+        self.counts = np.zeros(self.count_size, dtype=np.int64)
+        self.status = np.full(self.lanes, RUNNING, dtype=np.uint8)
+        self.errors: List[Optional[SimulationError]] = [None] * self.lanes
+        self.outputs: List[List[int]] = [[] for _ in range(self.lanes)]
+        self.inputs: List[Iterator[int]] = [iter(values) for values in self.input_sets]
+        self.io_reads = [0] * self.lanes
+        for lane, p in enumerate(self.program_of):
+            if self.code.errors[p] is not None:
+                self.fail(lane, self.code.errors[p])
+
+    def fail(self, lane: int, message: str) -> None:
+        self.status[lane] = FAILED
+        self.lanes_changed = True
+        self.errors[lane] = SimulationError(message)
+
+    def run(self, max_steps: int = DEFAULT_MAX_STEPS) -> BatchResult:
+        # All running lanes step together, so each has executed exactly lockstep_steps
+        # instructions (counting the halt, as the scalar simulator does)
+        started = time.perf_counter()
+        lockstep_steps = 0
+        all_lanes = np.arange(self.lanes)
+        count_offset = self.count_base - self.code_base
+        self.lanes_changed = True
+        while True:
+            if self.lanes_changed:
+                lanes = np.flatnonzero(self.status == RUNNING)
+                full = lanes.size == self.lanes
+                self.lanes_changed = False
+            if not lanes.size:
+                break
+            if lockstep_steps >= max_steps:
+                for lane in lanes.tolist():
+                    offset = (int(self.pc[lane]) - int(self.code_base[lane])) * 2
+                    self.fail(lane, f'Step limit {max_steps} reached at offset {offset}')
+                break
+
+            pcs = self.pc if full else self.pc[lanes]
+            self.counts[(count_offset if full else count_offset[lanes]) + pcs] += 1
+            first = pcs[0]
+            if (pcs == first).all():
+                # Common case for lanes running one program: a single instruction
+                self.execute(int(self.kind[first]), all_lanes if full else lanes, pcs, int(first), full)
+            else:
+                kinds = self.kind[pcs]
+                for kind in np.unique(kinds):
+                    group = kinds == kind
+                    self.execute(int(kind), lanes[group], pcs[group], None, False)
+            lockstep_steps += 1
+        elapsed = time.perf_counter() - started
+        return self.collect(elapsed, lockstep_steps)
+
+    def execute(self, kind: int, lanes, pcs, pc: Optional[int], full: bool) -> None:
+        # pc is set when every lane of the group is at the same instruction, and full when
+        # the group is every lane, in which case whole register rows are used
+        if kind == KIND_HALT:
+            self.status[lanes] = HALTED
+            self.lanes_changed = True
+            return
+        if kind == KIND_IO:
+            for lane, at in zip(lanes.tolist(), pcs.tolist()):
+                self.pc[lane] = self.execute_io(lane, at)
+            return
+
+        dec_op, op = kind >> 4, kind & 0b1111
+        regs = self.registers
+        columns = slice(None) if full else lanes
+
+        def read(fields):
+            if pc is not None:
+                return regs[fields[pc], columns].astype(np.int64)
+            return regs[fields[pcs], lanes].astype(np.int64)
+
+        def write(fields, values) -> None:
+            if pc is not None:
+                regs[fields[pc], columns] = values
+            else:
+                regs[fields[pcs], lanes] = values
+
+        if dec_op == DecOp.BRANCH:
+            target = self.target[pc] if pc is not None else self.target[pcs]
+            if op != BranchOp.JUMP:
+                target = np.where(vector_condition(op, read(self.rs1), read(self.rs2)), target, pcs + 1)
+            self.pc[columns] = target
+            return
+
+        if dec_op in (DecOp.CALC_REG, DecOp.CALC_IMM):
+            b = (self.imm[pc] if pc is not None else self.imm[pcs]) if dec_op == DecOp.CALC_IMM else read(self.rs2)
+            write(self.rd, vector_alu(op, read(self.rs1), b).astype(np.uint16))
+        else:
+            addresses = regs[MAR, columns].astype(np.int64)
+            outside = addresses >= self.memory_words
+            if outside.any():
+                for lane, address in zip(lanes[outside].tolist(), addresses[outside].tolist()):
+                    self.fail(lane, f'Address {address} is outside the {self.memory_words} word batch memory')
+                lanes, pcs, addresses = lanes[~outside], pcs[~outside], addresses[~outside]
+                columns, full = lanes, False
+            if dec_op == DecOp.MEM_LOAD:
+                write(self.rd, self.memory[lanes, addresses])
+            else:
+                self.memory[lanes, addresses] = regs[self.rs1[pc], columns] if pc is not None \
+                    else regs[self.rs1[pcs], lanes]
+        self.pc[columns] = pcs + 1
+
+    def read_input(self, lane: int) -> int:
+        self.io_reads[lane] += 1
+        return next(self.inputs[lane], 0) & MASK
+
+    def execute_io(self, lane: int, pc: int) -> int:
+        # One instruction of one lane, in the scalar simulator's order of IO accesses
+        instr = self.code.instructions[pc]
+        regs = self.registers[:, lane]
+
+        def read(register: int) -> int:
+            return self.read_input(lane) if register == IO else int(regs[register])
+
+        def write(register: int, value: int) -> None:
+            if register == IO:
+                self.outputs[lane].append(value)
+            else:
+                regs[register] = value
+
+        if instr.dec_op in (DecOp.CALC_REG, DecOp.CALC_IMM):
+            a = read(instr.rs1)
+            b = instr.imm & MASK if instr.dec_op == DecOp.CALC_IMM else read(instr.rs2)
+            write(instr.rd, ALU_FUNCTIONS[instr.op](a, b))
+            return pc + 1
+        if instr.dec_op == DecOp.BRANCH:
+            a, b = read(instr.rs1), read(instr.rs2)
+            return int(self.target[pc]) if BRANCH_CONDITIONS[instr.op](a, b) else pc + 1
+
+        address = int(regs[MAR])
+        if address >= self.memory_words:
+            self.fail(lane, f'Address {address} is outside the {self.memory_words} word batch memory')
+            return pc
+        if instr.dec_op == DecOp.MEM_LOAD:
+            write(instr.rd, int(self.memory[lane, address]))
+        else:
+            self.memory[lane, address] = read(instr.rs1)
+        return pc + 1
+
+    def collect(self, elapsed: float, lockstep_steps: int) -> BatchResult:
+        results: List[Optional[SimResult]] = []
+        # Results always carry the full memory, as the scalar simulator's do
+        memory_tail = [0] * (MEMORY_WORDS - self.memory_words)
+        for lane in range(self.lanes):
+            if self.status[lane] != HALTED:
+                results.append(None)
+                continue
+            program = self.code.programs[self.program_of[lane]]
+            start = int(self.count_base[lane])
+            counts = self.counts[start:start + len(program)].tolist()
+            memory = self.memory[lane].tolist() + memory_tail
+            results.append(SimResult(
+                output=list(self.outputs[lane]),
+                registers=self.registers[:, lane].tolist(),
+                memory=memory,
+                stats=collect_stats(program, counts, elapsed, self.io_reads[lane], len(self.outputs[lane]))
+            ))
+        return BatchResult(results=results, errors=list(self.errors), seconds=elapsed,
+                           lockstep_steps=lockstep_steps)
+
+
+def check_program(program: List[DecodedInstruction]) -> Optional[str]:
+    # The error Simulator raises while compiling this program, if any
+    for index, instr in enumerate(program):
+        if instr.dec_op in (DecOp.CALC_REG, DecOp.CALC_IMM):
+            if instr.op not in ALU_FUNCTIONS:
+                return f'Cannot simulate {instr!r}'
+        elif instr.dec_op == DecOp.MEM_LOAD and instr.op == MemOp.LOAD:
+            pass
+        elif instr.dec_op == DecOp.MEM_STOR and instr.op == MemOp.STOR:
+            pass
+        elif instr.dec_op == DecOp.BRANCH:
+            target = instr.imm // 2
+            if instr.imm % 2 or not 0 <= target < len(program) + 1:
+                return f'Branch target {instr.imm} is outside the program'
+            if instr.op not in BRANCH_CONDITIONS:
+                return f'Cannot simulate {instr!r}'
+        else:
+            return f'Cannot simulate {instr!r} at offset {index * 2}'
+    return None
+
+
+def uses_io(instr: DecodedInstruction) -> bool:
+    if instr.dec_op == DecOp.CALC_IMM:
+        return IO in (instr.rs1, instr.rd)
+    elif instr.dec_op == DecOp.CALC_REG:
+        return IO in (instr.rs1, instr.rs2, instr.rd)
+    elif instr.dec_op == DecOp.MEM_LOAD:
+        return instr.rd == IO
+    elif instr.dec_op == DecOp.MEM_STOR:
+        return instr.rs1 == IO
+    return instr.op != BranchOp.JUMP and IO in (instr.rs1, instr.rs2)
+
+
+# sim.alu over int64 arrays of operands in 0..MASK
+def vector_alu(op: int, a, b):
+    if op == ALUOp.ADD:
+        return (a + b) & MASK
+    elif op == ALUOp.SUB:
+        return (a - b) & MASK
+    elif op == ALUOp.AND:
+        return a & b
+    elif op == ALUOp.OR:
+        return a | b
+    elif op == ALUOp.NOT:
+        return ~a & MASK
+    elif op == ALUOp.XOR:
+        return a ^ b
+    elif op == ALUOp.SHL:
+        # Shift counts are clamped: NumPy shifts by 64 or more are undefined
+        return (a << np.minimum(b, 16)) & MASK
+    elif op == ALUOp.SHR:
+        return a >> np.minimum(b, 16)
+    elif op == ALUOp.MUL:
+        return (a * b) & MASK
+    elif op == ALUOp.MULH:
+        return (a * b) >> 16
+    elif op == ALUOp.DIV:
+        return np.where(b != 0, a // np.maximum(b, 1), MASK)
+    elif op == ALUOp.DIVH:
+        return np.where(b != 0, a % np.maximum(b, 1), a)
+    elif op == ALUOp.MOV:
+        return b
+    elif op == ALUOp.ROL:
+        b = b & 15
+        return ((a << b) | (a >> (16 - b))) & MASK
+    elif op == ALUOp.ROR:
+        b = b & 15
+        return ((a >> b) | (a << (16 - b))) & MASK
+    raise NotImplementedError(f'ALU operation {op} is not defined')
+
+
+def vector_condition(op: int, a, b):
+    if op in (BranchOp.BLE, BranchOp.BLT, BranchOp.BGE, BranchOp.BGT):
+        # Flipping the sign bit maps signed order onto unsigned order
+        a, b = a ^ 0x8000, b ^ 0x8000
+    if op in (BranchOp.BLE, BranchOp.BLEU):
+        return a <= b
+    elif op in (BranchOp.BLT, BranchOp.BLTU):
+        return a < b
+    elif op in (BranchOp.BGE, BranchOp.BGEU):
+        return a >= b
+    elif op in (BranchOp.BGT, BranchOp.BGTU):
+        return a > b
+    elif op == BranchOp.BEQ:
+        return a == b
+    elif op == BranchOp.BNE:
+        return a != b
+    raise NotImplementedError(f'Branch operation {op} is not defined')
+
+
+def simulate_batch(programs: Sequence[Sequence[EncodedWord]],
+                   inputs: Optional[Sequence[Iterable[int]]] = None,
+                   max_steps: int = DEFAULT_MAX_STEPS) -> BatchResult:
+    return BatchSimulator(programs, inputs).run(max_steps)
+
+
+__all__ = ['BatchSimulator', 'BatchResult', 'simulate_batch']
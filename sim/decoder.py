@@ -0,0 +1,74 @@
+from dataclasses import dataclass
+from enum import IntEnum
+from functools import lru_cache
+from typing import Iterable, List, Type
+
+from backend.encoder import EncodedWord
+from backend.isa import ALUOp, BranchOp, CallRetOp, DecOp, MemOp, Register
+
+
+# One (word, imm) pair split back into the fields Encoder.encode packs:
+# (dec_op << 13) | (op << 9) | (rs1 << 6) | (rs2 << 3) | rd
+@dataclass(frozen=True)
+class DecodedInstruction:
+    __slots__ = ('dec_op', 'op', 'rs1', 'rs2', 'rd', 'imm')
+    dec_op: int
+    op: int
+    rs1: int
+    rs2: int
+    rd: int
+    imm: int
+
+    def mnemonic(self) -> str:
+        return mnemonic(self.dec_op, self.op)
+
+    def __repr__(self):
+        return (f"DecodedInstruction({self.mnemonic()}, rs1={Register(self.rs1).name}, "
+                f"rs2={Register(self.rs2).name}, rd={Register(self.rd).name}, imm={self.imm})")
+
+
+@lru_cache(maxsize=None)
+def mnemonic(dec_op: int, op: int) -> str:
+    return f'{DecOp(dec_op).name} {op_enum(dec_op)(op).name}'
+
+
+def op_enum(dec_op: int) -> Type[IntEnum]:
+    if dec_op in (DecOp.CALC_REG, DecOp.CALC_IMM):
+        return ALUOp
+    elif dec_op in (DecOp.MEM_LOAD, DecOp.MEM_STOR):
+        return MemOp
+    elif dec_op == DecOp.BRANCH:
+        return BranchOp
+    elif dec_op == DecOp.CALL_RET:
+        return CallRetOp
+    raise NotImplementedError(f'Unknown decode operation {dec_op:03b}')
+
+
+def decode(encoded: EncodedWord) -> DecodedInstruction:
+    word, imm = encoded
+    return DecodedInstruction(
+        dec_op=(word >> 13) & 0b111,
+        op=(word >> 9) & 0b1111,
+        rs1=(word >> 6) & 0b111,
+        rs2=(word >> 3) & 0b111,
+        rd=word & 0b111,
+        imm=imm
+    )
+
+
+def decode_program(words: Iterable[EncodedWord]) -> List[DecodedInstruction]:
+    return [decode(encoded) for encoded in words]
+
+
+def read_words(path: str) -> List[EncodedWord]:
+    # The "<word> <imm>" per line format driver.batch writes
+    words = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                word, imm = line.split()
+                words.append((int(word), int(imm)))
+    return words
+
+
+__all__ = ['DecodedInstruction', 'decode', 'decode_program', 'op_enum', 'read_words']
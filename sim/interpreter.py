@@ -0,0 +1,288 @@
+from __future__ import annotations
+
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from itertools import repeat
+from typing import Callable, Dict, Iterable, Iterator, List
+
+from backend.encoder import EncodedWord
+from backend.isa import ALUOp, BranchOp, DecOp, MemOp, Register
+from sim.alu import ALU_FUNCTIONS, BRANCH_CONDITIONS, MASK
+from sim.decoder import DecodedInstruction, decode_program
+
+import logging
+
+logger = logging.getLogger('Simulator')
+
+MEMORY_WORDS = 1 << 16
+DEFAULT_MAX_STEPS = 100_000_000
+
+MAR = int(Register.MAR)
+IO = int(Register.IO)
+
+Step = Callable[[], int]
+
+
+class SimulationError(Exception):
+    pass
+
+
+class _Halt(Exception):
+    pass
+
+
+@dataclass
+class SimStats:
+    instructions: int = 0
+    by_opcode: Dict[str, int] = field(default_factory=dict)
+    loads: int = 0
+    stores: int = 0
+    branches: int = 0
+    io_reads: int = 0
+    io_writes: int = 0
+    seconds: float = 0.0
+
+    @property
+    def memory_traffic(self) -> int:
+        return self.loads + self.stores
+
+    @property
+    def instructions_per_second(self) -> float:
+        return self.instructions / self.seconds if self.seconds else 0.0
+
+
+@dataclass
+class SimResult:
+    output: List[int]
+    registers: List[int]
+    memory: List[int]
+    stats: SimStats
+
+
+def collect_stats(program: List[DecodedInstruction],
+                  counts: List[int],
+                  elapsed: float,
+                  io_reads: int,
+                  io_writes: int) -> SimStats:
+    # counts[i] is how many times program[i] executed
+    stats = SimStats(instructions=sum(counts), seconds=elapsed, io_reads=io_reads, io_writes=io_writes)
+    by_opcode: Counter = Counter()
+    for instr, count in zip(program, counts):
+        if not count:
+            continue
+        by_opcode[instr.mnemonic()] += count
+        if instr.dec_op == DecOp.MEM_LOAD:
+            stats.loads += count
+        elif instr.dec_op == DecOp.MEM_STOR:
+            stats.stores += count
+        elif instr.dec_op == DecOp.BRANCH:
+            stats.branches += count
+    stats.by_opcode = dict(by_opcode.most_common())
+    return stats
+
+
+# Decode-and-dispatch interpreter for encoded LEG-16 programs.
+#
+# The program is decoded once into one closure per instruction. A closure performs its
+# instruction on the shared register and memory lists and returns the index of the next
+# instruction, so the run loop is just `pc = steps[pc]()`. Branch targets are byte offsets
+# (two per instruction, as LabelAllocator records them); running off the end halts.
+#
+# Registers R0-R5 and MAR live in `registers`; writing IO appends to the output, reading
+# IO takes the next input value (0 once inputs run out). Every value is kept in 0..0xFFFF.
+class Simulator:
+    def __init__(self, words: Iterable[EncodedWord], inputs: Iterable[int] = ()) -> None:
+        self.program: List[DecodedInstruction] = decode_program(words)
+        self.registers: List[int] = [0] * 8
+        self.memory: List[int] = [0] * MEMORY_WORDS
+        self.output: List[int] = []
+        self.inputs: Iterator[int] = iter(inputs)
+        self.io_reads = 0
+        self.steps: List[Step] = [self.compile_step(index, instr) for index, instr in enumerate(self.program)]
+        self.steps.append(self.halt)
+
+    def reset(self, inputs: Iterable[int] = ()) -> None:
+        # In place: the compiled steps hold references to these lists
+        self.registers[:] = [0] * 8
+        self.memory[:] = [0] * MEMORY_WORDS
+        self.output.clear()
+        self.inputs = iter(inputs)
+        self.io_reads = 0
+
+    def run(self, max_steps: int = DEFAULT_MAX_STEPS) -> SimResult:
+        steps = self.steps
+        counts = [0] * len(steps)
+        pc = 0
+        started = time.perf_counter()
+        try:
+            for _ in repeat(None, max_steps):
+                counts[pc] += 1
+                pc = steps[pc]()
+            raise SimulationError(f'Step limit {max_steps} reached at offset {pc * 2}')
+        except _Halt:
+            pass
+        elapsed = time.perf_counter() - started
+        counts.pop()
+        return SimResult(
+            output=list(self.output),
+            registers=list(self.registers),
+            memory=self.memory,
+            stats=collect_stats(self.program, counts, elapsed, self.io_reads, len(self.output))
+        )
+
+    def halt(self) -> int:
+        raise _Halt()
+
+    def read_input(self) -> int:
+        self.io_reads += 1
+        return next(self.inputs, 0) & MASK
+
+    def compile_step(self, index: int, instr: DecodedInstruction) -> Step:
+        if instr.dec_op in (DecOp.CALC_REG, DecOp.CALC_IMM):
+            return self.compile_calc(index + 1, instr)
+        elif instr.dec_op == DecOp.MEM_LOAD and instr.op == MemOp.LOAD:
+            return self.compile_load(index + 1, instr)
+        elif instr.dec_op == DecOp.MEM_STOR and instr.op == MemOp.STOR:
+            return self.compile_store(index + 1, instr)
+        elif instr.dec_op == DecOp.BRANCH:
+            return self.compile_branch(index + 1, instr)
+        raise SimulationError(f'Cannot simulate {instr!r} at offset {index * 2}')
+
+    def reader(self, register: int) -> Callable[[], int]:
+        registers = self.registers
+        if register == IO:
+            return self.read_input
+        return lambda: registers[register]
+
+    def writer(self, register: int) -> Callable[[int], None]:
+        registers = self.registers
+        if register == IO:
+            return self.output.append
+
+        def write(value: int) -> None:
+            registers[register] = value
+        return write
+
+    def compile_calc(self, nxt: int, instr: DecodedInstruction) -> Step:
+        function = ALU_FUNCTIONS.get(instr.op)
+        if function is None:
+            raise SimulationError(f'Cannot simulate {instr!r}')
+        regs = self.registers
+        op, a, b, rd = instr.op, instr.rs1, instr.rs2, instr.rd
+        imm_mode = instr.dec_op == DecOp.CALC_IMM
+        imm = instr.imm & MASK
+
+        if IO in (a, rd) or (not imm_mode and b == IO):
+            # Rare: generic form through reader/writer callables
+            read_a = self.reader(a)
+            read_b = (lambda: imm) if imm_mode else self.reader(b)
+            write = self.writer(rd)
+
+            def step() -> int:
+                write(function(read_a(), read_b()))
+                return nxt
+            return step
+
+        # Specialized closures for the instructions the compiler emits most
+        if imm_mode and op == ALUOp.MOV:
+            def step() -> int:
+                regs[rd] = imm
+                return nxt
+        elif imm_mode and op == ALUOp.ADD:
+            def step() -> int:
+                regs[rd] = (regs[a] + imm) & 0xFFFF
+                return nxt
+        elif imm_mode and op == ALUOp.SUB:
+            def step() -> int:
+                regs[rd] = (regs[a] - imm) & 0xFFFF
+                return nxt
+        elif imm_mode:
+            def step() -> int:
+                regs[rd] = function(regs[a], imm)
+                return nxt
+        elif op == ALUOp.MOV:
+            def step() -> int:
+                regs[rd] = regs[b]
+                return nxt
+        elif op == ALUOp.ADD:
+            def step() -> int:
+                regs[rd] = (regs[a] + regs[b]) & 0xFFFF
+                return nxt
+        elif op == ALUOp.SUB:
+            def step() -> int:
+                regs[rd] = (regs[a] - regs[b]) & 0xFFFF
+                return nxt
+        else:
+            def step() -> int:
+                regs[rd] = function(regs[a], regs[b])
+                return nxt
+        return step
+
+    def compile_load(self, nxt: int, instr: DecodedInstruction) -> Step:
+        regs, memory, rd = self.registers, self.memory, instr.rd
+        if rd == IO:
+            output = self.output
+
+            def step() -> int:
+                output.append(memory[regs[MAR]])
+                return nxt
+            return step
+
+        def step() -> int:
+            regs[rd] = memory[regs[MAR]]
+            return nxt
+        return step
+
+    def compile_store(self, nxt: int, instr: DecodedInstruction) -> Step:
+        regs, memory, rs1 = self.registers, self.memory, instr.rs1
+        if rs1 == IO:
+            read = self.read_input
+
+            def step() -> int:
+                memory[regs[MAR]] = read()
+                return nxt
+            return step
+
+        def step() -> int:
+            memory[regs[MAR]] = regs[rs1]
+            return nxt
+        return step
+
+    def compile_branch(self, nxt: int, instr: DecodedInstruction) -> Step:
+        target = instr.imm // 2
+        if instr.imm % 2 or not 0 <= target < len(self.program) + 1:
+            raise SimulationError(f'Branch target {instr.imm} is outside the program')
+        condition = BRANCH_CONDITIONS.get(instr.op)
+        if condition is None:
+            raise SimulationError(f'Cannot simulate {instr!r}')
+        if instr.op == BranchOp.JUMP:
+            return lambda: target
+
+        regs, a, b = self.registers, instr.rs1, instr.rs2
+        if IO in (a, b):
+            read_a, read_b = self.reader(a), self.reader(b)
+            return lambda: target if condition(read_a(), read_b()) else nxt
+        if instr.op == BranchOp.BEQ:
+            return lambda: target if regs[a] == regs[b] else nxt
+        elif instr.op == BranchOp.BNE:
+            return lambda: target if regs[a] != regs[b] else nxt
+        elif instr.op in (BranchOp.BLE, BranchOp.BLT, BranchOp.BGE, BranchOp.BGT):
+            # Flipping the sign bit maps signed order onto unsigned order
+            if instr.op == BranchOp.BLE:
+                return lambda: target if regs[a] ^ 0x8000 <= regs[b] ^ 0x8000 else nxt
+            elif instr.op == BranchOp.BLT:
+                return lambda: target if regs[a] ^ 0x8000 < regs[b] ^ 0x8000 else nxt
+            elif instr.op == BranchOp.BGE:
+                return lambda: target if regs[a] ^ 0x8000 >= regs[b] ^ 0x8000 else nxt
+            return lambda: target if regs[a] ^ 0x8000 > regs[b] ^ 0x8000 else nxt
+        return lambda: target if condition(regs[a], regs[b]) else nxt
+
+
+def simulate(words: Iterable[EncodedWord],
+             inputs: Iterable[int] = (),
+             max_steps: int = DEFAULT_MAX_STEPS) -> SimResult:
+    return Simulator(words, inputs).run(max_steps)
+
+
+__all__ = ['Simulator', 'SimResult', 'SimStats', 'SimulationError', 'simulate', 'MEMORY_WORDS']
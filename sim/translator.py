@@ -0,0 +1,410 @@
+from __future__ import annotations
+
+import hashlib
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional, Tuple
+
+from backend.encoder import EncodedWord
+from backend.isa import ALUOp, BranchOp, DecOp, MemOp
+from sim.alu import ALU_FUNCTIONS, BRANCH_CONDITIONS, MASK, alu
+from sim.decoder import DecodedInstruction, decode_program
+from sim.interpreter import (DEFAULT_MAX_STEPS, IO, MAR, MEMORY_WORDS, SimResult, SimulationError,
+                             collect_stats)
+
+import logging
+
+logger = logging.getLogger('Translator')
+
+REGISTER_NAMES = ('r0', 'r1', 'r2', 'r3', 'r4', 'r5', 'mar')
+TRANSLATION_CACHE_SIZE = 64
+# Blocks up to this many instructions are inlined into the blocks that flow into them
+INLINE_BLOCK_SIZE = 16
+
+# Python expression per ALU operation over operand expressions a and b, matching sim.alu
+ALU_TEMPLATES: Dict[int, str] = {
+    ALUOp.ADD: '({a} + {b}) & 0xFFFF',
+    ALUOp.SUB: '({a} - {b}) & 0xFFFF',
+    ALUOp.AND: '{a} & {b}',
+    ALUOp.OR: '{a} | {b}',
+    ALUOp.NOT: '~{a} & 0xFFFF',
+    ALUOp.XOR: '{a} ^ {b}',
+    ALUOp.SHL: '(({a} << {b}) & 0xFFFF if {b} < 16 else 0)',
+    ALUOp.SHR: '{a} >> {b}',
+    ALUOp.MUL: '({a} * {b}) & 0xFFFF',
+    ALUOp.MULH: '({a} * {b}) >> 16',
+    ALUOp.DIV: '({a} // {b} if {b} else 0xFFFF)',
+    ALUOp.DIVH: '({a} % {b} if {b} else {a})',
+    ALUOp.MOV: '{b}',
+    ALUOp.ROL: 'rol({a}, {b})',
+    ALUOp.ROR: 'ror({a}, {b})',
+}
+
+# Signed compares flip the sign bit, which maps signed order onto unsigned order
+BRANCH_TEMPLATES: Dict[int, str] = {
+    BranchOp.BLE: '{a} ^ 0x8000 <= {b} ^ 0x8000',
+    BranchOp.BLT: '{a} ^ 0x8000 < {b} ^ 0x8000',
+    BranchOp.BGE: '{a} ^ 0x8000 >= {b} ^ 0x8000',
+    BranchOp.BGT: '{a} ^ 0x8000 > {b} ^ 0x8000',
+    BranchOp.BLEU: '{a} <= {b}',
+    BranchOp.BLTU: '{a} < {b}',
+    BranchOp.BGEU: '{a} >= {b}',
+    BranchOp.BGTU: '{a} > {b}',
+    BranchOp.BEQ: '{a} == {b}',
+    BranchOp.BNE: '{a} != {b}',
+}
+
+
+@dataclass
+class Block:
+    index: int
+    start: int
+    end: int  # exclusive
+    successors: Tuple[int, ...] = ()
+
+
+@dataclass
+class Translation:
+    blocks: List[Block]
+    source: str
+    run: Callable
+
+
+# Binary translator: the second execution engine, with the same observable behavior as
+# sim.interpreter.Simulator (output, registers, memory and statistics).
+#
+# The program is split into basic blocks at branch targets and after branches. All blocks
+# become one generated Python function in which the registers are locals, each block is a
+# straight run of assignments, and block exits are native ifs that set the next block id.
+# Blocks are selected through a binary tree of comparisons on that id; small blocks are
+# inlined into the blocks that jump to them, and a block that branches back to itself (a
+# compiled loop body) iterates in a native while loop without going through dispatch.
+# Within a region, registers set from constants (MAR in particular) are folded into the
+# expressions that read them and written back only if they are live at the exit.
+#
+# Statistics are exact: per-block entry counts times each block's instructions.
+# Translations are cached by a hash of the encoded program.
+class TranslatingSimulator:
+    def __init__(self, words: Iterable[EncodedWord], inputs: Iterable[int] = ()) -> None:
+        words = list(words)
+        self.program: List[DecodedInstruction] = decode_program(words)
+        self.memory: List[int] = [0] * MEMORY_WORDS
+        self.registers: List[int] = [0] * 8
+        self.output: List[int] = []
+        self.inputs: Iterator[int] = iter(inputs)
+        self.io_reads = 0
+        self.translation = translate(words, self.program)
+
+    def reset(self, inputs: Iterable[int] = ()) -> None:
+        self.registers = [0] * 8
+        self.memory[:] = [0] * MEMORY_WORDS
+        self.output = []
+        self.inputs = iter(inputs)
+        self.io_reads = 0
+
+    def read_input(self) -> int:
+        self.io_reads += 1
+        return next(self.inputs, 0) & MASK
+
+    def run(self, max_steps: int = DEFAULT_MAX_STEPS) -> SimResult:
+        blocks = self.translation.blocks
+        block_counts = [0] * len(blocks)
+        started = time.perf_counter()
+        registers = self.translation.run(self.memory, self.output.append, self.read_input,
+                                         block_counts, max_steps, tuple(self.registers[:7]))
+        elapsed = time.perf_counter() - started
+        if registers is None:
+            raise SimulationError(f'Step limit {max_steps} reached')
+        self.registers = list(registers) + [0]
+
+        counts = [0] * len(self.program)
+        for block, count in zip(blocks, block_counts):
+            if count:
+                counts[block.start:block.end] = [count] * (block.end - block.start)
+        return SimResult(
+            output=list(self.output),
+            registers=list(self.registers),
+            memory=self.memory,
+            stats=collect_stats(self.program, counts, elapsed, self.io_reads, len(self.output))
+        )
+
+
+_translations: Dict[str, Translation] = {}
+
+
+def program_hash(words: List[EncodedWord]) -> str:
+    digest = hashlib.sha256()
+    for word, imm in words:
+        digest.update(f'{word} {imm}\n'.encode('ascii'))
+    return digest.hexdigest()
+
+
+def translate(words: List[EncodedWord], program: Optional[List[DecodedInstruction]] = None) -> Translation:
+    key = program_hash(words)
+    translation = _translations.get(key)
+    if translation is not None:
+        logger.debug('Translation cache hit %s', key)
+        return translation
+    if program is None:
+        program = decode_program(words)
+
+    blocks = split_blocks(program)
+    source = generate_source(program, blocks)
+    namespace = {'rol': ALU_FUNCTIONS[ALUOp.ROL], 'ror': ALU_FUNCTIONS[ALUOp.ROR]}
+    exec(compile(source, f'<leg16 {key[:12]}>', 'exec'), namespace)
+    translation = Translation(blocks=blocks, source=source, run=namespace['run'])
+
+    if len(_translations) >= TRANSLATION_CACHE_SIZE:
+        _translations.pop(next(iter(_translations)))
+    _translations[key] = translation
+    return translation
+
+
+def branch_target(program: List[DecodedInstruction], index: int) -> int:
+    instr = program[index]
+    target = instr.imm // 2
+    if instr.imm % 2 or not 0 <= target <= len(program):
+        raise SimulationError(f'Branch target {instr.imm} is outside the program')
+    return target
+
+
+def split_blocks(program: List[DecodedInstruction]) -> List[Block]:
+    leaders = {0}
+    for index, instr in enumerate(program):
+        if instr.dec_op == DecOp.BRANCH:
+            leaders.add(branch_target(program, index))
+            leaders.add(index + 1)
+    starts = sorted(leader for leader in leaders if leader < len(program))
+    ends = starts[1:] + [len(program)]
+    block_of = {start: i for i, start in enumerate(starts)}
+    # Falling or branching to the end of the program halts: block id len(starts)
+    block_of[len(program)] = len(starts)
+
+    blocks = []
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        last = program[end - 1]
+        if last.dec_op != DecOp.BRANCH:
+            successors = (block_of[end],)
+        elif last.op == BranchOp.JUMP:
+            successors = (block_of[branch_target(program, end - 1)],)
+        else:
+            successors = (block_of[branch_target(program, end - 1)], block_of[end])
+        blocks.append(Block(index=i, start=start, end=end, successors=successors))
+    return blocks
+
+
+def register_uses(instr: DecodedInstruction) -> Tuple[Tuple[int, ...], Tuple[int, ...]]:
+    # (registers read, registers written), IO excluded
+    if instr.dec_op == DecOp.CALC_IMM:
+        reads, writes = (instr.rs1,) if instr.op != ALUOp.MOV else (), (instr.rd,)
+    elif instr.dec_op == DecOp.CALC_REG:
+        reads, writes = (instr.rs1, instr.rs2), (instr.rd,)
+    elif instr.dec_op == DecOp.MEM_LOAD:
+        reads, writes = (MAR,), (instr.rd,)
+    elif instr.dec_op == DecOp.MEM_STOR:
+        reads, writes = (MAR, instr.rs1), ()
+    elif instr.dec_op == DecOp.BRANCH and instr.op != BranchOp.JUMP:
+        reads, writes = (instr.rs1, instr.rs2), ()
+    else:
+        reads, writes = (), ()
+    return tuple(r for r in reads if r != IO), tuple(r for r in writes if r != IO)
+
+
+def live_registers(program: List[DecodedInstruction], blocks: List[Block]) -> List[FrozenSet[int]]:
+    # Registers live on entry to each block. Everything is live at the halt, where the
+    # final register values are part of the result.
+    all_registers = frozenset(range(len(REGISTER_NAMES)))
+    uses, defs = [], []
+    for block in blocks:
+        used, defined = set(), set()
+        for instr in program[block.start:block.end]:
+            reads, writes = register_uses(instr)
+            used.update(r for r in reads if r not in defined)
+            defined.update(writes)
+        uses.append(used)
+        defs.append(defined)
+
+    live_in = [frozenset()] * len(blocks) + [all_registers]
+    changed = True
+    while changed:
+        changed = False
+        for block in reversed(blocks):
+            live_out = frozenset().union(*(live_in[successor] for successor in block.successors))
+            new = frozenset(uses[block.index] | (live_out - defs[block.index]))
+            if new != live_in[block.index]:
+                live_in[block.index] = new
+                changed = True
+    return live_in
+
+
+class _RegionWriter:
+    # Python statements for one region: a block plus the small blocks it jumps into.
+    # Registers assigned constants are kept as literals and only written to their locals
+    # when the region exits and the register is live there.
+    def __init__(self, indent: str) -> None:
+        self.indent = indent
+        self.lines: List[str] = []
+        self.consts: Dict[int, int] = {}
+        self.io_reads = 0
+
+    def emit(self, line: str) -> None:
+        self.lines.append(self.indent + line)
+
+    def read(self, register: int) -> str:
+        if register == IO:
+            name = f'io{self.io_reads}'
+            self.io_reads += 1
+            self.emit(f'{name} = read_input()')
+            return name
+        if register in self.consts:
+            return str(self.consts[register])
+        return REGISTER_NAMES[register]
+
+    def write(self, register: int, expression: str, const: Optional[int] = None) -> None:
+        if register == IO:
+            self.emit(f'emit({expression})')
+        elif const is not None:
+            self.consts[register] = const
+        else:
+            self.consts.pop(register, None)
+            self.emit(f'{REGISTER_NAMES[register]} = {expression}')
+
+    def flush(self, live: FrozenSet[int]) -> None:
+        for register in sorted(self.consts):
+            if register in live:
+                self.emit(f'{REGISTER_NAMES[register]} = {self.consts[register]}')
+        self.consts = {}
+
+    def calc(self, instr: DecodedInstruction) -> None:
+        template = ALU_TEMPLATES.get(instr.op)
+        if template is None:
+            raise SimulationError(f'Cannot simulate {instr!r}')
+        # MOV ignores its first operand, but an IO first operand still consumes an input
+        a = '0' if instr.op == ALUOp.MOV and instr.rs1 != IO else self.read(instr.rs1)
+        b = str(instr.imm & MASK) if instr.dec_op == DecOp.CALC_IMM else self.read(instr.rs2)
+        if a.isdigit() and b.isdigit():
+            # Both operands known: evaluate now with the simulator's own ALU
+            value = alu(instr.op, int(a), int(b))
+            self.write(instr.rd, str(value), const=value)
+        else:
+            self.write(instr.rd, template.format(a=a, b=b))
+
+    def load(self, instr: DecodedInstruction) -> None:
+        self.write(instr.rd, f'memory[{self.read(MAR)}]')
+
+    def store(self, instr: DecodedInstruction) -> None:
+        address = self.read(MAR)
+        self.emit(f'memory[{address}] = {self.read(instr.rs1)}')
+
+    def condition(self, instr: DecodedInstruction) -> str:
+        template = BRANCH_TEMPLATES.get(instr.op)
+        if template is None:
+            raise SimulationError(f'Cannot simulate {instr!r}')
+        return template.format(a=self.read(instr.rs1), b=self.read(instr.rs2))
+
+    def body(self, program: List[DecodedInstruction], block: Block) -> Optional[DecodedInstruction]:
+        # Emits every instruction but a final branch, which is returned
+        for index in range(block.start, block.end):
+            instr = program[index]
+            if instr.dec_op in (DecOp.CALC_REG, DecOp.CALC_IMM):
+                self.calc(instr)
+            elif instr.dec_op == DecOp.MEM_LOAD and instr.op == MemOp.LOAD:
+                self.load(instr)
+            elif instr.dec_op == DecOp.MEM_STOR and instr.op == MemOp.STOR:
+                self.store(instr)
+            elif instr.dec_op == DecOp.BRANCH and BRANCH_CONDITIONS.get(instr.op) is not None:
+                return instr
+            else:
+                raise SimulationError(f'Cannot simulate {instr!r} at offset {index * 2}')
+        return None
+
+
+def region_of(blocks: List[Block], block: Block) -> List[Block]:
+    # The block followed by the chain of small single-successor blocks it flows into
+    region = [block]
+    while len(region[-1].successors) == 1:
+        successor = region[-1].successors[0]
+        if successor >= len(blocks) or successor == block.index or blocks[successor] in region:
+            break
+        following = blocks[successor]
+        if following.end - following.start > INLINE_BLOCK_SIZE:
+            break
+        region.append(following)
+    return region
+
+
+def region_lines(program: List[DecodedInstruction], blocks: List[Block], live_in: List[FrozenSet[int]],
+                 block: Block, indent: str) -> List[str]:
+    region = region_of(blocks, block)
+    last = region[-1]
+    successors = last.successors
+    live_out = frozenset().union(*(live_in[successor] for successor in successors))
+    size = sum(b.end - b.start for b in region)
+    self_loop = block.index in successors
+
+    writer = _RegionWriter(indent + '    ' if self_loop else indent)
+    if self_loop:
+        # The hot shape of compiled loops: iterate natively instead of through dispatch
+        writer.lines.append(indent + 'while True:')
+    for b in region:
+        writer.emit(f'counts[{b.index}] += 1')
+    writer.emit(f'budget -= {size}')
+    writer.emit('if budget <= 0:')
+    writer.emit('    return None')
+    branch = None
+    for b in region:
+        branch = writer.body(program, b)
+
+    if branch is None or branch.op == BranchOp.JUMP:
+        writer.flush(live_out)
+        if not self_loop:
+            writer.emit(f'block = {successors[0]}')
+        return writer.lines
+
+    condition = writer.condition(branch)
+    writer.flush(live_out)
+    taken, fallthrough = successors
+    if not self_loop:
+        writer.emit(f'block = {taken} if {condition} else {fallthrough}')
+    elif taken == block.index and fallthrough == block.index:
+        pass
+    elif taken == block.index:
+        writer.emit(f'if not ({condition}):')
+        writer.emit(f'    block = {fallthrough}')
+        writer.emit('    break')
+    else:
+        writer.emit(f'if {condition}:')
+        writer.emit(f'    block = {taken}')
+        writer.emit('    break')
+    return writer.lines
+
+
+def dispatch_tree(program: List[DecodedInstruction], blocks: List[Block], live_in: List[FrozenSet[int]],
+                  entries: List[Block], indent: str, out: List[str]) -> None:
+    # Selects among the entry blocks by halving the range of their ids
+    if len(entries) == 1:
+        out.extend(region_lines(program, blocks, live_in, entries[0], indent))
+        return
+    middle = len(entries) // 2
+    out.append(f'{indent}if block < {entries[middle].index}:')
+    dispatch_tree(program, blocks, live_in, entries[:middle], indent + '    ', out)
+    out.append(f'{indent}else:')
+    dispatch_tree(program, blocks, live_in, entries[middle:], indent + '    ', out)
+
+
+def generate_source(program: List[DecodedInstruction], blocks: List[Block]) -> str:
+    lines = [
+        'def run(memory, emit, read_input, counts, budget, registers):',
+        '    r0, r1, r2, r3, r4, r5, mar = registers',
+        '    block = 0',
+        f'    while block != {len(blocks)}:',
+    ]
+    if blocks:
+        dispatch_tree(program, blocks, live_registers(program, blocks), blocks, '        ', lines)
+    else:
+        lines.append('        break')
+    lines.append('    return r0, r1, r2, r3, r4, r5, mar')
+    return '\n'.join(lines) + '\n'
+
+
+__all__ = ['TranslatingSimulator', 'Translation', 'translate', 'split_blocks', 'program_hash']
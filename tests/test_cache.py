@@ -0,0 +1,101 @@
+import io
+import tempfile
+import unittest
+from unittest import mock
+
+from driver.cache import CompilationCache, cache_key
+from driver.compiler import CompileOptions, Compiler
+
+LONG_SOURCE = 'var y = 3;\nvar x = ' + ' + '.join(['y'] * 3000) + ';\n'
+
+
+class CacheKeyTest(unittest.TestCase):
+    def test_key_depends_on_compiler_sources(self):
+        # A persistent cache directory must not serve entries of another compiler version
+        with mock.patch('driver.cache.compiler_fingerprint', return_value='one'):
+            first = cache_key('var a = 1;', 'options')
+        with mock.patch('driver.cache.compiler_fingerprint', return_value='two'):
+            second = cache_key('var a = 1;', 'options')
+        self.assertNotEqual(first, second)
+
+    def test_key_depends_on_source_and_options(self):
+        key = cache_key('var a = 1;', 'options')
+        self.assertEqual(key, cache_key('var a = 1;', 'options'))
+        self.assertNotEqual(key, cache_key('var a = 2;', 'options'))
+        self.assertNotEqual(key, cache_key('var a = 1;', 'other options'))
+
+
+class CacheCountersTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_hits_and_misses(self):
+        cache = CompilationCache(self.directory.name)
+        self.assertIsNone(cache.get('a' * 64))
+        cache.put('a' * 64, [(1, 2)])
+        self.assertEqual(cache.get('a' * 64), [(1, 2)])
+        cache.clear_memory()
+        self.assertEqual(cache.get('a' * 64), [(1, 2)])
+        self.assertEqual(cache.get('a' * 64), [(1, 2)])
+        stats = cache.stats
+        self.assertEqual((stats.hits, stats.misses, stats.memory_hits, stats.disk_hits, stats.stores),
+                         (3, 1, 2, 1, 1))
+        self.assertAlmostEqual(stats.hit_rate, 0.75)
+
+    def test_memory_is_least_recently_used(self):
+        cache = CompilationCache(max_memory_entries=2)
+        for key in ('a', 'b'):
+            cache.put(key * 64, [key])
+        cache.get('a' * 64)
+        cache.put('c' * 64, ['c'])
+        self.assertEqual(list(cache.memory), ['a' * 64, 'c' * 64])
+        self.assertIsNone(cache.get('b' * 64))
+
+    def test_disk_eviction(self):
+        cache = CompilationCache(self.directory.name, max_disk_bytes=1000)
+        for index in range(20):
+            cache.put(f'{index:064x}', [(index, 0)] * 20)
+        self.assertGreater(cache.stats.evictions, 0)
+        self.assertLessEqual(cache.scan_disk_bytes(), 1000)
+        # The newest entry survives eviction
+        cache.clear_memory()
+        self.assertEqual(cache.get(f'{19:064x}'), [(19, 0)] * 20)
+
+
+class CompilerCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_long_expression_is_stored_and_served_from_disk(self):
+        cache = CompilationCache(self.directory.name)
+        words = Compiler(cache=cache).compile(LONG_SOURCE)
+        self.assertEqual((cache.stats.stores, cache.stats.store_failures), (1, 0))
+        fresh = CompilationCache(self.directory.name)
+        self.assertEqual(Compiler(cache=fresh).compile(LONG_SOURCE), words)
+        self.assertEqual(fresh.stats.disk_hits, 1)
+
+    def test_store_failure_does_not_fail_the_compile(self):
+        cache = CompilationCache(self.directory.name)
+        with mock.patch.object(CompilationCache, 'write_disk', side_effect=OSError('disk full')):
+            words = Compiler(cache=cache).compile('var a = 1;')
+        self.assertEqual(words, Compiler().compile('var a = 1;'))
+        self.assertEqual(cache.stats.store_failures, 1)
+
+    def test_dumps_do_not_depend_on_a_warm_cache(self):
+        options = CompileOptions(dump_stages=True, select_instructions=True)
+        cache = CompilationCache(self.directory.name)
+        Compiler(cache=cache).compile('var a = 1;\nvar b = a * 4;')
+        dumps = []
+        for _ in range(2):
+            out = io.StringIO()
+            Compiler(options, out=out, cache=cache).compile('var a = 1;\nvar b = a * 4;')
+            dumps.append(out.getvalue())
+        self.assertIn('isel_program', dumps[0])
+        self.assertEqual(dumps[0], dumps[1])
+        self.assertEqual(cache.stats.hits, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
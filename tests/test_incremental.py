@@ -0,0 +1,49 @@
+import unittest
+
+from driver.compiler import compile
+from driver.incremental import IncrementalCompiler
+from sim.interpreter import Simulator
+
+SOURCE = '''var n = 5;
+var s = 0;
+while n > 0:{
+    var s = s + n;
+    var n = n - 1;
+}
+if s > 10:{ var t = 1; } else { var t = 2; }
+var m = 3;
+while m > 0:{ var m = m - 1; }
+'''
+
+
+class IncrementalCompilerTest(unittest.TestCase):
+    def test_edits_match_a_full_compile(self):
+        compiler = IncrementalCompiler()
+        for source in (SOURCE,
+                       SOURCE.replace('var n = 5;', 'var n = 7;'),
+                       SOURCE.replace('var s = 0;', 'var s = 0;\nvar extra = 2;\nvar s = s + extra;'),
+                       SOURCE):
+            with self.subTest(source=source):
+                self.assertEqual(compiler.compile(source), compile(source))
+
+    def test_inserted_statement_relocates_the_rest(self):
+        # No new names and the free registers left in the same order: every old statement
+        # is reused, the later ones with their branch targets moved past the inserted code
+        compiler = IncrementalCompiler()
+        compiler.compile(SOURCE)
+        edited = SOURCE.replace('var s = 0;', 'var s = 0;\nvar n = 6;')
+        words = compiler.compile(edited)
+        self.assertEqual(words, compile(edited))
+        self.assertEqual(compiler.stats.rebuilt, 6 + 1)
+        self.assertEqual(compiler.stats.reused, 6)
+        self.assertEqual(Simulator(words).run().memory[:2], [0, 21])
+
+    def test_unchanged_source_is_all_reused(self):
+        compiler = IncrementalCompiler()
+        compiler.compile(SOURCE)
+        self.assertEqual(compiler.compile(SOURCE), compile(SOURCE))
+        self.assertEqual((compiler.stats.reused, compiler.stats.rebuilt), (6, 6))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,26 @@
+import unittest
+
+from frontend.lexer import Lexer
+
+
+class IdentifierTest(unittest.TestCase):
+    # The grammar of the original master pattern: [a-zA-Z_]\w* with a Unicode \w
+    def test_non_ascii_letters_after_the_first(self):
+        source = 'var café = 1;\nvar b = café;'
+        tokens = list(Lexer(source).token_stream())
+        self.assertEqual(tokens[1], ('IDENT', 'café'))
+        self.assertEqual(tokens, Lexer(source).tokenize())
+        self.assertEqual(tokens, Lexer(source).tokenize_master_pattern())
+
+    def test_ascii_source_matches_master_pattern(self):
+        source = 'var a = 1; // comment\nwhile a < 10:{ var a = a << 1; }'
+        self.assertEqual(list(Lexer(source).token_stream()), Lexer(source).tokenize_master_pattern())
+
+    def test_non_ascii_first_letter_is_an_error(self):
+        for source in ('var é = 1;', 'var a = 1;\nvar b€ = 2;'):
+            with self.assertRaises(RuntimeError):
+                Lexer(source).token_stream()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+
+from frontend.lexer import Lexer
+from frontend.parser import Parser
+from frontend.symbol_table import SemanticAnalyzer
+from ir.builder import IRBuilder
+from ir.memopt import optimize_memory
+from ir.program import ProgrammIRInstruction
+
+# b = b at the start of a block: the store is forwarded away, the load feeding it stays.
+# c is written in the loop but overwritten after it, so it is dead at the loop's exit.
+SOURCE = '''
+var a = 3;
+var b = 2;
+var n = 4;
+while n > 0:{
+    var c = n;
+    var n = n - 1;
+}
+var b = b;
+var c = 5;
+var r = a + n + c;
+'''
+
+
+def build(source: str) -> ProgrammIRInstruction:
+    ast = Parser(Lexer(source).token_stream()).parse_program()
+    analyzer = SemanticAnalyzer()
+    analyzer.visit(ast)
+    return IRBuilder(symbol_table=analyzer.table).build_program(ast)
+
+
+class MemoryOptimizationTest(unittest.TestCase):
+    # The Lowerer's register allocator expects every temp it is given to be read
+    def test_every_written_temp_is_read(self):
+        program, stats = optimize_memory(build(SOURCE))
+        self.assertGreater(stats.forwarded + stats.dead_stores, 0)
+        self.assertGreater(stats.promoted, 0)
+        read = {temp.id for instr in program.instructions for temp in instr.used_temps()}
+        for instr in program.instructions:
+            for temp in instr.defined_temps():
+                self.assertIn(temp.id, read, instr)
+
+
+if __name__ == '__main__':
+    unittest.main()
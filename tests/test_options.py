@@ -0,0 +1,94 @@
+import pathlib
+import unittest
+
+from benchmarks.generator import SHAPES, generate
+from driver.compiler import CompileOptions, compile
+from frontend.lexer import Lexer
+from frontend.parser import Parser
+from frontend.symbol_table import SemanticAnalyzer
+from sim.interpreter import Simulator
+
+EXAMPLES = pathlib.Path(__file__).resolve().parent.parent / 'examples'
+
+# Constant operands for strength reduction and selection, a branch constant folding
+# decides, loads value numbering reuses and a variable only ever stored in the loop
+ARITHMETIC_SOURCE = '''
+var n = 0;
+var a = 0;
+var q = 0;
+var r = 0;
+var dead = 0;
+while n < 300:{
+    var q = q + n / 7 + n / 10 - n % 6 + n % 16;
+    var r = r ^ n * 9 - n * 12 + n >> 2;
+    if 3 > 4:{
+        var q = 0;
+    }
+    var a = a + r * q + r * q;
+    var dead = n;
+    var n = n + 37;
+}
+print q
+print r
+print a
+'''
+
+FLAGS = {
+    'ssa': CompileOptions(ssa=True),
+    'fold_constants': CompileOptions(fold_constants=True),
+    'optimize_memory': CompileOptions(optimize_memory=True),
+    'value_numbering': CompileOptions(value_numbering=True),
+    'peephole': CompileOptions(peephole=True),
+    'select_instructions': CompileOptions(select_instructions=True),
+    'reduce_strength': CompileOptions(reduce_strength=True),
+    'packed_ir': CompileOptions(packed_ir=True),
+    'no_reorder_operands': CompileOptions(reorder_operands=False),
+    'spill_all': CompileOptions(register_allocator='spill_all'),
+    'everything': CompileOptions(ssa=True, fold_constants=True, optimize_memory=True, value_numbering=True,
+                                 peephole=True, select_instructions=True, reduce_strength=True),
+}
+
+
+def sources() -> dict:
+    named = {path.name: path.read_text() for path in sorted(EXAMPLES.glob('*.leg'))}
+    named['arithmetic'] = ARITHMETIC_SOURCE
+    for shape in SHAPES:
+        named[shape] = generate(shape, 80, seed=2)
+    return named
+
+
+def variable_count(source: str) -> int:
+    analyzer = SemanticAnalyzer()
+    analyzer.visit(Parser(Lexer(source).token_stream()).parse_program())
+    return analyzer.table.next_slot
+
+
+def observable(source: str, options: CompileOptions) -> tuple:
+    # Output and the final value of every variable; registers, spill slots and the
+    # instruction counts are the optimizations' to change
+    result = Simulator(compile(source, options)).run()
+    return result.output, result.memory[:variable_count(source)]
+
+
+class CompileOptionsTest(unittest.TestCase):
+    # Every optimization and code generation choice computes what the unoptimized build does
+    def test_flags_match_unoptimized_build(self):
+        for name, source in sources().items():
+            expected = observable(source, CompileOptions())
+            for flag, options in FLAGS.items():
+                with self.subTest(program=name, flag=flag):
+                    self.assertEqual(observable(source, options), expected)
+
+    def test_flags_change_the_code(self):
+        # The arithmetic source gives every pass something to do, so the comparison above
+        # cannot pass by a flag being ignored. The packed IR lowers to the same code.
+        unoptimized = compile(ARITHMETIC_SOURCE)
+        for flag, options in FLAGS.items():
+            if flag != 'packed_ir':
+                with self.subTest(flag=flag):
+                    self.assertNotEqual(compile(ARITHMETIC_SOURCE, options), unoptimized)
+        self.assertEqual(compile(ARITHMETIC_SOURCE, FLAGS['packed_ir']), unoptimized)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import itertools
+import unittest
+
+from driver.compiler import compile
+from driver.incremental import IncrementalCompiler
+from frontend.ast_leg import BinaryOp, VarRef
+from frontend.lexer import Lexer
+from frontend.parser import BINARY_PRECEDENCE, Parser
+from frontend.token_stream import KIND_TEXT
+from sim.alu import MASK
+from sim.interpreter import Simulator
+
+# Operator text to binding power, as the parser reads it
+PRECEDENCE = {KIND_TEXT[kind]: level for kind, level in BINARY_PRECEDENCE.items()}
+
+
+def run(source: str) -> list:
+    return Simulator(compile(source)).run().memory
+
+
+def parse_expr(text: str):
+    return Parser(Lexer(f'var x = {text};').token_stream()).parse_program().statements[0].expr
+
+
+class PrecedenceTest(unittest.TestCase):
+    # Every pair of binary operators: the tighter one groups first, and equal ones group
+    # from the left
+    def test_precedence_table(self):
+        a, b, c = VarRef('a'), VarRef('b'), VarRef('c')
+        for first, second in itertools.product(PRECEDENCE, repeat=2):
+            with self.subTest(first=first, second=second):
+                if PRECEDENCE[second] > PRECEDENCE[first]:
+                    expected = BinaryOp(a, first, BinaryOp(b, second, c))
+                else:
+                    expected = BinaryOp(BinaryOp(a, first, b), second, c)
+                self.assertEqual(parse_expr(f'a {first} b {second} c'), expected)
+
+    def test_same_order_as_python(self):
+        # The operators LEG-16 shares with Python bind the same way, so Python computes
+        # the expected values
+        for text in ('2 + 3 * 4', '20 - 6 / 2 - 1', '1 << 2 + 1', '7 & 3 | 8 ^ 12', '30 % 7 * 2',
+                     '1 | 2 << 3 & 255', '100 >> 2 >> 1'):
+            with self.subTest(text=text):
+                self.assertEqual(run(f'var x = {text};')[0], eval(text.replace('/', '//')) & MASK)
+
+
+class LongExpressionTest(unittest.TestCase):
+    # Every stage walks expressions without recursion, so chains far past the recursion
+    # limit compile and run like short ones
+    def test_long_plus_chain(self):
+        source = 'var y = 3;\nvar x = ' + ' + '.join(['y'] * 3000) + ';\n'
+        self.assertEqual(run(source)[1], 3 * 3000 & MASK)
+
+    def test_long_not_chain(self):
+        # Two ~ cancel out, so 5001 of them give what one gives
+        self.assertEqual(run('var y = 3;\nvar x = ' + '~' * 5001 + 'y;\n')[1], run('var y = 3;\nvar x = ~y;\n')[1])
+
+    def test_incremental_recompile(self):
+        source = 'var y = 3;\nvar x = ' + ' - '.join(['y'] * 3000) + ';\n'
+        compiler = IncrementalCompiler()
+        compiler.compile(source)
+        words = compiler.compile(source + 'var z = x;\n')
+        self.assertEqual(compiler.stats.reused, 2)
+        self.assertEqual(Simulator(words).run().memory[2], 3 - 3 * 2999 & MASK)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+
+from backend.encoder import Encoder
+from backend.lowerer import Lowerer
+from frontend.lexer import Lexer
+from frontend.parser import Parser
+from frontend.symbol_table import SemanticAnalyzer
+from ir.builder import IRBuilder
+from ir.instructions import ConstIRInstruction, LoadIRInstruction, StoreIRInstruction
+from ir.program import ProgrammIRInstruction
+from ir.values import IRConst, IRSlot, IRTemp
+from sim.interpreter import Simulator
+
+# Without operand reordering every left operand of these chains stays live while the
+# right side is computed: seven or eight values for six registers
+SOURCE = '''
+var h = 1234;
+var s = 7;
+var t = 3;
+var i = 0;
+while i < 20:{
+    var t = s | i ^ h & t << 1 + i % 3;
+    var s = s + t * 3 == s | i ^ h & t >> 1 + i % 3;
+    print t
+    var i = i + 1;
+}
+'''
+
+
+def run(source: str, reorder_operands: bool, register_allocator: str):
+    ast = Parser(Lexer(source).token_stream()).parse_program()
+    analyzer = SemanticAnalyzer()
+    analyzer.visit(ast)
+    program = IRBuilder(symbol_table=analyzer.table, reorder_operands=reorder_operands).build_program(ast)
+    lowerer = Lowerer(program, register_allocator=register_allocator)
+    result = Simulator(Encoder().encode_program(lowered_program=lowerer.lower())).run()
+    return lowerer.register_allocator.stats, result.output, result.memory[:analyzer.table.next_slot]
+
+
+class SpillingTest(unittest.TestCase):
+    def test_spilled_code_matches_unspilled_code(self):
+        stats, output, variables = run(SOURCE, reorder_operands=True, register_allocator='linear_scan')
+        self.assertEqual(stats.spilled_temps, 0)
+        for allocator in ('linear_scan', 'spill_all'):
+            with self.subTest(register_allocator=allocator):
+                spilled = run(SOURCE, reorder_operands=False, register_allocator=allocator)
+                self.assertGreater(spilled[0].spilled_temps, 0)
+                self.assertEqual(spilled[1:], (output, variables))
+
+    def test_linear_scan_spills_less_than_spill_all(self):
+        linear_scan = run(SOURCE, reorder_operands=False, register_allocator='linear_scan')[0]
+        spill_all = run(SOURCE, reorder_operands=False, register_allocator='spill_all')[0]
+        self.assertLess(linear_scan.spilled_temps, spill_all.spilled_temps)
+        self.assertLess(linear_scan.reloads, spill_all.reloads)
+
+    def test_unread_temps_under_pressure(self):
+        # Ten loads nothing reads, then eight constants for six registers: the loads give
+        # their registers back at once, so only the constants past the sixth are spilled
+        slots = [IRSlot(index, f's{index}') for index in range(10)]
+        instructions = [LoadIRInstruction(src=slots[index], dst=IRTemp(index)) for index in range(10)]
+        instructions += [ConstIRInstruction(src=IRConst.of(index), dst=IRTemp(20 + index)) for index in range(8)]
+        instructions += [StoreIRInstruction(src=IRTemp(20 + index), dst=slots[index]) for index in range(8)]
+        lowerer = Lowerer(ProgrammIRInstruction(instructions=instructions, slots=slots))
+        result = Simulator(Encoder().encode_program(lowered_program=lowerer.lower())).run()
+        self.assertEqual(lowerer.register_allocator.stats.spilled_temps, 2)
+        self.assertEqual(result.memory[:8], list(range(8)))
+
+
+if __name__ == '__main__':
+    unittest.main()
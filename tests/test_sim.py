@@ -0,0 +1,85 @@
+import pathlib
+import unittest
+
+from benchmarks.generator import SHAPES, generate
+from driver.compiler import compile
+from sim.batch import np, simulate_batch
+from sim.interpreter import SimResult, SimulationError, Simulator
+from sim.translator import TranslatingSimulator
+
+EXAMPLES = pathlib.Path(__file__).resolve().parent.parent / 'examples'
+
+# Output, a loop whose exit depends on memory, and a branch skipped on every other pass
+LOOP_SOURCE = '''
+var i = 0;
+var s = 0;
+while i < 40:{
+    if i % 3 == 0:{
+        var s = s + i;
+        print s
+    } else {
+        var s = s ^ i;
+    }
+    var i = i + 1;
+}
+print s
+'''
+
+
+def programs() -> dict:
+    sources = {path.name: path.read_text() for path in sorted(EXAMPLES.glob('*.leg'))}
+    sources['loop'] = LOOP_SOURCE
+    for shape in SHAPES:
+        sources[shape] = generate(shape, 60, seed=1)
+    return {name: compile(source) for name, source in sources.items()}
+
+
+def observable(result: SimResult) -> tuple:
+    return (result.output, result.registers, result.memory, result.stats.instructions,
+            result.stats.by_opcode, result.stats.loads, result.stats.stores, result.stats.branches)
+
+
+class TranslatingSimulatorTest(unittest.TestCase):
+    # Same output, machine state and executed instruction counts as the interpreter
+    def test_matches_interpreter(self):
+        for name, words in programs().items():
+            with self.subTest(program=name):
+                self.assertEqual(observable(TranslatingSimulator(words).run()),
+                                 observable(Simulator(words).run()))
+
+    def test_step_limit(self):
+        words = compile(LOOP_SOURCE)
+        for simulator in (Simulator(words), TranslatingSimulator(words)):
+            with self.subTest(simulator=type(simulator).__name__):
+                with self.assertRaises(SimulationError):
+                    simulator.run(max_steps=50)
+
+
+@unittest.skipIf(np is None, 'the batch simulator requires numpy')
+class BatchSimulatorTest(unittest.TestCase):
+    # Lanes running different programs diverge at once; each must match the interpreter
+    def test_matches_interpreter(self):
+        named = programs()
+        batch = simulate_batch(list(named.values()))
+        self.assertEqual(batch.failed, [])
+        for (name, words), result in zip(named.items(), batch.results):
+            with self.subTest(program=name):
+                self.assertEqual(observable(result), observable(Simulator(words).run()))
+
+    def test_step_limit_fails_only_long_lanes(self):
+        named = programs()
+        batch = simulate_batch(list(named.values()), max_steps=500)
+        for (name, words), result, error in zip(named.items(), batch.results, batch.errors):
+            with self.subTest(program=name):
+                try:
+                    expected = Simulator(words).run(max_steps=500)
+                except SimulationError:
+                    self.assertIsNone(result)
+                    self.assertIsInstance(error, SimulationError)
+                    continue
+                self.assertIsNone(error)
+                self.assertEqual(observable(result), observable(expected))
+
+
+if __name__ == '__main__':
+    unittest.main()